@@ -0,0 +1,210 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmark the construction of footprint tables
+
+Builds synthetic source catalogs of increasing size and times
+`lsst.display.firefly.footprints.createFootprintsTable`, and the extraction
+of the footprint columns with and without the per-record loop it replaced,
+and measures the peak resident memory of converting each catalog to an
+astropy table by copying it (``copy=True``, as was done before) and by
+viewing its columns (``copy=False``). Then it times the largest catalog
+with several worker processes and in each upload encoding::
+
+    python benchmarks/bench_footprints.py --sizes 1000 10000 100000 --workers 1 4 16
+"""
+
+import argparse
+import functools
+import io
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import lsst.geom as geom
+import lsst.afw.detection as afwDetect
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.display.firefly import fitsWriter, footprints
+
+
+def makeCatalog(nSources, width=4000, height=4000, seed=1):
+    """Make a source catalog with circular footprints
+
+    About a third of the sources are deblended children of the parents
+    listed before them.
+    """
+    rng = np.random.default_rng(seed)
+    schema = afwTable.SourceTable.makeMinimalSchema()
+    schema.addField("deblend_nChild", type=np.int32, doc="number of children")
+    centroidKey = afwTable.Point2DKey.addFields(schema, "slot_Centroid", "centroid", "pixel")
+    nChildKey = schema["deblend_nChild"].asKey()
+    catalog = afwTable.SourceCatalog(schema)
+    catalog.reserve(nSources)
+
+    xs = rng.uniform(0, width, nSources)
+    ys = rng.uniform(0, height, nSources)
+    radii = rng.integers(2, 12, nSources)
+    nParents = 0
+    for x, y, r in zip(xs, ys, radii):
+        record = catalog.addNew()
+        center = geom.Point2I(int(x), int(y))
+        spans = afwGeom.SpanSet.fromShape(int(r), afwGeom.Stencil.CIRCLE, offset=center)
+        footprint = afwDetect.Footprint(spans)
+        footprint.addPeak(x, y, 1.0)
+        if nParents and rng.random() < 0.3:
+            parent = catalog[int(rng.integers(0, nParents))]
+            record.setParent(parent.getId())
+            parent.set(nChildKey, parent.get(nChildKey) + 1)
+        else:
+            nParents += 1
+        record.setFootprint(footprint)
+        record.set(centroidKey, geom.Point2D(x, y))
+    return catalog
+
+
+def loopFootprintColumns(catalog, xy0=(0, 0)):
+    """Extract the footprint columns one record at a time"""
+    x0, y0 = xy0
+    spans, peaks, corners = [], [], []
+    for record in catalog:
+        footprint = record.getFootprint()
+        spans.append(np.ma.MaskedArray([(s.getY() - y0, s.getX0() - x0, s.getX1() - x0)
+                                        for s in footprint.getSpans()]).ravel())
+        peaks.append(np.ma.MaskedArray([(p.getFx() - x0, p.getFy() - y0)
+                                        for p in footprint.getPeaks()]).ravel())
+        box = footprint.getBBox()
+        corners.append((box.getMinX() - x0, box.getMinY() - y0, box.getMaxX() - x0, box.getMaxY() - y0))
+    return spans, peaks, corners
+
+
+def timeCall(func, *args, repeat=3):
+    """Return the best wall-clock time of ``repeat`` calls"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def encode(catalog, tableFormat):
+    """Return the footprints table of ``catalog`` as bytes in ``tableFormat``"""
+    with io.BytesIO() as fd:
+        if tableFormat == "votable":
+            footprints.createFootprintsTable(catalog).to_xml(fd)
+        elif tableFormat == "fits":
+            fitsWriter.writeFits(fd, [footprints.createFootprintsHdu(catalog)])
+        else:
+            footprints.writeArrowTable(fd, footprints.createFootprintsArrow(catalog), tableFormat)
+        return fd.getvalue()
+
+
+def copiedAstropy(catalog):
+    """Convert a catalog to astropy by deep-copying it and its columns, as
+    createFootprintsTable did before it viewed them
+    """
+    copied = afwTable.SourceCatalog(catalog.table.clone())
+    copied.extend(catalog, deep=True)
+    return copied.asAstropy(copy=True)
+
+
+def _maxRss():
+    """Return the peak resident memory of this process in bytes"""
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss if sys.platform == "darwin" else 1024*maxRss
+
+
+def _peakRss(nSources, copy):
+    """Return how much converting a new catalog to astropy raises the peak
+    resident memory of this process; see `peakRss`
+    """
+    catalog = makeCatalog(nSources)
+    before = _maxRss()
+    table = copiedAstropy(catalog) if copy else footprints.catalogAsAstropy(catalog)
+    after = _maxRss()
+    del table
+    return after - before
+
+
+def peakRss(nSources, copy):
+    """Return the increase in peak resident memory, in bytes, of converting
+    a catalog of ``nSources`` to an astropy table, copied or viewed
+
+    Unlike tracemalloc this includes the memory allocated by afw. Each
+    measurement is made in a new process, so that it does not start at
+    the peak of an earlier one.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_peakRss, nSources, copy).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="catalog sizes to time")
+    parser.add_argument("--repeat", type=int, default=3, help="timings per measurement")
+    parser.add_argument("--skip-loop", action="store_true",
+                        help="do not time the per-record loop (slow for large catalogs)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16],
+                        help="worker counts to time on the largest catalog")
+    args = parser.parse_args()
+
+    print(f"{'sources':>10} {'loop (s)':>10} {'arrays (s)':>11} {'table (s)':>10} {'us/source':>10}"
+          f" {'copy RSS (MiB)':>15} {'view RSS (MiB)':>15}")
+    for n in args.sizes:
+        catalog = makeCatalog(n)
+        loop = float("nan")
+        if not args.skip_loop:
+            loop = timeCall(loopFootprintColumns, catalog, repeat=args.repeat)
+        arrays = timeCall(footprints.extractFootprintArrays, catalog, repeat=args.repeat)
+        table = timeCall(footprints.createFootprintsTable, catalog, repeat=args.repeat)
+        copied = peakRss(n, copy=True)/2**20
+        viewed = peakRss(n, copy=False)/2**20
+        print(f"{n:>10} {loop:>10.3f} {arrays:>11.3f} {table:>10.3f} {1e6*table/n:>10.1f}"
+              f" {copied:>15.1f} {viewed:>15.1f}")
+
+    print(f"\n{'workers':>10} {'table (s)':>10} {'speedup':>8}  ({n} sources)")
+    serial = None
+    for nWorkers in args.workers:
+        table = timeCall(functools.partial(footprints.createFootprintsTable, nWorkers=nWorkers), catalog,
+                         repeat=args.repeat)
+        serial = serial or table
+        print(f"{nWorkers:>10} {table:>10.3f} {serial/table:>8.2f}")
+
+    print(f"\n{'encoding':>10} {'write (s)':>10} {'size (MiB)':>11}  ({n} sources)")
+    for tableFormat in footprints.TABLE_FORMATS:
+        try:
+            size = len(encode(catalog, tableFormat))
+        except RuntimeError as e:  # e.g. no pyarrow
+            print(f"{tableFormat:>10} skipped: {e}")
+            continue
+        seconds = timeCall(encode, catalog, tableFormat, repeat=args.repeat)
+        print(f"{tableFormat:>10} {seconds:>10.3f} {size/2**20:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Batching of the actions dispatched to Firefly
+
+Firefly's ``pushAction`` command carries a single action per request, so
+the actions of a batch are pipelined instead: requests that do not depend
+on one another are in flight at the same time, and a batch of actions on
+many mask layers takes about as long as a single round trip.
+"""
+
+__all__ = ["ActionBatch"]
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class ActionBatch:
+    """Actions waiting to be dispatched to Firefly
+
+    Actions are dispatched as soon as they are added, unless within
+    `batch`.  Actions added with the same key, e.g. those acting on the same
+    layer, are dispatched in the order they were added; actions with
+    different keys are dispatched concurrently.
+
+    Each thread has batches of its own: the actions a thread adds within a
+    batch are dispatched by that thread when its outermost batch ends,
+    whatever batches other threads, e.g. those of other frames, have open.
+
+    Parameters:
+    -----------
+    nThreads : `int`
+        Maximum number of requests in flight at once
+    """
+
+    def __init__(self, nThreads=8):
+        self.nThreads = nThreads
+        self._local = threading.local()
+
+    def _state(self):
+        """Return the calling thread's batch, with its ``depth`` and its
+        ``pending`` actions keyed as for `add`
+        """
+        state = self._local
+        if not hasattr(state, "pending"):
+            state.depth = 0
+            state.pending = {}
+        return state
+
+    def __len__(self):
+        return sum(len(calls) for calls in self._state().pending.values())
+
+    @property
+    def held(self):
+        """Whether the calling thread's actions are kept until the end of
+        its batch
+        """
+        return self._state().depth > 0
+
+    def add(self, key, func, *args, **kwargs):
+        """Dispatch an action, or queue it within a batch
+
+        Parameters:
+        -----------
+        key : hashable
+            Actions with the same key are dispatched in order
+        func : callable
+            Called with ``args`` and ``kwargs`` to dispatch the action,
+            e.g. a method of `firefly_client.FireflyClient`
+
+        Returns:
+        --------
+        result
+            What ``func`` returns, or None if the action was queued
+        """
+        state = self._state()
+        if state.depth == 0:
+            return func(*args, **kwargs)
+        state.pending.setdefault(key, []).append((func, args, kwargs))
+
+    def flush(self):
+        """Dispatch the calling thread's pending actions, and wait for them
+        to complete
+
+        Raises:
+        -------
+        Exception
+            The first error raised by an action, once all have completed;
+            the other actions with the same key are not dispatched.
+        """
+        state = self._state()
+        pending = list(state.pending.values())
+        state.pending = {}
+        if not pending:
+            return
+        if self.nThreads > 1 and len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.nThreads, len(pending))) as pool:
+                errors = list(pool.map(_runCalls, pending))
+        else:
+            errors = [_runCalls(calls) for calls in pending]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def clear(self):
+        """Discard the calling thread's pending actions without dispatching
+        them
+        """
+        self._state().pending = {}
+
+    @contextmanager
+    def batch(self):
+        """Queue the actions the calling thread adds within the block, and
+        dispatch them at its end
+
+        Batches may be nested; the actions are dispatched when the
+        outermost block exits.
+        """
+        state = self._state()
+        state.depth += 1
+        try:
+            yield self
+        finally:
+            state.depth -= 1
+            if state.depth == 0:
+                self.flush()
+
+
+def _runCalls(calls):
+    """Make the calls in order, stopping at the first error, which is
+    returned
+    """
+    for func, args, kwargs in calls:
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            return e
+    return None
@@ -0,0 +1,120 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def contentKey(buffers):
+    """Return a content hash for a sequence of bytes-like objects
+
+    Parameters:
+    -----------
+    buffers : iterable of bytes-like
+        Buffers to hash, in order; may be a generator, so that content
+        too large to hold in memory can be hashed a block at a time.
+
+    Returns:
+    --------
+    `str`
+        Hex digest identifying the concatenated content
+    """
+    digest = hashlib.sha256()
+    for buf in buffers:
+        digest.update(buf)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """Least-recently-used map from content keys to Firefly server handles
+
+    Entries are charged a size in bytes (normally the size of the upload
+    they stand for), and the least recently used entries are evicted once
+    the total exceeds ``maxBytes``.
+
+    Parameters:
+    -----------
+    maxBytes : `int`
+        Maximum total size of the entries; 0 disables the cache.
+    """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self._totalBytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def totalBytes(self):
+        """Total size in bytes of the cached entries"""
+        return self._totalBytes
+
+    def get(self, key):
+        """Return the value cached for ``key``, or None
+
+        A hit marks the entry as most recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        """Cache ``value`` under ``key``, charging it ``nbytes``
+
+        Entries larger than ``maxBytes`` are not cached.
+        """
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.maxBytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._totalBytes += nbytes
+            while self._totalBytes > self.maxBytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._totalBytes -= evicted
+
+    def invalidate(self, key=None):
+        """Drop the entry for ``key``, or every entry if ``key`` is None
+
+        Call with no argument when the Firefly server session is reset, as
+        the server handles held by the cache are then no longer valid.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._totalBytes = 0
+            else:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._totalBytes -= entry[1]
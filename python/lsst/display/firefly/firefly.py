@@ -20,17 +20,38 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import functools
 import logging
+import multiprocessing
+import os
+import threading
+import urllib.parse
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 from io import BytesIO
 from socket import gaierror
 
+import numpy as np
+import requests
+from astropy.io import fits
+
 import lsst.afw.display.interface as interface
 import lsst.afw.display.virtualDevice as virtualDevice
 import lsst.afw.display.ds9Regions as ds9Regions
 import lsst.afw.display as afwDisplay
-import lsst.afw.math as afwMath
 
-from .footprints import createFootprintsTable
+from . import fitsWriter, upload
+from .batching import ActionBatch
+from .frameQueue import FrameQueue
+from .cache import UploadCache, contentKey
+from .footprints import (catalogFingerprint, createCatalogTable, createFootprintsTable, createFootprintsHdu,
+                         extractFootprintArrays, footprintBBoxes, footprintOutlines, FootprintGridIndex,
+                         iterFootprintsTables, selectCatalog, subsetCatalog, createFootprintsArrow,
+                         writeArrowTable, TABLE_FORMATS)
+from .masks import compositeMaskPlanes, usedMaskBits
+from .regions import (boxRegions, dotRegions, lineRegions, polygonRegions, RegionBuffer, simplifyPolylines,
+                      splitAlpha)
 
 try:
     import firefly_client
@@ -41,6 +62,96 @@ from ws4py.client import HandshakeError
 
 _LOG = logging.getLogger(__name__)
 
+# Server handles of uploaded FITS files, keyed by the hash of their content.
+# Shared by all frames, as they share the module-global _fireflyClient.
+_uploadCache = UploadCache(1 << 30)
+# Serialized footprint tables and their server files, keyed by catalog content
+_footprintCache = UploadCache(1 << 28)
+# Actions on mask layers, pipelined within batches.  Each thread has batches
+# of its own, so a batch spans the frames displayed synchronously, while
+# frames displayed concurrently (asynchronously or by mtvMany) never hold
+# back or dispatch each other's actions.
+_actionBatch = ActionBatch()
+# Threads serializing images for asynchronous displays, shared by all frames
+_serializeThreads = 2
+_serializePool = None
+
+
+def _getSerializePool():
+    global _serializePool
+    if _serializePool is None:
+        _serializePool = ThreadPoolExecutor(max_workers=_serializeThreads,
+                                            thread_name_prefix="firefly-serialize")
+    return _serializePool
+
+
+# Number of connections each requests session keeps alive, once raised
+_sessionConnections = weakref.WeakKeyDictionary()
+
+
+@contextmanager
+def _moreConnections(session, connections):
+    """Return a context manager letting ``session`` keep at least
+    ``connections`` connections to each server alive (requests keeps 10 by
+    default) within it, and putting back the adapters it replaced after
+    """
+    previousConnections = _sessionConnections.get(session)
+    if connections <= (previousConnections or 10):
+        yield
+        return
+    previous = {prefix: session.adapters[prefix] for prefix in ("http://", "https://")
+                if prefix in session.adapters}
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    _sessionConnections[session] = connections
+    try:
+        yield
+    finally:
+        for prefix, previousAdapter in previous.items():
+            session.mount(prefix, previousAdapter)
+        if previousConnections is None:
+            del _sessionConnections[session]
+        else:
+            _sessionConnections[session] = previousConnections
+        adapter.close()
+
+
+def _serializeHdus(hdus):
+    """Write a FITS file holding ``hdus`` in memory, returning its bytes and
+    content hash; run in worker processes by `DisplayImpl.mtvMany`
+    """
+    with BytesIO() as fd:
+        fitsWriter.writeFits(fd, hdus)
+        data = fd.getvalue()
+    return data, contentKey([data])
+
+
+def _maskPlanesFromFits(path, index):
+    """Return the mask planes of the ``index``-th image HDU of a FITS file,
+    from the ``MP_`` keywords written by afw, as a `dict` of bits keyed by
+    plane name
+    """
+    with fits.open(path, lazy_load_hdus=True) as hduList:
+        images = [hdu for hdu in hduList if hdu.is_image and hdu.header.get("NAXIS", 0) >= 2]
+        try:
+            header = images[index].header
+        except IndexError:
+            raise FireflyError(f"{path} has no image HDU {index}")
+        return {key[3:]: int(value) for key, value in header.items() if key.startswith("MP_")}
+
+
+def _splitImageData(data):
+    """Return the image, mask and WCS displayed by ``mtv(data)``"""
+    wcs = None
+    if hasattr(data, "getMaskedImage"):
+        data, wcs = data.getMaskedImage(), data.getWcs()
+    if hasattr(data, "getImage") and hasattr(data, "getMask"):
+        return data.getImage(), data.getMask(), wcs
+    if hasattr(data, "getMaskPlaneDict"):
+        return None, data, wcs
+    return data, None, wcs
+
 
 class FireflyError(Exception):
 
@@ -53,9 +164,78 @@ def firefly_version():
     return firefly_client.__version__
 
 
+class _FootprintOverlay:
+    """State of a footprints overlay, kept to update it as the view changes
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        Catalog whose footprints are overlaid
+    tableFormat : `str`
+        Format in which footprints tables are uploaded
+    nWorkers : `int`
+        Number of processes with which to build footprints tables
+    style : `dict`
+        Keyword arguments of `firefly_client.FireflyClient.overlay_footprints`,
+        other than the table
+    """
+
+    def __init__(self, catalog, tableFormat, nWorkers, style):
+        self.catalog = catalog
+        self.tableFormat = tableFormat
+        self.nWorkers = nWorkers
+        self.style = style
+        self.index = None
+        self.cull = False
+        self.viewSize = None
+        self.margin = 0
+        self.detailZooms = None
+        # Level of detail drawn (see DisplayImpl._detailLevel), the regions
+        # of the image already uploaded, which footprints they contain, and
+        # the footprint layers holding them when drawn in full
+        self.level = 0
+        self.regions = []
+        self.shown = np.zeros(len(catalog), dtype=bool)
+        self.layers = []
+
+    @property
+    def regionLayerId(self):
+        """Id of the region layer holding outlines, boxes and points"""
+        return self.style['footprint_layer_id'] + ' outlines'
+
+
+def _ordered(method):
+    """Make a `DisplayImpl` method run after the requests already made to its
+    frame, and return a `concurrent.futures.Future`, when the display is
+    asynchronous
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        queue = self._frameQueue
+        if queue is None or queue.isCurrent():
+            return method(self, *args, **kwargs)
+        return queue.submit(method, self, *args, **kwargs)
+    return wrapper
+
+
+def _contains(outer, inner):
+    """Return whether the region ``outer`` contains ``inner``; both are
+    (minX, minY, maxX, maxY)
+    """
+    return (outer[0] <= inner[0] and outer[1] <= inner[1] and
+            outer[2] >= inner[2] and outer[3] >= inner[3])
+
+
 class DisplayImpl(virtualDevice.DisplayImpl):
     """Device to talk to a firefly display"""
 
+    # Requests to this frame waiting to run in the background, if the
+    # display is asynchronous (see setAsyncOptions)
+    _frameQueue = None
+    # Server files uploaded by mtvMany, keyed by the images they hold (see
+    # _setPrepared), until mtv shows them
+    _prepared = None
+
     @staticmethod
     def _scoped_mask_id(frame, plane_name):
         """Build a server-side mask layer id that is unique per frame.
@@ -139,67 +319,128 @@ class DisplayImpl(virtualDevice.DisplayImpl):
                 raise RuntimeError("Cannot add listener. Browser must be connected"
                                    f"to {_fireflyClient.get_firefly_url()}: {e}")
 
-        self._isBuffered = False
-        self._regions = []
+        if 'upload_cache_bytes' in kwargs:
+            _uploadCache.maxBytes = kwargs['upload_cache_bytes']
+        if 'footprint_cache_bytes' in kwargs:
+            _footprintCache.maxBytes = kwargs['footprint_cache_bytes']
+
+        self._regions = RegionBuffer(self._sendRegions, dispatch=self._callOrdered)
+        # Polylines drawn simplified, kept to simplify them again as the
+        # zoom changes, and the regions drawing them
+        self._lineRegions = RegionBuffer(self._sendLineRegions, dispatch=self._callOrdered)
+        self._lineTolerance = None
+        self._lineZoom = None
+        self._simplifiedLines = []
         self._regionLayerId = self._getRegionLayerId()
         self._fireflyFitsID = None
         self._fireflyMaskOnServer = None
+        self._maskImageNumber = 0
+        self._multiExtension = False
+        self._streaming = False
+        self._chunkBytes = 1 << 22
+        self._compression = None
+        self._quantizeLevel = None
+        self._compressionThreads = None
+        # Directories the server reads directly, keyed by their path here
+        self._serverPathMap = {}
+        self._maskScanThreads = 1
+        self._compositeMasks = False
+        # The last mask displayed composited, to composite it again as
+        # plane colors change, and the layer of each of its planes
+        self._compositeMask = None
+        self._compositeLayers = {}
         self._client = _fireflyClient
+        self._uploadCache = _uploadCache
+        self._footprintCache = _footprintCache
         self._channel = _fireflyClient.channel
         self._url = _fireflyClient.get_firefly_url()
         self._maskIds = []
         self._maskDict = {}
+        self._usedMaskPlanes = None
         self._maskPlaneColors = {}
         self._maskTransparencies = {}
         self._lastZoom = None
         self._lastPan = None
         self._lastStretch = None
+        self._lastImageBBox = None
+        self._footprintOverlays = {}
+        self._footprintChunkLayers = {}
+        # Layers of footprints overlaid in a single table, neither culled
+        # nor in chunks
+        self._footprintTableLayers = set()
 
     def _getRegionLayerId(self):
         return f"lsstRegions{self.display.frame}" if self.display else "None"
 
+    @_ordered
+    def _callOrdered(self, func):
+        """Call ``func``, after the requests already made to the frame if the
+        display is asynchronous, e.g. to send regions when a flush interval
+        expires
+        """
+        func()
+
+    @_ordered
     def _clearImage(self):
         """Delete the current image in the Firefly viewer
         """
         self._client.dispatch(action_type='ImagePlotCntlr.deletePlotView',
                               payload=dict(plotId=str(self.display.frame)))
 
-    def _mtv(self, image, mask=None, wcs=None, title="", metadata=None):
+    def _mtv(self, image, mask=None, wcs=None, title="", metadata=None, variance=None):
         """Display an Image and/or Mask on a Firefly display
+
+        With multi-extension uploads enabled (see `setUploadOptions`), the
+        image, mask and variance (if given) are uploaded together as the
+        HDUs of a single FITS file.
+
+        If the display is asynchronous (see `setAsyncOptions`) the image is
+        serialized in the background, possibly while the previous one is
+        uploaded, then uploaded and shown once the requests already made
+        to the frame are done; a `concurrent.futures.Future` is returned.
         """
         if title == "":
             title = str(self.display.frame)
+        multiExtension = bool(image and mask and self._multiExtension)
+        queue = self._frameQueue
+        if queue is None or queue.isCurrent():
+            return self._displayImage(image, mask, wcs, title, metadata, variance, multiExtension)
+
+        serialized = None
+        preparedData = (image, mask, variance) if multiExtension else (image,)
+        if image and not self._streaming and not self._hasPrepared(*preparedData):
+            serialized = _getSerializePool().submit(self._serializeImage, image, mask, variance, wcs, title,
+                                                    metadata, multiExtension)
+        return queue.submit(self._displayImage, image, mask, wcs, title, metadata, variance, multiExtension,
+                            serialized)
+
+    def _displayImage(self, image, mask, wcs, title, metadata, variance, multiExtension, serialized=None):
+        """Upload and show an Image and/or Mask; see `_mtv`
+
+        ``serialized`` is a future of the FITS file of the image, as
+        returned by `_serializeImage`, if it is written in advance.
+        """
+        if image or mask:
+            self._lastImageBBox = (image if image else mask).getBBox()
         if image:
             if self.verbose:
                 print('displaying image')
             self._erase()
 
-            with BytesIO() as fd:
-                afwDisplay.writeFitsImage(fd, image, wcs, title, metadata=metadata)
-                fd.seek(0, 0)
-                self._fireflyFitsID = _fireflyClient.upload_fits_data(fd)
-
-            try:
-                viewer_id = f'image-{_fireflyClient.render_tree_id}-{self.frame}'
-            except AttributeError:
-                viewer_id = f'image-{self.frame}'
-            extraParams = dict(Title=title,
-                               MultiImageIdx=0,
-                               PredefinedOverlayIds=' ',
-                               viewer_id=viewer_id)
-            # Firefly's Javascript API requires a space for parameters;
-            # otherwise the parameter will be ignored
-
-            if self._lastZoom:
-                extraParams['InitZoomLevel'] = self._lastZoom
-                extraParams['ZoomType'] = 'LEVEL'
-            if self._lastPan:
-                extraParams['InitialCenterPosition'] = f'{self._lastPan[0]:.3f};{self._lastPan[1]:.3f};PIXEL'
-            if self._lastStretch:
-                extraParams['RangeValues'] = self._lastStretch
-
-            ret = _fireflyClient.show_fits_image(self._fireflyFitsID, plot_id=str(self.display.frame),
-                                                 **extraParams)
+            if serialized is not None:
+                upload = functools.partial(self._uploadSerialized, serialized.result())
+            elif multiExtension:
+                upload = functools.partial(self._uploadMultiExtension, image, mask, variance,
+                                           wcs, title, metadata)
+            else:
+                upload = functools.partial(self._uploadImage, image, wcs, title, metadata)
+            self._fireflyFitsID, cached = upload()
+            ret = self._showFits(self._fireflyFitsID, title)
+            if not ret["success"] and cached:
+                # The cached file may have been dropped by the server (e.g. the
+                # session was reset); upload the pixels again and retry.
+                self._fireflyFitsID, _ = upload(refresh=True)
+                ret = self._showFits(self._fireflyFitsID, title)
 
             if not ret["success"]:
                 raise RuntimeError("Display of image failed")
@@ -207,31 +448,444 @@ class DisplayImpl(virtualDevice.DisplayImpl):
         if mask:
             if self.verbose:
                 print('displaying mask')
-            with BytesIO() as fdm:
-                afwDisplay.writeFitsImage(fdm, mask, wcs, title, metadata=metadata)
-                fdm.seek(0, 0)
-                self._fireflyMaskOnServer = _fireflyClient.upload_fits_data(fdm)
-
             maskPlaneDict = mask.getMaskPlaneDict()
             for k, v in maskPlaneDict.items():
                 self._maskDict[k] = v
                 self._maskPlaneColors[k] = self.display.getMaskPlaneColor(k)
-            usedPlanes = int(afwMath.makeStatistics(mask, afwMath.SUM).getValue())
-            for k in self._maskDict:
-                if (((1 << self._maskDict[k]) & usedPlanes) and
-                        (k in self._maskPlaneColors) and
-                        (self._maskPlaneColors[k] is not None) and
-                        (self._maskPlaneColors[k].lower() != 'ignore')):
-                    _fireflyClient.add_mask(bit_number=self._maskDict[k],
-                                            image_number=0,
-                                            plot_id=str(self.display.frame),
-                                            mask_id=self._scoped_mask_id(self.display.frame, k),
-                                            title=k + ' - bit %d'%self._maskDict[k],
-                                            color=self._maskPlaneColors[k],
-                                            file_on_server=self._fireflyMaskOnServer)
-                    if k in self._maskTransparencies:
-                        self._setMaskTransparency(self._maskTransparencies[k], k)
-                    self._maskIds.append((self.display.frame, k))
+            usedPlanes = usedMaskBits(mask.getArray(), nThreads=self._maskScanThreads)
+
+            with _actionBatch.batch():
+                if self._compositeMasks:
+                    self._compositeMask = (mask, wcs, title, metadata, usedPlanes)
+                    self._addCompositeMask()
+                else:
+                    self._compositeMask = None
+                    self._addMaskPlanes(mask, wcs, title, metadata, usedPlanes, multiExtension)
+
+    def _showFits(self, fileInput, title, imageIndex=0, **fileParams):
+        """Show a FITS file on the current frame, as set up by the last
+        zoom, pan and stretch
+
+        Parameters:
+        -----------
+        fileInput : `str` or None
+            Server handle or URL of the file, as for
+            `firefly_client.FireflyClient.show_fits_image`
+        title : `str`
+            Title of the image
+        imageIndex : `int`
+            Index of the image to show among the image HDUs of the file
+        **fileParams
+            Other plot request parameters, e.g. the ``file`` read by the
+            server if ``fileInput`` is None
+
+        Returns:
+        --------
+        status : `dict`
+            Status of the request
+        """
+        try:
+            viewer_id = f'image-{_fireflyClient.render_tree_id}-{self.frame}'
+        except AttributeError:
+            viewer_id = f'image-{self.frame}'
+        extraParams = dict(Title=title,
+                           MultiImageIdx=imageIndex,
+                           PredefinedOverlayIds=' ',
+                           viewer_id=viewer_id)
+        # Firefly's Javascript API requires a space for parameters;
+        # otherwise the parameter will be ignored
+
+        if self._lastZoom:
+            extraParams['InitZoomLevel'] = self._lastZoom
+            extraParams['ZoomType'] = 'LEVEL'
+        if self._lastPan:
+            extraParams['InitialCenterPosition'] = f'{self._lastPan[0]:.3f};{self._lastPan[1]:.3f};PIXEL'
+        if self._lastStretch:
+            extraParams['RangeValues'] = self._lastStretch
+        extraParams.update(fileParams)
+
+        return _fireflyClient.show_fits_image(fileInput, plot_id=str(self.display.frame), **extraParams)
+
+    def _addMaskPlanes(self, mask, wcs, title, metadata, usedPlanes, multiExtension):
+        """Upload a mask, unless it was uploaded with its image, and overlay
+        each plane shown with a layer of its own
+        """
+        if multiExtension:
+            self._fireflyMaskOnServer = self._fireflyFitsID
+            self._maskImageNumber = 1
+        else:
+            self._fireflyMaskOnServer, _ = self._uploadImage(mask, wcs, title, metadata)
+            self._maskImageNumber = 0
+
+        self._usedMaskPlanes = usedPlanes
+        for k in self._maskDict:
+            if ((1 << self._maskDict[k]) & usedPlanes) and self._isMaskPlaneShown(k):
+                self._addMaskPlane(k)
+
+    def _addMaskPlane(self, name):
+        """Overlay a plane of the mask last uploaded, on the current frame"""
+        frame = self.display.frame
+        _actionBatch.add((frame, name), _fireflyClient.add_mask,
+                         bit_number=self._maskDict[name],
+                         image_number=self._maskImageNumber,
+                         plot_id=str(frame),
+                         mask_id=self._scoped_mask_id(frame, name),
+                         title=name + ' - bit %d'%self._maskDict[name],
+                         color=self._maskPlaneColors[name],
+                         file_on_server=self._fireflyMaskOnServer)
+        if name in self._maskTransparencies:
+            self._setMaskTransparency(self._maskTransparencies[name], name)
+        self._maskIds.append((frame, name))
+
+    def _isMaskPlaneShown(self, name):
+        """Return whether a mask plane is to be overlaid, given its color"""
+        color = self._maskPlaneColors.get(name)
+        return color is not None and color.lower() != 'ignore'
+
+    def _addCompositeMask(self):
+        """Overlay the planes of the last mask displayed as composited masks
+
+        The planes shown are grouped by color, and a mask with one bit per
+        group is uploaded and overlaid with a layer per group, named after
+        the planes in it.
+        """
+        mask, wcs, title, metadata, usedPlanes = self._compositeMask
+        frame = self.display.frame
+        groups = self._compositeGroups()
+        self._compositeLayers = {}
+        if not groups:
+            return
+
+        bitmasks = [sum(1 << self._maskDict[k] for k in planes) for planes in groups.values()]
+        array = compositeMaskPlanes(mask.getArray(), bitmasks, nThreads=self._maskScanThreads)
+        fileId, _ = self._uploadHdus([self._makeHdu(mask, wcs, title, metadata, array=array)])
+        for bit, planes in enumerate(groups.values()):
+            name = '+'.join(planes)
+            _actionBatch.add((frame, name), _fireflyClient.add_mask,
+                             bit_number=bit,
+                             image_number=0,
+                             plot_id=str(frame),
+                             mask_id=self._scoped_mask_id(frame, name),
+                             title=', '.join(planes),
+                             color=self._maskPlaneColors[planes[0]],
+                             file_on_server=fileId)
+            self._maskIds.append((frame, name))
+            self._compositeLayers.update(dict.fromkeys(planes, name))
+            transparency = next((self._maskTransparencies[k] for k in planes
+                                 if self._maskTransparencies.get(k) is not None), None)
+            if transparency is not None:
+                self._setMaskTransparency(transparency, planes[0])
+
+    def _compositeGroups(self):
+        """Return the planes shown of the last mask composited, grouped by
+        color
+        """
+        usedPlanes = self._compositeMask[4]
+        groups = {}
+        for k, bit in self._maskDict.items():
+            if ((1 << bit) & usedPlanes) and self._isMaskPlaneShown(k):
+                groups.setdefault(self._maskPlaneColors[k].lower(), []).append(k)
+        return groups
+
+    def _changeMaskLayers(self, frame, changes, doReplot):
+        """Change the attributes of mask layers in place
+
+        Parameters:
+        -----------
+        frame : `int`
+            Frame the layers are overlaid on
+        changes : `list` of (`str`, `dict`)
+            Layer names, as in ``_maskIds``, and the attributes to set
+        doReplot : `bool`
+            Whether the server must render the layers again
+        """
+        with _actionBatch.batch():
+            for layer, attributes in changes:
+                _actionBatch.add((frame, layer), _fireflyClient.dispatch,
+                                 action_type='ImagePlotCntlr.overlayPlotChangeAttributes',
+                                 payload={'plotId': str(frame),
+                                          'imageOverlayId': self._scoped_mask_id(frame, layer),
+                                          'attributes': attributes,
+                                          'doReplot': doReplot})
+
+    def _cachedUpload(self, key, nbytes, send, refresh=False):
+        """Return the server file for content ``key``, uploading it if needed
+
+        Parameters:
+        -----------
+        key : `str`
+            Content hash of the file
+        nbytes : `int`
+            Size of the file
+        send : callable
+            Function uploading the file and returning its server handle
+        refresh : `bool`
+            Discard any cached server file for this content and upload again
+
+        Returns:
+        --------
+        fileId : `str`
+            Firefly server handle of the file
+        cached : `bool`
+            True if ``fileId`` was reused from the upload cache
+        """
+        if refresh:
+            self._uploadCache.invalidate(key)
+        fileId = self._uploadCache.get(key)
+        if fileId is not None:
+            _LOG.debug("Reusing uploaded file %s", fileId)
+            return fileId, True
+        fileId = send()
+        self._uploadCache.put(key, fileId, nbytes)
+        return fileId, False
+
+    def _uploadFits(self, write, refresh=False):
+        """Upload a FITS file built in memory, unless identical content is cached
+
+        Parameters:
+        -----------
+        write : callable
+            Function writing the FITS file to the binary stream it is passed
+        refresh : `bool`
+            Discard any cached server file for this content and upload again
+
+        Returns:
+        --------
+        fileId : `str`
+            Firefly server handle of the FITS file
+        cached : `bool`
+            True if ``fileId`` was reused from the upload cache
+        """
+        return self._uploadSerialized(self._serializeFits(write), refresh)
+
+    @staticmethod
+    def _serializeFits(write):
+        """Write a FITS file in memory
+
+        Parameters:
+        -----------
+        write : callable
+            Function writing the FITS file to the binary stream it is passed
+
+        Returns:
+        --------
+        fd : `io.BytesIO`
+            The file
+        key : `str`
+            Content hash of the file
+        nbytes : `int`
+            Size of the file
+        """
+        fd = BytesIO()
+        write(fd)
+        with fd.getbuffer() as buf:
+            return fd, contentKey([buf]), buf.nbytes
+
+    def _uploadSerialized(self, serialized, refresh=False):
+        """Upload a FITS file written by `_serializeFits`, unless identical
+        content is cached; see `_uploadFits` for the return values
+        """
+        fd, key, nbytes = serialized
+
+        def send():
+            fd.seek(0, 0)
+            return _fireflyClient.upload_fits_data(fd)
+        return self._cachedUpload(key, nbytes, send, refresh)
+
+    def _serializeImage(self, image, mask, variance, wcs, title, metadata, multiExtension):
+        """Write the FITS file `_mtv` uploads for an image in memory, as
+        `_serializeFits`
+        """
+        if multiExtension:
+            hdus = self._multiExtensionHdus(image, mask, variance, wcs, title, metadata)
+        elif self._compression:
+            hdus = [self._makeHdu(image, wcs, title, metadata)]
+        else:
+            return self._serializeFits(self._imageWriter(image, wcs, title, metadata))
+        return self._serializeFits(functools.partial(fitsWriter.writeFits, hdus=hdus))
+
+    def _uploadHdus(self, hdus, refresh=False):
+        """Upload HDUs as a single FITS file, unless identical content is cached
+
+        When streaming uploads are enabled the file is never held in memory:
+        it is hashed, and if need be uploaded, a block of rows at a time.
+
+        Parameters:
+        -----------
+        hdus : `list` of `fitsWriter.ImageHdu`
+            HDUs of the file, the first being the primary HDU
+        refresh : `bool`
+            Discard any cached server file for this content and upload again
+
+        Returns:
+        --------
+        fileId : `str`
+            Firefly server handle of the FITS file
+        cached : `bool`
+            True if ``fileId`` was reused from the upload cache
+        """
+        if not self._streaming:
+            return self._uploadFits(functools.partial(fitsWriter.writeFits, hdus=hdus), refresh)
+
+        def iterChunks():
+            return fitsWriter.iterFits(hdus, self._chunkBytes)
+
+        nbytes = fitsWriter.fitsLength(hdus)
+
+        def send():
+            return upload.uploadStream(_fireflyClient, iterChunks, nbytes, spoolBytes=self._chunkBytes)
+        return self._cachedUpload(contentKey(iterChunks()), nbytes, send, refresh)
+
+    def _uploadImage(self, data, wcs, title, metadata, refresh=False):
+        """Upload an image or mask as a single-HDU FITS file
+
+        Parameters:
+        -----------
+        data : `lsst.afw.image.Image` or `lsst.afw.image.Mask`
+            Pixels to upload
+        wcs : `lsst.afw.geom.SkyWcs` or None
+            WCS to write to the FITS header
+        title : `str`
+            Title to write to the FITS header
+        metadata : `lsst.daf.base.PropertyList` or None
+            Additional FITS header cards
+        refresh : `bool`
+            Discard any cached server file for this content and upload again
+
+        Returns:
+        --------
+        fileId : `str`
+            Firefly server handle of the FITS file
+        cached : `bool`
+            True if ``fileId`` was reused from the upload cache
+        """
+        prepared = self._takePrepared(data)
+        if prepared is not None and not refresh:
+            return prepared
+        if self._streaming or self._compression:
+            return self._uploadHdus([self._makeHdu(data, wcs, title, metadata)], refresh)
+        return self._uploadFits(self._imageWriter(data, wcs, title, metadata), refresh)
+
+    @staticmethod
+    def _imageWriter(data, wcs, title, metadata):
+        """Return a function writing ``data`` as a single-HDU FITS file to
+        the binary stream it is passed
+        """
+        def write(fd):
+            afwDisplay.writeFitsImage(fd, data, wcs, title, metadata=metadata)
+        return write
+
+    def _uploadMultiExtension(self, image, mask, variance, wcs, title, metadata, refresh=False):
+        """Upload an image, its mask and optionally its variance as one FITS file
+
+        The image is the primary HDU, followed by the mask and then the
+        variance, so the mask is image number 1 for ``add_mask``.  See
+        `_uploadImage` for the other parameters and the return values.
+        """
+        prepared = self._takePrepared(image, mask, variance)
+        if prepared is not None and not refresh:
+            return prepared
+        return self._uploadHdus(self._multiExtensionHdus(image, mask, variance, wcs, title, metadata),
+                                refresh)
+
+    def _uploadFile(self, path, refresh=False):
+        """Upload a local file as it is, a block at a time, unless it was
+        uploaded before and has not changed since
+
+        See `_uploadFits` for the parameters and return values.
+        """
+        stat = os.stat(path)
+        key = f"file:{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+        def iterChunks():
+            with open(path, "rb") as fd:
+                yield from iter(functools.partial(fd.read, self._chunkBytes), b"")
+
+        def send():
+            return upload.uploadStream(_fireflyClient, iterChunks, stat.st_size, spoolBytes=self._chunkBytes)
+        return self._cachedUpload(key, stat.st_size, send, refresh)
+
+    def _serverPath(self, path):
+        """Return the path under which the server reads the local file
+        ``path``, or None if it is not in a directory it reads
+        """
+        path = os.path.abspath(path)
+        for localDir in sorted(self._serverPathMap, key=len, reverse=True):
+            prefix = localDir.rstrip("/")
+            if path == prefix or path.startswith(prefix + "/"):
+                return self._serverPathMap[localDir].rstrip("/") + path[len(prefix):]
+        return None
+
+    @staticmethod
+    def _preparedKey(datas):
+        """Return the key of the file holding ``datas`` (those not None) in
+        ``_prepared``
+        """
+        return tuple(id(data) for data in datas if data is not None)
+
+    def _setPrepared(self, datas, fileId, cached):
+        """Record the server file uploaded by `mtvMany` holding ``datas``
+
+        The data are kept with the file, so that their ids are not reused
+        by other objects; afw hands back the same Python object for an
+        image as long as one exists, so ``mtv`` finds the file by id.
+        """
+        if self._prepared is None:
+            self._prepared = {}
+        self._prepared[self._preparedKey(datas)] = (datas, fileId, cached)
+
+    def _hasPrepared(self, *datas):
+        """Return whether `mtvMany` uploaded the file holding ``datas``"""
+        return bool(self._prepared) and self._preparedKey(datas) in self._prepared
+
+    def _takePrepared(self, *datas):
+        """Return the server file uploaded by `mtvMany` holding ``datas``
+        (those not None), if any, as ``(fileId, cached)``
+        """
+        if not self._prepared:
+            return None
+        prepared = self._prepared.pop(self._preparedKey(datas), None)
+        return None if prepared is None else prepared[1:]
+
+    @_ordered
+    def _clearPrepared(self):
+        """Forget the files uploaded by `mtvMany` that ``mtv`` did not show"""
+        self._prepared = None
+
+    def _preparedFiles(self, data, title):
+        """Return the files ``mtv(data)`` uploads, as tuples of the data
+        they hold and their HDUs
+        """
+        image, mask, wcs = _splitImageData(data)
+        if title == "":
+            title = str(self.display.frame)
+        if image and mask and self._multiExtension:
+            return [((image, mask), self._multiExtensionHdus(image, mask, None, wcs, title, None))]
+        files = []
+        if image:
+            files.append(((image,), [self._makeHdu(image, wcs, title, None)]))
+        if mask and not self._compositeMasks:
+            files.append(((mask,), [self._makeHdu(mask, wcs, title, None)]))
+        return files
+
+    def _multiExtensionHdus(self, image, mask, variance, wcs, title, metadata):
+        """Return the HDUs of the file uploaded by `_uploadMultiExtension`"""
+        hdus = [self._makeHdu(image, wcs, title, metadata, extname='IMAGE'),
+                self._makeHdu(mask, wcs, title, metadata, extname='MASK')]
+        if variance is not None:
+            hdus.append(self._makeHdu(variance, wcs, title, metadata, extname='VARIANCE'))
+        return hdus
+
+    def _makeHdu(self, data, wcs, title, metadata, extname=None, array=None):
+        """Make the HDU used to upload ``data``, or ``array`` in its place,
+        compressed if so configured
+        """
+        if not self._compression:
+            return fitsWriter.makeImageHdu(data, wcs, title, metadata, extname, array=array)
+        return fitsWriter.makeImageHdu(data, wcs, title, metadata, extname, array=array,
+                                       compression=self._compression,
+                                       quantizeLevel=self._quantizeLevel or None,
+                                       nThreads=self._compressionThreads)
 
     def _remove_masks(self):
         """Remove mask layers for the current frame.
@@ -242,49 +896,65 @@ class DisplayImpl(virtualDevice.DisplayImpl):
         """
         frame = self.display.frame
         kept = []
-        for f, name in self._maskIds:
-            if f == frame:
-                _fireflyClient.remove_mask(plot_id=str(frame),
-                                           mask_id=self._scoped_mask_id(f, name))
-            else:
-                kept.append((f, name))
+        with _actionBatch.batch():
+            for f, name in self._maskIds:
+                if f == frame:
+                    _actionBatch.add((f, name), _fireflyClient.remove_mask,
+                                     plot_id=str(frame), mask_id=self._scoped_mask_id(f, name))
+                else:
+                    kept.append((f, name))
         self._maskIds = kept
 
+    @_ordered
     def _buffer(self, enable=True):
         """!Enable or disable buffering of writes to the display
         param enable  True or False, as appropriate
         """
-        self._isBuffered = enable
+        self._regions.buffered = enable
+        self._lineRegions.buffered = enable
 
+    @_ordered
     def _flush(self):
         """!Flush any I/O buffers
         """
-        if not self._regions:
-            return
+        self._regions.flush()
+        self._lineRegions.flush()
 
+    def _sendRegions(self, regions):
         if self.verbose:
-            print("Flushing %d regions" % len(self._regions))
-            print(self._regions)
+            print("Flushing %d regions" % len(regions))
+            print(regions)
 
         self._regionLayerId = self._getRegionLayerId()
-        _fireflyClient.add_region_data(region_data=self._regions, plot_id=str(self.display.frame),
+        _fireflyClient.add_region_data(region_data=regions, plot_id=str(self.display.frame),
                                        region_layer_id=self._regionLayerId)
-        self._regions = []
 
-    def _uploadTextData(self, regions):
-        self._regions += regions
+    def _getLineLayerId(self):
+        return self._getRegionLayerId() + " lines"
+
+    def _sendLineRegions(self, regions):
+        _fireflyClient.add_region_data(region_data=regions, plot_id=str(self.display.frame),
+                                       region_layer_id=self._getLineLayerId())
 
-        if not self._isBuffered:
-            self._flush()
+    def _uploadTextData(self, regions):
+        self._regions.add(regions)
 
     def _close(self):
         """Called when the device is closed"""
         if self.verbose:
             print("Closing firefly device %s" % (self.display.frame if self.display else "[None]"))
+        if self._frameQueue is not None:
+            self._frameQueue.shutdown()
+            self._frameQueue = None
         if _fireflyClient is not None:
+            self._regions.clear()
+            self._lineRegions.clear()
             _fireflyClient.disconnect()
             _fireflyClient.session.close()
+            _uploadCache.invalidate()
+            _footprintCache.invalidate()
 
+    @_ordered
     def _dot(self, symb, c, r, size, ctype, fontFamily="helvetica", textAngle=None):
         """Draw a symbol onto the specified DS9 frame at (col,row) = (c,r) [0-based coordinates]
     Possible values are:
@@ -302,18 +972,51 @@ class DisplayImpl(virtualDevice.DisplayImpl):
     """
         self._uploadTextData(ds9Regions.dot(symb, c, r, size, ctype, fontFamily, textAngle))
 
+    @_ordered
     def _drawLines(self, points, ctype):
         """Connect the points, a list of (col,row)
         Ctype is the name of a colour (e.g. 'red')"""
 
-        self._uploadTextData(ds9Regions.drawLines(points, ctype))
+        if self._lineTolerance:
+            self._drawSimplifiedLines(points, None, ctype)
+        else:
+            self._uploadTextData(lineRegions(points, ctype=ctype))
 
+    def _drawSimplifiedLines(self, vertices, offsets, ctype):
+        """Draw polylines simplified to the line tolerance at the current
+        zoom, keeping them to simplify again when the zoom changes
+        """
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        offsets = np.asarray([0, len(vertices)] if offsets is None else offsets)
+        if not self._simplifiedLines:
+            self._lineZoom = self._lastZoom or 1.0
+        self._simplifiedLines.append((vertices, offsets, ctype))
+        tolerance = (self._lineTolerance or 0)/self._lineZoom
+        self._lineRegions.add(lineRegions(*simplifyPolylines(vertices, offsets, tolerance), ctype))
+
+    def _refreshSimplifiedLines(self, force=False):
+        """Draw the simplified polylines again if the zoom has changed"""
+        zoom = self._lastZoom or 1.0
+        if not self._simplifiedLines or (zoom == self._lineZoom and not force):
+            return
+        self._lineRegions.clear()
+        _fireflyClient.delete_region_layer(self._getLineLayerId(), plot_id=str(self.display.frame))
+        lines, self._simplifiedLines = self._simplifiedLines, []
+        with self._lineRegions.batch():
+            for vertices, offsets, ctype in lines:
+                self._drawSimplifiedLines(vertices, offsets, ctype)
+
+    @_ordered
     def _erase(self):
         """Erase all overlays on the image"""
         if self.verbose:
             print(f'region layer id is {self._regionLayerId}')
         if self._regionLayerId:
             _fireflyClient.delete_region_layer(self._regionLayerId, plot_id=str(self.display.frame))
+        if self._simplifiedLines:
+            self._lineRegions.clear()
+            self._simplifiedLines = []
+            _fireflyClient.delete_region_layer(self._getLineLayerId(), plot_id=str(self.display.frame))
 
     def _setCallback(self, what, func):
         if func != interface.noop_callback:
@@ -340,6 +1043,7 @@ class DisplayImpl(virtualDevice.DisplayImpl):
     # Set gray scale
     #
 
+    @_ordered
     def _scale(self, algorithm, min, max, unit=None, *args, **kwargs):
         """Scale the image stretch and limits
 
@@ -451,6 +1155,7 @@ class DisplayImpl(virtualDevice.DisplayImpl):
         if 'rv_string' in rval:
             self._lastStretch = rval['rv_string']
 
+    @_ordered
     def _setMaskTransparency(self, transparency, maskName):
         """Specify mask transparency (percent); or None to not set it when loading masks.
 
@@ -467,11 +1172,11 @@ class DisplayImpl(virtualDevice.DisplayImpl):
             names.update(self.display._defaultMaskPlaneColor.keys())
         for k in names:
             self._maskTransparencies[k] = transparency
-            _fireflyClient.dispatch(action_type='ImagePlotCntlr.overlayPlotChangeAttributes',
-                                    payload={'plotId': str(frame),
-                                             'imageOverlayId': self._scoped_mask_id(frame, k),
-                                             'attributes': {'opacity': 1.0 - transparency/100.},
-                                             'doReplot': False})
+        # Composited planes share the layer of their color
+        attributes = {'opacity': 1.0 - transparency/100.}
+        self._changeMaskLayers(frame, [(layer, attributes) for layer in
+                                       dict.fromkeys(self._compositeLayers.get(k, k) for k in names)],
+                               doReplot=False)
 
     def _getMaskTransparency(self, maskName):
         """Return the current mask's transparency"""
@@ -480,21 +1185,13 @@ class DisplayImpl(virtualDevice.DisplayImpl):
             transparency = self._maskTransparencies[maskName]
         return transparency
 
+    @_ordered
     def _setMaskPlaneColor(self, maskName, color):
         """Specify mask color for the current frame.
         """
-        frame = self.display.frame
-        scoped_id = self._scoped_mask_id(frame, maskName)
-        _fireflyClient.remove_mask(plot_id=str(frame), mask_id=scoped_id)
-        self._maskPlaneColors[maskName] = color
-        if (color.lower() != 'ignore'):
-            _fireflyClient.add_mask(bit_number=self._maskDict[maskName],
-                                    image_number=1,
-                                    plot_id=str(frame),
-                                    mask_id=scoped_id,
-                                    color=self.display.getMaskPlaneColor(maskName),
-                                    file_on_server=self._fireflyFitsID)
+        self.setMaskPlaneColors({maskName: color})
 
+    @_ordered
     def _show(self):
         """Show the requested window"""
         if self._client.render_tree_id is not None:
@@ -510,6 +1207,7 @@ class DisplayImpl(virtualDevice.DisplayImpl):
     # Zoom and Pan
     #
 
+    @_ordered
     def _zoom(self, zoomfac):
         """Zoom display by specified amount
 
@@ -520,7 +1218,10 @@ class DisplayImpl(virtualDevice.DisplayImpl):
         """
         self._lastZoom = zoomfac
         _fireflyClient.set_zoom(plot_id=str(self.display.frame), factor=zoomfac)
+        self._refreshFootprintOverlays()
+        self._refreshSimplifiedLines()
 
+    @_ordered
     def _pan(self, colc, rowc):
         """Pan to specified pixel coordinates
 
@@ -533,6 +1234,7 @@ class DisplayImpl(virtualDevice.DisplayImpl):
         self._lastPan = [colc+0.5, rowc+0.5]  # saved for future use in _mtv
         # Firefly's internal convention is first pixel is (0.5, 0.5)
         _fireflyClient.set_pan(plot_id=str(self.display.frame), x=colc, y=rowc)
+        self._refreshFootprintOverlays()
 
     # Extensions to the API that are specific to using the Firefly backend
 
@@ -546,11 +1248,518 @@ class DisplayImpl(virtualDevice.DisplayImpl):
         """
         return self._client
 
+    def setUploadOptions(self, multiExtension=None, streaming=None, chunkBytes=None,
+                         compression=None, quantizeLevel=None, compressionThreads=None):
+        """Choose how images are sent to the Firefly server
+
+        Parameters that are None are left unchanged.
+
+        Parameters:
+        -----------
+        multiExtension : `bool`, optional
+            Upload the image, mask and variance of a masked image as the
+            HDUs of a single FITS file, in one request, rather than
+            uploading the image and the mask separately.
+        streaming : `bool`, optional
+            Write the FITS file into the upload request a block of rows at
+            a time, rather than building it in memory first.  The extra
+            memory needed is then about ``chunkBytes``, whatever the size
+            of the image.
+        chunkBytes : `int`, optional
+            Size of the blocks used by streaming uploads (default 4 MiB)
+        compression : {'GZIP_1', 'GZIP_2'} or `False`, optional
+            Upload tile-compressed FITS, compressing the tiles in parallel
+            threads; `False` turns compression off again.  Masks and other
+            integer images are always compressed losslessly.  GZIP_2 usually
+            compresses floating-point pixels better.
+        quantizeLevel : `float`, optional
+            Quantize floating-point images before compressing them, with a
+            step of each tile's noise divided by ``quantizeLevel``: 4 loses
+            nothing visible on the display, larger values are less lossy.
+            0 turns quantization off, so that compression is lossless.
+        compressionThreads : `int`, optional
+            Number of threads compressing tiles; by default one per CPU.
+        """
+        if multiExtension is not None:
+            self._multiExtension = multiExtension
+        if streaming is not None:
+            self._streaming = streaming
+        if chunkBytes is not None:
+            self._chunkBytes = chunkBytes
+        if compression is not None:
+            if compression and compression not in fitsWriter.COMPRESSION_TYPES:
+                raise FireflyError(
+                    'Compression {} is invalid; please choose one of "{}"'.format(
+                        compression, '", "'.join(fitsWriter.COMPRESSION_TYPES)
+                    )
+                )
+            self._compression = compression or None
+        if quantizeLevel is not None:
+            self._quantizeLevel = quantizeLevel
+        if compressionThreads is not None:
+            self._compressionThreads = compressionThreads
+
+    def setAsyncOptions(self, enabled=None, serializeThreads=None):
+        """Choose whether requests to this frame are made in the background
+
+        When asynchronous, ``mtv``, ``overlayFootprints``, ``flush`` and the
+        other requests to Firefly return at once, with a
+        `concurrent.futures.Future` where the method is called directly
+        (e.g. ``display1.overlayFootprints``).  They are run in the order
+        they were made, one at a time, so that e.g. a pan applies to the
+        image displayed before it.  Images are serialized ahead of their
+        turn, while the previous images are uploaded; errors are raised by
+        the futures and by `wait`.
+
+        Parameters that are None are left unchanged.
+
+        Parameters:
+        -----------
+        enabled : `bool`, optional
+            Make the requests to this frame in the background; disabling
+            waits for the requests already made
+        serializeThreads : `int`, optional
+            Number of threads serializing images, shared by all frames
+            (default 2).  Applies once no image is being serialized.
+        """
+        global _serializeThreads, _serializePool
+        if serializeThreads is not None and serializeThreads != _serializeThreads:
+            _serializeThreads = serializeThreads
+            if _serializePool is not None:
+                _serializePool.shutdown(wait=False)
+                _serializePool = None
+        if enabled and self._frameQueue is None:
+            self._frameQueue = FrameQueue(f"firefly-frame{self.display.frame}")
+        elif enabled is not None and not enabled and self._frameQueue is not None:
+            queue = self._frameQueue
+            self._frameQueue = None
+            queue.shutdown()
+            queue.wait()
+
+    def wait(self, timeout=None):
+        """Wait for the requests made in the background to this frame
+
+        Parameters:
+        -----------
+        timeout : `float`, optional
+            Maximum number of seconds to wait
+
+        Raises:
+        -------
+        TimeoutError
+            Raised if requests are still running after ``timeout`` seconds
+        Exception
+            The error raised by the first request that failed since the
+            last wait, if any
+        """
+        if self._frameQueue is not None:
+            self._frameQueue.wait(timeout)
+
+    def setServerPathMap(self, pathMap):
+        """Declare the directories the Firefly server reads directly, for
+        `mtvFile`
+
+        Parameters:
+        -----------
+        pathMap : `dict` or None
+            Path of each directory on the server, keyed by its path here,
+            e.g. ``{"/repo": "/mnt/repo"}``, or ``{"/repo": "/repo"}`` if
+            mounted at the same place.  None forgets all directories.
+        """
+        self._serverPathMap = dict(pathMap or {})
+
+    def setMaskOptions(self, scanThreads=None, composite=None):
+        """Choose how masks are displayed
+
+        Parameters that are None are left unchanged.
+
+        Parameters:
+        -----------
+        scanThreads : `int`, optional
+            Number of threads scanning the mask pixels for the planes in
+            use, each scanning a block of rows (default 1)
+        composite : `bool`, optional
+            Composite the mask planes shown into a mask with one bit per
+            color, computed locally and uploaded instead of the mask, and
+            overlay a layer per color rather than per plane.  With many
+            planes this takes far fewer requests, and the server decodes
+            a smaller file.  Changing a plane's color composites the planes
+            again; setting the transparency of a plane sets that of its
+            color's layer.  Applies to masks displayed from now on.
+        """
+        if scanThreads is not None:
+            self._maskScanThreads = scanThreads
+        if composite is not None:
+            self._compositeMasks = composite
+
+    @_ordered
+    def setMaskPlaneColors(self, colors):
+        """Change the colors of several mask planes of the current frame
+
+        Layers already overlaid are recolored in place, without the server
+        reading the mask again; planes set to ``'ignore'`` are removed, and
+        planes that were ignored are overlaid.  Composited masks are only
+        composited again if the planes sharing a color change.
+
+        Parameters:
+        -----------
+        colors : `dict`
+            Colors keyed by mask plane name
+        """
+        with _actionBatch.batch():
+            self._setMaskPlaneColors(colors)
+
+    def _setMaskPlaneColors(self, colors):
+        frame = self.display.frame
+        if self._compositeMask is not None:
+            groups = self._compositeGroups()
+            self._maskPlaneColors.update(colors)
+            newGroups = self._compositeGroups()
+            if list(groups.values()) == list(newGroups.values()):
+                # Same layers, possibly in new colors
+                self._changeMaskLayers(frame, [('+'.join(planes), {'color': self._maskPlaneColors[planes[0]]})
+                                               for old, (color, planes) in zip(groups, newGroups.items())
+                                               if color != old],
+                                       doReplot=True)
+            else:
+                # Composite the planes again; identical composites are not
+                # uploaded again
+                self._remove_masks()
+                self._addCompositeMask()
+            return
+
+        changes = []
+        for name, color in colors.items():
+            self._maskPlaneColors[name] = color
+            shown = (frame, name) in self._maskIds
+            if color.lower() == 'ignore':
+                if shown:
+                    _actionBatch.add((frame, name), _fireflyClient.remove_mask,
+                                     plot_id=str(frame), mask_id=self._scoped_mask_id(frame, name))
+                    self._maskIds.remove((frame, name))
+            elif shown:
+                changes.append((name, {'color': color}))
+            elif (name in self._maskDict and self._fireflyMaskOnServer is not None and
+                  (self._usedMaskPlanes is None or (1 << self._maskDict[name]) & self._usedMaskPlanes)):
+                self._addMaskPlane(name)
+        self._changeMaskLayers(frame, changes, doReplot=True)
+
+    def setRegionBufferOptions(self, maxRegions=None, maxBytes=None, flushInterval=None):
+        """Choose how regions drawn with ``dot`` and ``line`` are batched
+
+        Parameters that are None are left unchanged.
+
+        Parameters:
+        -----------
+        maxRegions : `int`, optional
+            Maximum number of regions sent in one request (default 10000).
+            While buffering, pending regions are sent as soon as there are
+            this many.
+        maxBytes : `int`, optional
+            Maximum size in bytes of the regions sent in one request
+            (default 1 MiB), likewise.
+        flushInterval : `float`, optional
+            When not buffering, send regions this many seconds after the
+            first one is drawn, from a background thread, so that regions
+            drawn in quick succession share a request; on an asynchronous
+            display they are sent in turn with its other requests.  0
+            sends each one at once, as by default.
+        """
+        for buffer in (self._regions, self._lineRegions):
+            if maxRegions is not None:
+                buffer.maxRegions = maxRegions
+            if maxBytes is not None:
+                buffer.maxBytes = maxBytes
+            if flushInterval is not None:
+                buffer.flushInterval = flushInterval or None
+
+    def setLineSimplification(self, tolerance):
+        """Simplify the lines drawn from now on to a tolerance in screen pixels
+
+        Lines drawn with ``line`` and `lines` are simplified with the
+        Douglas-Peucker algorithm, leaving off vertices that are no
+        further than ``tolerance`` screen pixels from the simplified line
+        at the current zoom.  They are simplified again when the zoom
+        changes.  This keeps overlays of contours, trails or streaks with
+        very many vertices fast to upload and render.
+
+        Parameters:
+        -----------
+        tolerance : `float` or None
+            Tolerance in screen pixels; None or 0 turns simplification
+            off for lines drawn from now on.  Lines already drawn
+            simplified are drawn again with the new tolerance.
+        """
+        self._lineTolerance = tolerance or None
+        self._refreshSimplifiedLines(force=True)
+
+    @contextmanager
+    def batchRegions(self):
+        """Return a context manager sending the regions drawn within it
+        in as few requests as possible
+
+        As within ``display.Buffering()``, the regions are sent in requests
+        of at most ``maxRegions`` regions and ``maxBytes`` bytes (see
+        `setRegionBufferOptions`) as they accumulate.  Batches may be
+        nested; the rest are sent when the outermost one ends.
+        """
+        with self._orderedContexts(self._regions.batch(), self._lineRegions.batch()):
+            yield
+
+    @contextmanager
+    def batchActions(self):
+        """Return a context manager dispatching the changes to mask layers
+        made within it together
+
+        Firefly takes one action per request, so the requests are
+        pipelined, in up to ``threads`` connections (see
+        `setDispatchOptions`), each layer's actions in order.  A batch
+        spans all the synchronous frames, so masks may be recolored on
+        several frames in about the time of one round trip; that of an
+        asynchronous frame only spans the frame.  Batches may be nested.
+        """
+        with self._orderedContexts(_actionBatch.batch()):
+            yield
+
+    @contextmanager
+    def _orderedContexts(self, *contexts):
+        """Enter and exit ``contexts`` in order with the requests made to
+        the frame, in the background if the display is asynchronous
+        """
+        stack = ExitStack()
+        for context in contexts:
+            self._enterContext(stack, context)
+        try:
+            yield
+        finally:
+            self._exitContexts(stack)
+
+    @_ordered
+    def _enterContext(self, stack, context):
+        stack.enter_context(context)
+
+    @_ordered
+    def _exitContexts(self, stack):
+        stack.close()
+
+    def setDispatchOptions(self, threads=None):
+        """Choose how batched actions are dispatched, for all frames
+
+        Parameters:
+        -----------
+        threads : `int`, optional
+            Maximum number of requests in flight at once (default 8);
+            1 dispatches the actions one at a time.  Left unchanged if None.
+        """
+        if threads is not None:
+            _actionBatch.nThreads = threads
+
+    @_ordered
+    def dots(self, x, y, symb='+', size=2, ctype=None):
+        """Draw a symbol at each of many points
+
+        Equivalent to calling ``dot`` at each point within
+        `batchRegions`, but the regions of all the points are computed
+        together, which is much faster for whole catalogs.
+
+        Parameters:
+        -----------
+        x, y : array-like
+            Zero-based column and row of each point
+        symb : {'+', 'x', '*', 'o'}
+            Symbol to draw
+        size : `float` or array-like
+            Size of the symbols, in pixels, or of each symbol
+        ctype : `str`, optional
+            Color of the symbols
+        """
+        with self.batchRegions():
+            self._uploadTextData(dotRegions(x, y, symb, size, ctype))
+
+    @_ordered
+    def lines(self, vertices, offsets=None, ctype=None):
+        """Draw many polylines
+
+        Parameters:
+        -----------
+        vertices : array-like, (nVertices, 2)
+            Zero-based (col, row) of the vertices of every polyline
+        offsets : array-like, (nLines + 1,), optional
+            The vertices of polyline ``i`` are
+            ``vertices[offsets[i]:offsets[i+1]]``; by default all the
+            vertices form one polyline
+        ctype : `str`, optional
+            Color of the lines
+        """
+        with self.batchRegions():
+            if self._lineTolerance:
+                self._drawSimplifiedLines(vertices, offsets, ctype)
+            else:
+                self._uploadTextData(lineRegions(vertices, offsets, ctype))
+
+    def mtvMany(self, images, title="", processes=None, connections=8):
+        """Display images in several frames at once
+
+        The images are serialized in a pool of processes, uploaded over up
+        to ``connections`` concurrent keep-alive connections as they are
+        ready, and each is shown with ``mtv`` once its files are uploaded.
+        The processes are spawned, not forked, so that they do not inherit
+        the thread of the Firefly client's websocket, and the connection
+        pool of the client's session is put back as it was once done.
+        At most ``2*connections`` images are serialized ahead of their
+        display, which bounds the memory held by files waiting to be
+        uploaded.  The frames must be Firefly displays; they are created
+        if need be.
+
+        Parameters:
+        -----------
+        images : `dict`
+            Data as passed to ``mtv`` (`lsst.afw.image.Exposure`,
+            `~lsst.afw.image.MaskedImage`, `~lsst.afw.image.Image` or
+            `~lsst.afw.image.Mask`), keyed by frame
+        title : `str`, optional
+            Title of the images; the frame by default
+        processes : `int`, optional
+            Number of processes serializing images; the number of CPUs by
+            default.  0 serializes them in threads of this process.
+        connections : `int`
+            Maximum number of images uploaded at once
+
+        Raises:
+        -------
+        Exception
+            The first error met displaying a frame, once all are done
+        """
+        displays = {frame: afwDisplay.getDisplay(frame) for frame in images}
+        for frame, display in displays.items():
+            if not isinstance(display._impl, DisplayImpl):
+                raise FireflyError(f"Frame {frame} is not a Firefly display")
+
+        if processes == 0:
+            serializePool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        else:
+            serializePool = ProcessPoolExecutor(max_workers=processes,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        pending = threading.BoundedSemaphore(2*connections)
+        with _moreConnections(_fireflyClient.session, connections), serializePool, \
+                ThreadPoolExecutor(max_workers=connections) as uploadPool:
+            shown = []
+            for frame, data in images.items():
+                impl = displays[frame]._impl
+                pending.acquire()
+                files = [(datas, serializePool.submit(_serializeHdus, hdus))
+                         for datas, hdus in impl._preparedFiles(data, title)]
+                future = uploadPool.submit(self._showPrepared, displays[frame], data, title, files)
+                future.add_done_callback(lambda future: pending.release())
+                shown.append(future)
+            errors = [future.exception() for future in shown]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    @staticmethod
+    def _showPrepared(display, data, title, files):
+        """Upload the files serialized for ``mtv(data)`` by `mtvMany`, then
+        display ``data``
+        """
+        impl = display._impl
+        try:
+            for datas, future in files:
+                content, key = future.result()
+                impl._setPrepared(datas, *impl._uploadSerialized((BytesIO(content), key, len(content))))
+            display.mtv(data, title=title)
+        finally:
+            impl._clearPrepared()
+
+    @_ordered
+    def mtvFile(self, path, hdu=0, maskHdu=None, title=""):
+        """Display an image from a FITS file, letting the server read it
+        directly if it can
+
+        Files in the directories declared with `setServerPathMap`, and
+        http(s) URLs, are read by the server itself, so the pixels are
+        neither serialized nor uploaded.  Other local files, and files the
+        server fails to open, are uploaded as they are.  The server only
+        reports whether the request was accepted; a file it is not
+        allowed to read shows an error in the viewer instead.
+
+        Parameters:
+        -----------
+        path : `str` or `lsst.resources.ResourcePath`
+            Local path, ``file://`` URI or http(s) URL of the file
+        hdu : `int`
+            Index of the image to show among the image HDUs of the file,
+            e.g. 0 for the image of a calexp
+        maskHdu : `int`, optional
+            Index of a mask to overlay among the image HDUs, e.g. 1 for
+            the mask of a calexp.  Its planes are read from the ``MP_``
+            keywords of the header of the local file.
+        title : `str`, optional
+            Title of the image; the frame by default
+        """
+        path = str(path)
+        if path.startswith("file://"):
+            path = urllib.parse.unquote(urllib.parse.urlparse(path).path)
+        isUrl = path.startswith(("http://", "https://"))
+        if isUrl and maskHdu is not None:
+            raise FireflyError("Masks can only be overlaid from local files")
+        if title == "":
+            title = str(self.display.frame)
+        self._lastImageBBox = None
+        self._erase()
+
+        ret = {"success": False}
+        if isUrl:
+            fileId = path
+            ret = self._showFits(path, title, hdu)
+        else:
+            fileId = self._serverPath(path)
+            if fileId is not None:
+                ret = self._showFits(None, title, hdu, file=fileId)
+            if not ret["success"]:
+                if not os.path.isfile(path):
+                    raise RuntimeError(f"Cannot read {path} to upload it")
+                fileId, cached = self._uploadFile(path)
+                ret = self._showFits(fileId, title, hdu)
+                if not ret["success"] and cached:
+                    fileId, _ = self._uploadFile(path, refresh=True)
+                    ret = self._showFits(fileId, title, hdu)
+        if not ret["success"]:
+            raise RuntimeError("Display of image failed")
+        self._fireflyFitsID = fileId
+
+        if maskHdu is not None:
+            self._maskDict = _maskPlanesFromFits(path, maskHdu)
+            for k in self._maskDict:
+                self._maskPlaneColors[k] = self.display.getMaskPlaneColor(k)
+            self._fireflyMaskOnServer = fileId
+            self._maskImageNumber = maskHdu
+            # The pixels are not read, so every plane may be in use
+            self._usedMaskPlanes = None
+            self._compositeMask = None
+            with _actionBatch.batch():
+                for k in self._maskDict:
+                    if self._isMaskPlaneShown(k):
+                        self._addMaskPlane(k)
+
+    def clearUploadCache(self):
+        """Forget the files already uploaded to the Firefly server
+
+        Images are normally uploaded once per distinct content and the server
+        file is reused when the same pixels are displayed again.  Call this
+        after the server session has been reset, so that subsequent displays
+        upload their pixels afresh.  Footprint tables are forgotten too.
+        """
+        self._uploadCache.invalidate()
+        self._footprintCache.invalidate()
+
+    @_ordered
     def clearViewer(self):
         """Reinitialize the viewer
         """
         self._client.reinit_viewer()
 
+    @_ordered
     def resetLayout(self):
         """Reset the layout of the Firefly Slate browser
 
@@ -578,10 +1787,90 @@ class DisplayImpl(virtualDevice.DisplayImpl):
         self._client.add_cell(row=0, col=2, width=2, height=3, element_type='xyPlots',
                               cell_id=plots_cell_id)
 
+    @_ordered
+    def overlayCatalog(self, catalog, xcol=None, ycol=None, columns=None, coordSys='ZERO_BASED',
+                       color=None, symbol=None, tableFormat='fits', selection='all',
+                       layerString='catalog ', titleString='catalog '):
+        """Overlay markers at the positions of the sources of a catalog
+
+        The positions are uploaded once as a compact table, which Firefly
+        lists and draws as a catalog overlay; this is much faster than
+        drawing a region per source with ``dot`` or `dots` for large
+        catalogs.
+
+        Parameters:
+        -----------
+        catalog : `lsst.afw.table.SourceCatalog`
+            Source catalog to overlay
+        xcol, ycol : `str`, optional
+            Coordinate columns.  By default the centroid slot is used, or
+            failing that coord_ra and coord_dec or the SDSS centroid.
+        columns : `list` of `str`, optional
+            Other columns to list in the table
+        coordSys : {'ZERO_BASED', 'EQ_J2000'}
+            Coordinate system of ``xcol`` and ``ycol``: zero-based pixels or
+            equatorial coordinates
+        color : `str`, optional
+            Color of the markers
+        symbol : `str`, optional
+            Firefly marker symbol, e.g. 'CIRCLE', 'CROSS', 'X' or 'SQUARE'
+        tableFormat : {'votable', 'fits', 'parquet', 'arrow'}
+            Format in which the table is uploaded; 'parquet' and 'arrow'
+            need pyarrow
+        selection : `str` or `numpy.ndarray`
+            Sources to overlay: 'all', 'blended parents', 'deblended
+            children', 'isolated', or a boolean array with one entry per
+            record
+        layerString : `str`
+            Table id, to concatenate with the frame; re-using it replaces
+            the previous table and its markers
+        titleString : `str`
+            Title of the table, to concatenate with the frame
+
+        Raises:
+        -------
+        RuntimeError
+            The server failed to show the table
+
+        Notes:
+        ------
+        Identical tables are uploaded once, as for images.
+        """
+        if tableFormat not in TABLE_FORMATS:
+            raise FireflyError(f"Unknown catalog table format {tableFormat!r}; "
+                               f"please choose one of {TABLE_FORMATS}")
+        table, meta = createCatalogTable(catalog, xcol, ycol, columns, coordSys, tableFormat, selection)
+        if color:
+            meta['DEFAULT_COLOR'] = color
+        if symbol:
+            meta['DEFAULT_SYMBOL'] = symbol
+        payload = self._serializeTable(table, tableFormat)
+        key = contentKey([payload])
+
+        def show(refresh=False):
+            tableval, cached = self._cachedUpload(key, len(payload), lambda: self._uploadPayload(payload),
+                                                  refresh)
+            ret = self._client.show_table(file_on_server=tableval,
+                                          tbl_id=layerString + str(self.display.frame),
+                                          title=titleString + str(self.display.frame),
+                                          is_catalog=True, meta=meta)
+            return ret, cached
+
+        ret, cached = show()
+        if not ret["success"] and cached:
+            # The server may have dropped the file since it was cached
+            _LOG.debug("Uploading catalog table again")
+            ret, _ = show(refresh=True)
+        if not ret["success"]:
+            raise RuntimeError("Display of catalog failed")
+
+    @_ordered
     def overlayFootprints(self, catalog, color='rgba(74,144,226,0.60)',
                           highlightColor='cyan', selectColor='orange',
                           style='fill', layerString='detection footprints ',
-                          titleString='catalog footprints '):
+                          titleString='catalog footprints ', nWorkers=1, tableFormat='votable',
+                          cull=False, viewSize=1024, margin=0.5, levelOfDetail=False,
+                          detailZooms=(1.0, 0.25), chunkSize=None, selection='all'):
         """Overlay outlines of footprints from a catalog
 
         Overlay outlines of LSST footprints from the input catalog. The colors
@@ -611,20 +1900,291 @@ class DisplayImpl(virtualDevice.DisplayImpl):
             footprints
         titleString: `str`
             Title of catalog, to concatenate with the frame
+        nWorkers : `int`
+            Number of processes with which to build the footprints table
+        tableFormat : {'votable', 'fits', 'parquet', 'arrow'}
+            Format in which the footprints table is uploaded. 'fits' is a
+            compact binary table (see `createFootprintsHdu`), much faster
+            to build and smaller to upload for crowded fields.  'parquet'
+            and 'arrow' (Arrow IPC) are columnar tables built the same way
+            (see `createFootprintsArrow`), and need pyarrow.
+        cull : `bool`
+            Only upload the footprints in view, as set by the last `pan`
+            and `zoom`, and upload more as the view is panned and zoomed.
+            Until a zoom has been set the whole catalog is uploaded; if
+            there has been no `pan` the view is taken to be centred on the
+            image.
+        viewSize : `int` or (`int`, `int`)
+            Width and height of the Firefly viewer in screen pixels, used
+            to work out the region in view when culling
+        margin : `float`
+            Fraction of the view's size by which the region uploaded when
+            culling extends beyond the view on each side, so that small
+            pans need no new upload
+        levelOfDetail : `bool`
+            Choose how to draw the footprints from the zoom: full footprints
+            when zoomed in, simplified outlines further out, and boxes or
+            points when zoomed out.  The footprints are redrawn as the zoom
+            changes.  Outlines, boxes and points are drawn as regions, and
+            are not listed in a table.
+        detailZooms : (`float`, `float`)
+            Lowest zooms (screen pixels per image pixel) at which full
+            footprints and outlines are drawn, respectively
+        chunkSize : `int`, optional
+            Upload the catalog in chunks of this many records, each shown as
+            soon as it is uploaded, as its own layer: ``layerString`` and
+            the frame followed by the chunk number.  The memory used then
+            depends on the chunk size rather than the size of the catalog.
+            Cannot be combined with ``cull`` or ``levelOfDetail``.
+        selection : `str` or `numpy.ndarray`
+            Footprints to overlay: 'all', 'blended parents', 'deblended
+            children', 'isolated', or a boolean array with one entry per
+            record.  Only the selected records are uploaded.
+
+        Notes:
+        ------
+        The serialized table and its server file are cached, keyed by the
+        content of the catalog, so overlaying the same catalog again, e.g.
+        with another ``color`` or ``style``, only sends the new style.
+        """
+        if tableFormat not in TABLE_FORMATS:
+            raise FireflyError(f"Unknown footprints table format {tableFormat!r}; "
+                               f"please choose one of {TABLE_FORMATS}")
+        if chunkSize and (cull or levelOfDetail):
+            raise FireflyError("Footprints cannot be uploaded in chunks when culled or "
+                               "drawn at a level of detail")
+        catalog = selectCatalog(catalog, selection)
+        layerId = layerString + str(self.display.frame)
+        for chunkLayerId in self._footprintChunkLayers.pop(layerId, []):
+            self._client.dispatch(action_type='DrawLayerCntlr.destroyDrawLayer',
+                                  payload=dict(drawLayerId=chunkLayerId))
+        if (chunkSize or cull or levelOfDetail) and layerId in self._footprintTableLayers:
+            # The new overlay is drawn in layers of other names, so would
+            # not replace the table overlaid under this one
+            self._footprintTableLayers.discard(layerId)
+            self._client.dispatch(action_type='DrawLayerCntlr.destroyDrawLayer',
+                                  payload=dict(drawLayerId=layerId))
+        overlay = _FootprintOverlay(catalog, tableFormat, nWorkers,
+                                    dict(title=titleString + str(self.display.frame),
+                                         footprint_layer_id=layerId,
+                                         plot_id=str(self.display.frame),
+                                         color=color,
+                                         highlightColor=highlightColor,
+                                         selectColor=selectColor,
+                                         style=style))
+        previous = self._footprintOverlays.pop(layerId, None)
+        if previous is not None:
+            self._clearFootprintOverlay(previous)
+        if chunkSize:
+            self._overlayFootprintChunks(overlay, catalog, chunkSize)
+            return
+        if not (cull or levelOfDetail):
+            self._overlayFootprintTable(overlay, catalog)
+            self._footprintTableLayers.add(layerId)
+            return
+
+        overlay.index = FootprintGridIndex(footprintBBoxes(catalog))
+        overlay.cull = cull
+        overlay.viewSize = viewSize
+        overlay.margin = margin
+        overlay.detailZooms = detailZooms if levelOfDetail else None
+        self._footprintOverlays[layerId] = overlay
+        self._refreshFootprintOverlay(overlay)
+
+    def _overlayFootprintChunks(self, overlay, catalog, chunkSize):
+        """Upload and overlay the footprints of ``catalog`` a chunk at a time"""
+        layerId = overlay.style['footprint_layer_id']
+        chunkLayers = self._footprintChunkLayers[layerId] = []
+        chunks = iterFootprintsTables(catalog, chunkSize, nWorkers=overlay.nWorkers,
+                                      tableFormat=overlay.tableFormat)
+        for i, (start, stop, table) in enumerate(chunks):
+            tableval = self._uploadPayload(self._serializeTable(table, overlay.tableFormat))
+            del table
+            style = dict(overlay.style, footprint_layer_id=f"{layerId} {i + 1}",
+                         title=f"{overlay.style['title']} [{start}:{stop}]")
+            self._client.overlay_footprints(footprint_file=tableval, **style)
+            chunkLayers.append(style['footprint_layer_id'])
+            _LOG.debug("Overlaid footprints %d to %d of %d", start, stop, len(catalog))
+
+    def _overlayFootprintTable(self, overlay, catalog, style=None):
+        """Upload the footprints table of ``catalog``, unless cached, and
+        overlay it as described by ``overlay``, or by ``style`` if given
+
+        The table is only cached once the server has overlaid it.
+        """
+        if style is None:
+            style = overlay.style
+        key = f"{overlay.tableFormat}:{catalogFingerprint(catalog)}"
+        payload, tableval = self._footprintCache.get(key) or (None, None)
+        cached = tableval is not None
+        if payload is None:
+            payload = self._serializeFootprints(catalog, overlay.tableFormat, overlay.nWorkers)
+            tableval = self._uploadPayload(payload)
+
+        ret = self._client.overlay_footprints(footprint_file=tableval, **style)
+        if not ret["success"] and cached:
+            # The server may have dropped the file since it was cached
+            _LOG.debug("Uploading footprints table again")
+            tableval = self._uploadPayload(payload)
+            ret = self._client.overlay_footprints(footprint_file=tableval, **style)
+        if not ret["success"]:
+            self._footprintCache.invalidate(key)
+            raise RuntimeError("Display of footprints failed")
+        self._footprintCache.put(key, (payload, tableval), len(payload))
+
+    def _viewBounds(self, viewSize):
+        """Return the region in view, (minX, minY, maxX, maxY) in parent
+        pixels, or None if it is not known
+        """
+        if not self._lastZoom or self._lastImageBBox is None:
+            return None
+        width, height = (viewSize, viewSize) if np.isscalar(viewSize) else viewSize
+        x0, y0 = self._lastImageBBox.getMinX(), self._lastImageBBox.getMinY()
+        if self._lastPan:
+            # _lastPan is in Firefly's convention, with the first pixel at 0.5
+            xc, yc = self._lastPan[0] - 0.5 + x0, self._lastPan[1] - 0.5 + y0
+        else:
+            xc = x0 + 0.5*(self._lastImageBBox.getWidth() - 1)
+            yc = y0 + 0.5*(self._lastImageBBox.getHeight() - 1)
+        halfWidth, halfHeight = 0.5*width/self._lastZoom, 0.5*height/self._lastZoom
+        return (xc - halfWidth, yc - halfHeight, xc + halfWidth, yc + halfHeight)
+
+    def _refreshFootprintOverlays(self):
+        """Upload any footprints brought into view by a pan or zoom"""
+        for overlay in self._footprintOverlays.values():
+            self._refreshFootprintOverlay(overlay)
+
+    def _displayZoom(self, viewSize):
+        """Return the zoom of the display, or None if it is not known
+
+        Until a zoom is set Firefly fits the image to the viewer.
+        """
+        if self._lastZoom:
+            return self._lastZoom
+        if self._lastImageBBox is None:
+            return None
+        width, height = (viewSize, viewSize) if np.isscalar(viewSize) else viewSize
+        return min(width/self._lastImageBBox.getWidth(), height/self._lastImageBBox.getHeight())
+
+    def _detailLevel(self, overlay):
+        """Return how to draw a footprints overlay at the current zoom:
+        0 for full footprints, 1 for outlines, 2 for boxes and points
         """
-        footprintTable = createFootprintsTable(catalog)
+        zoom = self._displayZoom(overlay.viewSize)
+        if overlay.detailZooms is None or zoom is None:
+            return 0
+        fullZoom, outlineZoom = overlay.detailZooms
+        return 0 if zoom >= fullZoom else 1 if zoom >= outlineZoom else 2
+
+    def _clearFootprintOverlay(self, overlay):
+        """Remove what is drawn of an overlay kept by `_refreshFootprintOverlay`"""
+        for layerId in overlay.layers:
+            self._client.dispatch(action_type='DrawLayerCntlr.destroyDrawLayer',
+                                  payload=dict(drawLayerId=layerId))
+        if overlay.shown.any() and overlay.level != 0:
+            self._client.delete_region_layer(overlay.regionLayerId, plot_id=overlay.style['plot_id'])
+        overlay.regions = []
+        overlay.shown[:] = False
+        overlay.layers = []
+
+    def _refreshFootprintOverlay(self, overlay):
+        """Overlay the footprints of a culled or level-of-detail overlay
+        that are in view, at the level of detail for the current zoom
+
+        Footprints already drawn at the current level stay in the overlay.
+        Full footprints coming into view are uploaded as a layer of their
+        own, ``footprint_layer_id`` followed by the layer number, unless the
+        whole catalog is drawn at once; outlines, boxes and points are added
+        to the region layer.
+        """
+        level = self._detailLevel(overlay)
+        if level != overlay.level:
+            self._clearFootprintOverlay(overlay)
+            overlay.level = level
+
+        view = self._viewBounds(overlay.viewSize) if overlay.cull else None
+        if view is None:
+            shown = np.ones(len(overlay.index), dtype=bool)
+        else:
+            if any(_contains(region, view) for region in overlay.regions):
+                return
+            minX, minY, maxX, maxY = view
+            padX, padY = overlay.margin*(maxX - minX), overlay.margin*(maxY - minY)
+            region = (minX - padX, minY - padY, maxX + padX, maxY + padY)
+            overlay.regions.append(region)
+            shown = overlay.shown.copy()
+            shown[overlay.index.query(*region)] = True
+        new = shown & ~overlay.shown
+        if not new.any():
+            return
+        _LOG.debug("Overlaying %d more of %d footprints at level %d", new.sum(), len(new), level)
+
+        if level == 0:
+            try:
+                if new.all():
+                    style = overlay.style
+                    self._overlayFootprintTable(overlay, overlay.catalog)
+                else:
+                    n = len(overlay.layers) + 1
+                    style = dict(overlay.style,
+                                 footprint_layer_id=f"{overlay.style['footprint_layer_id']} {n}",
+                                 title=f"{overlay.style['title']} {n}")
+                    self._overlayFootprintTable(overlay, subsetCatalog(overlay.catalog, new), style)
+            except Exception:
+                # Try again when the region is next in view
+                if view is not None:
+                    overlay.regions.pop()
+                raise
+            overlay.layers.append(style['footprint_layer_id'])
+            overlay.shown = shown
+            return
+        newLayer = not overlay.shown.any()
+        overlay.shown = shown
+
+        box = self._lastImageBBox
+        x0, y0 = (box.getMinX(), box.getMinY()) if box is not None else (0, 0)
+        if level == 1:
+            fp = extractFootprintArrays(subsetCatalog(overlay.catalog, new), (x0, y0), overlay.nWorkers)
+            regions = polygonRegions(*footprintOutlines(fp), ctype=overlay.style['color'])
+        else:
+            bboxes = overlay.index.bboxes[new]
+            bboxes = bboxes[bboxes[:, 2] >= bboxes[:, 0]] - np.array([x0, y0, x0, y0])
+            regions = boxRegions(bboxes, ctype=overlay.style['color'],
+                                 pointBelow=3/self._displayZoom(overlay.viewSize))
+        self._client.add_region_data(region_data=regions, plot_id=overlay.style['plot_id'],
+                                     region_layer_id=overlay.regionLayerId)
+        if newLayer and splitAlpha(overlay.style['color'])[1] is not None:
+            # DS9 regions have no alpha, so the layer is given the color with it
+            self._client.dispatch(action_type='DrawLayerCntlr.changeDrawingDef',
+                                  payload=dict(drawLayerId=overlay.regionLayerId,
+                                               plotId=overlay.style['plot_id'],
+                                               drawingDef=dict(color=overlay.style['color'])))
+
+    @classmethod
+    def _serializeFootprints(cls, catalog, tableFormat, nWorkers=1):
+        """Return the footprints table of ``catalog`` as bytes in ``tableFormat``"""
+        create = {'votable': createFootprintsTable, 'fits': createFootprintsHdu,
+                  'parquet': createFootprintsArrow, 'arrow': createFootprintsArrow}[tableFormat]
+        return cls._serializeTable(create(catalog, nWorkers=nWorkers), tableFormat)
+
+    @staticmethod
+    def _serializeTable(table, tableFormat):
+        """Return a footprints or catalog table as bytes in ``tableFormat``"""
         with BytesIO() as fd:
-            footprintTable.to_xml(fd)
-            tableval = self._client.upload_data(fd, 'UNKNOWN')
-        self._client.overlay_footprints(footprint_file=tableval,
-                                        title=titleString + str(self.display.frame),
-                                        footprint_layer_id=layerString + str(self.display.frame),
-                                        plot_id=str(self.display.frame),
-                                        color=color,
-                                        highlightColor=highlightColor,
-                                        selectColor=selectColor,
-                                        style=style)
+            if tableFormat == 'votable':
+                table.to_xml(fd)
+            elif tableFormat == 'fits':
+                fitsWriter.writeFits(fd, [table])
+            else:
+                writeArrowTable(fd, table, tableFormat)
+            return fd.getvalue()
+
+    def _uploadPayload(self, payload):
+        """Upload a table held in memory, returning its server file"""
+        with BytesIO(payload) as fd:
+            return self._client.upload_data(fd, 'UNKNOWN')
 
+    @_ordered
     def alignImages(self, match_type="Standard", lock_match=True):
         """Align and optionally lock the orientation of the images being
         displayed.
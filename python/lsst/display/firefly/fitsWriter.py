@@ -0,0 +1,553 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Serialization of afw images to (multi-extension) FITS for upload
+
+The pixels are converted to FITS byte order a block of rows at a time, so
+the only full-size copy is the one the caller chooses to write to.  Images
+may also be written tile-compressed, following the FITS tiled image
+compression convention, with the tiles compressed in parallel threads.
+Binary tables whose variable-length columns are held as flat arrays can be
+written too.
+"""
+
+import logging
+import os
+import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+from astropy.io.fits.verify import VerifyWarning
+from astropy.units import UnitsWarning
+
+import lsst.geom as geom
+
+_LOG = logging.getLogger(__name__)
+
+FITS_BLOCK = 2880
+
+COMPRESSION_TYPES = ("GZIP_1", "GZIP_2")
+
+# Integer written for non-finite pixels of quantized floating-point images
+_ZBLANK = -2147483648
+
+# Keywords describing the layout of an HDU; these are generated by the
+# writer and never copied from user metadata.
+_STRUCTURAL_KEYS = {"SIMPLE", "XTENSION", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "EXTEND",
+                    "PCOUNT", "GCOUNT", "BZERO", "BSCALE", "EXTNAME", "END"}
+
+# Binary table format codes of the types allowed in variable-length columns
+_TFORM_CODES = {np.dtype(np.uint8): "B", np.dtype(np.int16): "I", np.dtype(np.int32): "J",
+                np.dtype(np.int64): "K", np.dtype(np.float32): "E", np.dtype(np.float64): "D"}
+
+_BITPIX = {np.dtype(np.uint8): 8, np.dtype(np.int16): 16, np.dtype(np.int32): 32,
+           np.dtype(np.int64): 64, np.dtype(np.float32): -32, np.dtype(np.float64): -64}
+
+
+def _padding(nbytes):
+    """Return the number of bytes needed to fill out the last FITS block"""
+    return -nbytes % FITS_BLOCK
+
+
+def imageHeader(data, wcs=None, title="", metadata=None):
+    """Return the non-structural header cards for an afw image
+
+    Parameters:
+    -----------
+    data : `lsst.afw.image.Image` or `lsst.afw.image.Mask`
+        Image whose origin is recorded as the physical coordinate system
+    wcs : `lsst.afw.geom.SkyWcs` or None
+        WCS of ``data``'s parent pixel coordinates
+    title : `str`
+        Written as the OBJECT keyword
+    metadata : `lsst.daf.base.PropertyList` or None
+        Additional cards; keywords describing the HDU layout are skipped
+
+    Returns:
+    --------
+    `astropy.io.fits.Header`
+        Header cards, without the structural keywords
+    """
+    header = fits.Header()
+    x0, y0 = data.getXY0()
+    if title:
+        header["OBJECT"] = title
+    header["LTV1"] = -x0
+    header["LTV2"] = -y0
+    header["WCSNAMEA"] = "PHYSICAL"
+    for i, v in ((1, x0), (2, y0)):
+        header[f"CTYPE{i}A"] = "LINEAR"
+        header[f"CUNIT{i}A"] = "PIXEL"
+        header[f"CRPIX{i}A"] = 1
+        header[f"CRVAL{i}A"] = v
+
+    if wcs is not None:
+        try:
+            wcsMetadata = wcs.copyAtShiftedPixelOrigin(geom.Extent2D(-x0, -y0)).getFitsMetadata()
+        except Exception as e:
+            _LOG.warning("Cannot write WCS to the FITS header: %s", e)
+        else:
+            _appendCards(header, wcsMetadata)
+    if metadata is not None:
+        _appendCards(header, metadata)
+    return header
+
+
+def _appendCards(header, propertyList):
+    """Append the entries of a PropertyList to a FITS header
+
+    Entries that cannot be represented as FITS cards are skipped.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", VerifyWarning)
+        for key, value in propertyList.toOrderedDict().items():
+            if key in _STRUCTURAL_KEYS:
+                continue
+            values = value if isinstance(value, list) else [value]
+            for v in values:
+                try:
+                    if key in ("COMMENT", "HISTORY"):
+                        header.append((key, v))
+                    else:
+                        header[key] = v
+                except (ValueError, TypeError) as e:
+                    _LOG.debug("Skipping FITS card %s=%r: %s", key, v, e)
+
+
+class ImageHdu:
+    """A two-dimensional image HDU, written a block of rows at a time
+
+    Parameters:
+    -----------
+    array : `numpy.ndarray`
+        Pixels, indexed as [row, column]; need not be contiguous.
+        Unsigned integers are written with the usual BZERO offset.
+    header : `astropy.io.fits.Header`, optional
+        Non-structural header cards
+    extname : `str`, optional
+        Value of the EXTNAME keyword
+    """
+
+    canBePrimary = True
+
+    def __init__(self, array, header=None, extname=None):
+        self.array = array
+        self.header = header if header is not None else fits.Header()
+        self.extname = extname
+
+        dtype = array.dtype
+        if dtype.kind == "u" and dtype.itemsize > 1:
+            self._fileDtype = np.dtype(f"i{dtype.itemsize}")
+            self._bzero = 1 << (8*dtype.itemsize - 1)
+        else:
+            self._fileDtype = dtype.newbyteorder("=")
+            self._bzero = None
+        if self._fileDtype not in _BITPIX:
+            raise TypeError(f"Cannot write pixels of type {dtype} to FITS")
+        self._fileDtype = self._fileDtype.newbyteorder(">")
+
+    def makeHeader(self, primary, extend=False):
+        """Return the complete header of this HDU
+
+        Parameters:
+        -----------
+        primary : `bool`
+            Write this HDU as the primary HDU
+        extend : `bool`
+            Set the EXTEND keyword of a primary HDU
+        """
+        height, width = self.array.shape
+        header = fits.Header()
+        if primary:
+            header["SIMPLE"] = True
+        else:
+            header["XTENSION"] = "IMAGE"
+        header["BITPIX"] = _BITPIX[self._fileDtype.newbyteorder("=")]
+        header["NAXIS"] = 2
+        header["NAXIS1"] = width
+        header["NAXIS2"] = height
+        if primary:
+            header["EXTEND"] = extend
+        else:
+            header["PCOUNT"] = 0
+            header["GCOUNT"] = 1
+        if self.extname:
+            header["EXTNAME"] = self.extname
+        if self._bzero is not None:
+            header["BSCALE"] = 1
+            header["BZERO"] = self._bzero
+        header.extend(self.header)
+        return header
+
+    @property
+    def dataLength(self):
+        """Length in bytes of the data unit, without padding"""
+        return self.array.size*self._fileDtype.itemsize
+
+    def iterData(self, chunkBytes):
+        """Yield the data unit, converted to FITS byte order, in row blocks
+
+        Parameters:
+        -----------
+        chunkBytes : `int`
+            Approximate size of each block; at least one row is yielded at
+            a time.
+        """
+        height, width = self.array.shape
+        rowBytes = max(1, width*self._fileDtype.itemsize)
+        nRows = max(1, chunkBytes//rowBytes)
+        for y in range(0, height, nRows):
+            yield self._fileRows(self.array[y:y + nRows]).tobytes()
+
+    def _fileRows(self, rows):
+        """Return ``rows`` of the array converted to the FITS representation"""
+        if self._bzero is not None:
+            signBit = rows.dtype.type(self._bzero)
+            rows = (rows ^ signBit).view(self._fileDtype.newbyteorder("="))
+        return rows.astype(self._fileDtype, copy=False)
+
+
+class CompressedImageHdu(ImageHdu):
+    """A two-dimensional image HDU written as a tile-compressed binary table
+
+    The image is divided into tiles of whole rows, which are compressed in
+    a pool of threads (zlib releases the GIL) the first time the header or
+    data are needed.  Only the compressed tiles are held in memory.
+
+    Parameters:
+    -----------
+    array : `numpy.ndarray`
+        Pixels, indexed as [row, column]
+    header : `astropy.io.fits.Header`, optional
+        Non-structural header cards
+    extname : `str`, optional
+        Value of the EXTNAME keyword
+    compression : {'GZIP_1', 'GZIP_2'}
+        Lossless compression of each tile's bytes; GZIP_2 shuffles the
+        bytes of the pixels first, which suits floating-point data.
+    quantizeLevel : `float`, optional
+        If set, floating-point pixels are quantized to integers before
+        compression, with a step of the tile's noise divided by
+        ``quantizeLevel`` (so larger values are less lossy).  Integer
+        images are always compressed losslessly.
+    tileRows : `int`, optional
+        Number of rows per tile; by default about 64k pixels per tile.
+    nThreads : `int`, optional
+        Number of compression threads; defaults to the number of CPUs.
+    level : `int`
+        zlib compression level
+    """
+
+    canBePrimary = False
+
+    def __init__(self, array, header=None, extname=None, compression="GZIP_2", quantizeLevel=None,
+                 tileRows=None, nThreads=None, level=1):
+        super().__init__(array, header, extname)
+        if compression not in COMPRESSION_TYPES:
+            raise ValueError(f"Unknown compression {compression}; please choose one of {COMPRESSION_TYPES}")
+        self.compression = compression
+        self.quantize = quantizeLevel is not None and array.dtype.kind == "f"
+        self.quantizeLevel = quantizeLevel
+        height, width = array.shape
+        self.tileRows = tileRows or max(1, (1 << 16)//max(1, width))
+        self.nThreads = nThreads or os.cpu_count() or 1
+        self.level = level
+        self._tiles = None
+
+    def _compressTile(self, y):
+        """Return the compressed bytes, scale and zero point of the tile at row ``y``"""
+        rows = self.array[y:y + self.tileRows]
+        scale, zero = 1.0, 0.0
+        if self.quantize:
+            finite = np.isfinite(rows)
+            values = rows[finite]
+            if values.size:
+                vmin, vmax = float(values.min()), float(values.max())
+                noise = 1.4826*float(np.median(np.abs(np.diff(values))))/np.sqrt(2) if values.size > 1 else 0
+                zero = 0.5*(vmin + vmax)
+                # The step must also keep the quantized values within int32
+                scale = max(noise/self.quantizeLevel, (vmax - vmin)/(2.0**32 - 4)) or 1.0
+            quantized = np.round((rows - zero)/scale)
+            quantized[~finite] = _ZBLANK
+            data = quantized.astype(">i4")
+        else:
+            data = self._fileRows(rows)
+        raw = np.ascontiguousarray(data).view(np.uint8)
+        if self.compression == "GZIP_2":
+            raw = raw.reshape(-1, data.dtype.itemsize).T
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # gzip format
+        return compressor.compress(raw.tobytes()) + compressor.flush(), scale, zero
+
+    @property
+    def tiles(self):
+        """List of (compressed bytes, scale, zero point) for each tile"""
+        if self._tiles is None:
+            starts = range(0, self.array.shape[0], self.tileRows)
+            if self.nThreads > 1 and len(starts) > 1:
+                with ThreadPoolExecutor(max_workers=self.nThreads) as pool:
+                    self._tiles = list(pool.map(self._compressTile, starts))
+            else:
+                self._tiles = [self._compressTile(y) for y in starts]
+        return self._tiles
+
+    @property
+    def _rowBytes(self):
+        return 24 if self.quantize else 8
+
+    def makeHeader(self, primary, extend=False):
+        if primary:
+            raise ValueError("A compressed image cannot be the primary HDU")
+        height, width = self.array.shape
+        tiles = self.tiles
+        header = fits.Header()
+        header["XTENSION"] = "BINTABLE"
+        header["BITPIX"] = 8
+        header["NAXIS"] = 2
+        header["NAXIS1"] = self._rowBytes
+        header["NAXIS2"] = len(tiles)
+        header["PCOUNT"] = sum(len(t[0]) for t in tiles)
+        header["GCOUNT"] = 1
+        header["TFIELDS"] = 3 if self.quantize else 1
+        header["TTYPE1"] = "COMPRESSED_DATA"
+        header["TFORM1"] = f"1PB({max(len(t[0]) for t in tiles)})"
+        if self.quantize:
+            header["TTYPE2"] = "ZSCALE"
+            header["TFORM2"] = "1D"
+            header["TTYPE3"] = "ZZERO"
+            header["TFORM3"] = "1D"
+        header["ZIMAGE"] = True
+        header["ZBITPIX"] = -32 if self.quantize else _BITPIX[self._fileDtype.newbyteorder("=")]
+        header["ZNAXIS"] = 2
+        header["ZNAXIS1"] = width
+        header["ZNAXIS2"] = height
+        header["ZTILE1"] = width
+        header["ZTILE2"] = self.tileRows
+        header["ZCMPTYPE"] = self.compression
+        if self.quantize:
+            header["ZQUANTIZ"] = "NO_DITHER"
+            header["ZBLANK"] = _ZBLANK
+        if self.extname:
+            header["EXTNAME"] = self.extname
+        if self._bzero is not None:
+            header["BSCALE"] = 1
+            header["BZERO"] = self._bzero
+        header.extend(self.header)
+        return header
+
+    @property
+    def dataLength(self):
+        tiles = self.tiles
+        return len(tiles)*self._rowBytes + sum(len(t[0]) for t in tiles)
+
+    def iterData(self, chunkBytes):
+        tiles = self.tiles
+        columns = [("nbytes", ">i4"), ("offset", ">i4")]
+        if self.quantize:
+            columns += [("scale", ">f8"), ("zero", ">f8")]
+        table = np.zeros(len(tiles), dtype=columns)
+        table["nbytes"] = [len(t[0]) for t in tiles]
+        table["offset"] = np.concatenate(([0], np.cumsum(table["nbytes"])[:-1]))
+        if self.quantize:
+            table["scale"] = [t[1] for t in tiles]
+            table["zero"] = [t[2] for t in tiles]
+        yield table.tobytes()
+        for compressed, _, _ in tiles:
+            yield compressed
+
+
+class TableHdu:
+    """A binary table HDU with variable-length array columns
+
+    Each variable-length column is given as a single flat array holding the
+    values of all the rows, one row after the other, and the offsets of the
+    rows within it.  The flat arrays are written as the table's heap, so the
+    column is never split into per-row arrays.
+
+    Parameters:
+    -----------
+    table : `astropy.table.Table`
+        Fixed-width columns
+    varColumns : `dict` [`str`, (`numpy.ndarray`, `numpy.ndarray`)]
+        Flat values and offsets of the variable-length columns, which
+        follow the fixed-width ones.  The values of row ``i`` are
+        ``flat[offsets[i]:offsets[i+1]]``.
+    header : `astropy.io.fits.Header`, optional
+        Non-structural header cards
+    extname : `str`, optional
+        Value of the EXTNAME keyword
+    """
+
+    canBePrimary = False
+
+    def __init__(self, table, varColumns, header=None, extname=None):
+        self.header = header if header is not None else fits.Header()
+        self.extname = extname
+        self._heap = []
+        heapBytes = 0
+        for flat, offsets in varColumns.values():
+            flat = np.asarray(flat)
+            if flat.dtype.newbyteorder("=") not in _TFORM_CODES:
+                raise TypeError(f"Cannot write a variable-length column of type {flat.dtype} to FITS")
+            self._heap.append(flat.astype(flat.dtype.newbyteorder(">"), copy=False))
+            heapBytes += flat.nbytes
+        self._heapBytes = heapBytes
+        # Descriptors are (count, offset) pairs; 64-bit ones are only needed
+        # for heaps of 2 GiB or more.
+        self._descriptorCode = "P" if heapBytes < 1 << 31 else "Q"
+        descriptorType = np.int32 if self._descriptorCode == "P" else np.int64
+
+        fixed = table.__class__(table, copy=False)
+        for name in varColumns:
+            fixed[name] = np.zeros((len(table), 2), dtype=descriptorType)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UnitsWarning)
+            hdu = fits.table_to_hdu(fixed)
+        self._tableHeader = hdu.header
+        rows = np.asarray(hdu.data).view(np.ndarray)
+        self._rows = rows.astype(rows.dtype.newbyteorder(">"))
+
+        heapOffset = 0
+        self._varForms = {}
+        for (name, (flat, offsets)), heap in zip(varColumns.items(), self._heap):
+            offsets = np.asarray(offsets)
+            counts = np.diff(offsets)
+            self._rows[name][:, 0] = counts
+            self._rows[name][:, 1] = heapOffset + offsets[:-1]*heap.itemsize
+            code = _TFORM_CODES[heap.dtype.newbyteorder("=")]
+            self._varForms[name] = f"{self._descriptorCode}{code}({counts.max() if len(counts) else 0})"
+            heapOffset += heap.nbytes
+
+    def makeHeader(self, primary, extend=False):
+        if primary:
+            raise ValueError("A binary table cannot be the primary HDU")
+        header = self._tableHeader.copy()
+        header["PCOUNT"] = self._heapBytes
+        for i in range(1, header["TFIELDS"] + 1):
+            name = header[f"TTYPE{i}"]
+            if name in self._varForms:
+                header[f"TFORM{i}"] = self._varForms[name]
+                header.remove(f"TDIM{i}", ignore_missing=True)
+        if self.extname:
+            header["EXTNAME"] = self.extname
+        header.extend(self.header)
+        return header
+
+    @property
+    def dataLength(self):
+        return self._rows.nbytes + self._heapBytes
+
+    def iterData(self, chunkBytes):
+        rowBytes = max(1, self._rows.dtype.itemsize)
+        nRows = max(1, chunkBytes//rowBytes)
+        for start in range(0, len(self._rows), nRows):
+            yield self._rows[start:start + nRows].tobytes()
+        for heap in self._heap:
+            nValues = max(1, chunkBytes//heap.itemsize)
+            for start in range(0, len(heap), nValues):
+                yield heap[start:start + nValues].tobytes()
+
+
+class _EmptyPrimaryHdu:
+    """Primary HDU without data, for files whose first HDU must be an extension"""
+
+    canBePrimary = True
+    dataLength = 0
+
+    def makeHeader(self, primary, extend=False):
+        header = fits.Header()
+        header["SIMPLE"] = True
+        header["BITPIX"] = 8
+        header["NAXIS"] = 0
+        header["EXTEND"] = True
+        return header
+
+    def iterData(self, chunkBytes):
+        return iter(())
+
+
+def makeImageHdu(data, wcs=None, title="", metadata=None, extname=None, compression=None, array=None,
+                 **compressionKwargs):
+    """Make an `ImageHdu` from an afw Image or Mask
+
+    If ``compression`` is set a `CompressedImageHdu` is returned, to which
+    ``compressionKwargs`` are passed.  If ``array`` is given those pixels,
+    e.g. computed from ``data``'s, are written instead of ``data``'s.  See
+    `imageHeader` for the other parameters.
+    """
+    header = imageHeader(data, wcs, title, metadata)
+    if array is None:
+        array = data.getArray()
+    if compression:
+        return CompressedImageHdu(array, header, extname, compression, **compressionKwargs)
+    return ImageHdu(array, header, extname)
+
+
+def _withPrimary(hdus):
+    """Return ``hdus``, preceded by an empty primary HDU if needed"""
+    if hdus and not hdus[0].canBePrimary:
+        return [_EmptyPrimaryHdu()] + list(hdus)
+    return hdus
+
+
+def _headerBytes(hdus):
+    """Yield the encoded header of each of ``hdus``, the first being primary"""
+    for i, hdu in enumerate(hdus):
+        yield hdu.makeHeader(primary=(i == 0), extend=(len(hdus) > 1)).tostring().encode("ascii")
+
+
+def fitsLength(hdus):
+    """Return the length in bytes of the FITS file holding ``hdus``"""
+    hdus = _withPrimary(hdus)
+    return sum(len(header) + hdu.dataLength + _padding(hdu.dataLength)
+               for hdu, header in zip(hdus, _headerBytes(hdus)))
+
+
+def iterFits(hdus, chunkBytes=1 << 22):
+    """Yield a FITS file holding ``hdus`` in blocks of about ``chunkBytes``
+
+    Parameters:
+    -----------
+    hdus : `list` of `ImageHdu` or `TableHdu`
+        HDUs to write, in order.  The first is written as the primary HDU,
+        unless it is compressed or a table, in which case an empty primary
+        HDU is written first.
+    chunkBytes : `int`
+        Approximate size of the pixel blocks that are yielded
+    """
+    hdus = _withPrimary(hdus)
+    for hdu, header in zip(hdus, _headerBytes(hdus)):
+        yield header
+        for block in hdu.iterData(chunkBytes):
+            yield block
+        padding = _padding(hdu.dataLength)
+        if padding:
+            yield bytes(padding)
+
+
+def writeFits(fd, hdus, chunkBytes=1 << 22):
+    """Write a FITS file holding ``hdus`` to the binary stream ``fd``
+
+    See `iterFits` for the parameters.
+    """
+    for block in iterFits(hdus, chunkBytes):
+        fd.write(block)
@@ -20,13 +20,23 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import multiprocessing
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 from astropy.io.votable.tree import Info
 from astropy.io.votable import from_table
+from astropy.io import fits
 from astropy.table import Column
 
 import lsst.geom as geom
-import lsst.afw.table as afwTable
+from lsst.afw.fits import MemFileManager
+from lsst.afw.table import SourceCatalog
+
+from . import fitsWriter
+from .cache import contentKey
 
 
 def recordSelector(record, selection):
@@ -60,126 +70,572 @@ def recordSelector(record, selection):
         )
 
 
-def createFootprintsTable(catalog, xy0=None, insertColumn=4):
-    """make a VOTable of SourceData table and footprints
+TABLE_FORMATS = ('votable', 'fits', 'parquet', 'arrow')
+
+SELECTIONS = ('all', 'blended parents', 'deblended children', 'isolated')
+
+
+def selectRecords(catalog, selection):
+    """Select records from source catalog, all at once
 
     Parameters:
     -----------
     catalog : `lsst.afw.table.SourceCatalog`
-            Source catalog from which to display footprints.
+        catalog to select from
+    selection : `str` or `numpy.ndarray`
+        One of the selections of `recordSelector`, or a boolean array with
+        one entry per record
+
+    Returns:
+    --------
+    `numpy.ndarray`
+        Boolean array selecting the records
+    """
+    if not isinstance(selection, str):
+        mask = np.asarray(selection)
+        if mask.dtype != bool or mask.shape != (len(catalog),):
+            raise RuntimeError(f'selection mask must be a boolean array of length {len(catalog)}')
+        return mask
+    if selection == 'all':
+        return np.ones(len(catalog), dtype=bool)
+    elif selection == 'blended parents':
+        return catalog['deblend_nChild'] > 0
+    elif selection == 'deblended children':
+        return catalog['parent'] > 0
+    elif selection == 'isolated':
+        return (catalog['parent'] == 0) & (catalog['deblend_nChild'] == 0)
+    else:
+        raise RuntimeError(
+            f'invalid selection: {selection}\n'
+            'Must be one of "all", "blended parents", "deblended children", "isolated"'
+        )
+
+
+def selectCatalog(catalog, selection):
+    """Return the records of ``catalog`` chosen by ``selection``
+
+    See `selectRecords` for the selections.  The catalog itself is returned
+    if every record is selected; otherwise the selected records are copied
+    into a new, contiguous catalog (see `subsetCatalog`).
+    """
+    if isinstance(selection, str) and selection == 'all':
+        return catalog
+    if not catalog.isContiguous():
+        catalog = catalog.copy(deep=True)
+    mask = selectRecords(catalog, selection)
+    return catalog if mask.all() else subsetCatalog(catalog, mask)
+
+
+def subsetCatalog(catalog, mask):
+    """Return the records of ``catalog`` chosen by the boolean ``mask``
+
+    ``catalog.subset(mask)`` shares the records of ``catalog``, so unless
+    the chosen records happen to be adjacent it is not contiguous in memory
+    and its columns cannot be read as arrays.  The subset is therefore
+    deep-copied.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        The catalog to subset
+    mask : `numpy.ndarray` of `bool`
+        The records to keep
+
+    Returns:
+    --------
+    `lsst.afw.table.SourceCatalog`
+        A contiguous catalog of the chosen records
+    """
+    return catalog.subset(mask).copy(deep=True)
+
+
+FootprintArrays = namedtuple("FootprintArrays", ["spans", "spanOffsets", "peaks", "peakOffsets",
+                                                 "bboxes", "familyIds", "categories"])
+FootprintArrays.__doc__ = """Footprints of a catalog, as flat arrays
+
+spans : `numpy.ndarray`, (nSpans, 3)
+    (y, x0, x1) of every span, record after record
+spanOffsets : `numpy.ndarray`, (nRecords + 1,)
+    The spans of record ``i`` are ``spans[spanOffsets[i]:spanOffsets[i+1]]``
+peaks : `numpy.ndarray`, (nPeaks, 2)
+    (x, y) of every peak, record after record
+peakOffsets : `numpy.ndarray`, (nRecords + 1,)
+    The peaks of record ``i`` are ``peaks[peakOffsets[i]:peakOffsets[i+1]]``
+bboxes : `numpy.ndarray`, (nRecords, 4)
+    (minX, minY, maxX, maxY) of each footprint's bounding box;
+    ``EMPTY_BBOX`` for footprints without pixels
+familyIds : `numpy.ndarray`
+    Id of each record's parent, or of the record itself if it has none
+categories : `numpy.ndarray`
+    'blended parent', 'isolated' or 'deblended child' for each record
+"""
+
+
+# Bounding box of a footprint without pixels, empty as maxX < minX
+EMPTY_BBOX = (0, 0, -1, -1)
+
+
+def _offsets(counts):
+    """Return the offsets of consecutive segments of the given lengths"""
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def extractFootprintArrays(catalog, xy0=None, nWorkers=1):
+    """Collect the footprints of a catalog into flat arrays
+
+    Spans and peaks are kept as they are in the footprint.  Peaks are
+    read as columns, but afw has no array view of a footprint's spans, so
+    each span is still read in Python, one record at a time; bounding
+    boxes, families and categories are then computed for all records at
+    once.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        Source catalog whose footprints to collect
     xy0 : tuple or list or None
         Pixel origin to subtract off from the footprint coordinates.
         If None, the value used is (0,0)
-    insertColumn : `int`
-        Column at which to insert the "family_id" and "category" columns
+    nWorkers : `int`
+        Number of processes among which to split the catalog, in contiguous
+        chunks.  The result does not depend on it.  Each chunk is sent to
+        its process as a FITS file in memory, which only pays for itself
+        for catalogs of many thousands of records.
 
     Returns:
     --------
-    `astropy.io.votable.voTableFile`
-        VOTable object to upload to Firefly
+    `FootprintArrays`
+        Spans, peaks, bounding boxes, family ids and categories
     """
     if xy0 is None:
         xy0 = geom.Point2I(0, 0)
+    if not catalog.isContiguous():
+        catalog = catalog.copy(deep=True)
+    n = len(catalog)
+    nWorkers = max(1, min(nWorkers, n))
+    if nWorkers == 1:
+        return _extractFootprintArrays(catalog, xy0)
 
-    _catalog = afwTable.SourceCatalog(catalog.table.clone())
-    _catalog.extend(catalog, deep=True)
-    sourceTable = _catalog.asAstropy()
+    bounds = np.linspace(0, n, nWorkers + 1).astype(int)
+    chunks = [_catalogToFits(catalog[int(start):int(stop)]) for start, stop in zip(bounds[:-1], bounds[1:])]
+    # The per-record work holds the GIL, so it is spread over processes;
+    # they are spawned rather than forked so as not to copy the threads
+    # of the Firefly client
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=nWorkers, mp_context=context) as pool:
+        parts = list(pool.map(_extractFitsFootprintArrays, chunks, [(xy0[0], xy0[1])]*len(chunks)))
+    return _concatenateFootprintArrays(parts)
 
-    # Change int64 dtypes so they convert to VOTable
-    for colName in sourceTable.colnames:
-        if sourceTable[colName].dtype.num == 9:
-            sourceTable[colName].dtype = np.dtype('long')
 
-    inputColumnNames = sourceTable.colnames
+def _catalogToFits(catalog):
+    """Return ``catalog``, with its footprints, as a FITS file in memory"""
+    manager = MemFileManager()
+    catalog.writeFits(manager)
+    return manager.getData()
+
+
+def _extractFitsFootprintArrays(data, xy0):
+    """Return the `FootprintArrays` of a catalog written by `_catalogToFits`;
+    run in the worker processes of `extractFootprintArrays`
+    """
+    manager = MemFileManager(len(data))
+    manager.setData(data, len(data))
+    return _extractFootprintArrays(SourceCatalog.readFits(manager), xy0)
+
+
+def _concatenateFootprintArrays(parts):
+    """Join the `FootprintArrays` of consecutive chunks of a catalog"""
+    def joinOffsets(offsets):
+        starts = np.cumsum([0] + [o[-1] for o in offsets[:-1]])
+        return np.concatenate([offsets[0][:1]] + [o[1:] + start for o, start in zip(offsets, starts)])
 
+    return FootprintArrays(
+        spans=np.concatenate([p.spans for p in parts]),
+        spanOffsets=joinOffsets([p.spanOffsets for p in parts]),
+        peaks=np.concatenate([p.peaks for p in parts]),
+        peakOffsets=joinOffsets([p.peakOffsets for p in parts]),
+        bboxes=np.concatenate([p.bboxes for p in parts]),
+        familyIds=np.concatenate([p.familyIds for p in parts]),
+        categories=np.concatenate([p.categories for p in parts]),
+    )
+
+
+def _extractFootprintArrays(catalog, xy0):
+    """Implementation of `extractFootprintArrays` for one process"""
     x0, y0 = xy0
-    spanList = []
-    peakList = []
-    familyList = []
-    categoryList = []
-    fpxll = []
-    fpyll = []
-    fpxur = []
-    fpyur = []
-    for record in catalog:
+    n = len(catalog)
+
+    spanCounts = np.empty(n, dtype=np.int64)
+    peakCounts = np.empty(n, dtype=np.int64)
+    spanList, pxs, pys = [], [], []
+    for i, record in enumerate(catalog):
         footprint = record.getFootprint()
-        recordId = record.getId()
-        spans = footprint.getSpans()
-        scoords = [(s.getY()-y0, s.getX0()-x0, s.getX1()-x0) for s in spans]
-        scoords = np.array(scoords).flatten()
-        scoords = np.ma.MaskedArray(scoords, mask=np.zeros(len(scoords),
-                                                           dtype=np.bool))
-        fpbbox = footprint.getBBox()
-        corners = [(c.getX()-x0, c.getY()-y0) for c in fpbbox.getCorners()]
-        fpxll.append(corners[0][0])
-        fpyll.append(corners[0][1])
-        fpxur.append(corners[2][0])
-        fpyur.append(corners[2][1])
+        spans = [(s.getY(), s.getX0(), s.getX1()) for s in footprint.getSpans()]
+        spanList.extend(spans)
+        spanCounts[i] = len(spans)
         peaks = footprint.getPeaks()
-        pcoords = [(p.getFx()-x0, p.getFy()-y0) for p in peaks]
-        pcoords = np.array(pcoords).flatten()
-        pcoords = np.ma.MaskedArray(pcoords, mask=np.zeros(len(pcoords),
-                                                           dtype=np.bool))
-        fpbbox = footprint.getBBox()
-        parentId = record.getParent()
-        nChild = record.get('deblend_nChild')
-        if parentId == 0:
-            familyList.append(recordId)
-            if nChild > 0:
-                # blended parent
-                categoryList.append('blended parent')
-            else:
-                # isolated
-                categoryList.append('isolated')
-        else:
-            # deblended child
-            familyList.append(parentId)
-            categoryList.append('deblended child')
-        spanList.append(scoords)
-        peakList.append(pcoords)
+        pxs.append(peaks['f_x'])
+        pys.append(peaks['f_y'])
+        peakCounts[i] = len(peaks)
+    spans = np.array(spanList, dtype=np.int32).reshape(-1, 3)
+    spans[:, 0] -= y0
+    spans[:, 1:] -= x0
+    spanOffsets = _offsets(spanCounts)
+
+    bboxes = np.tile(np.array(EMPTY_BBOX, dtype=np.int32), (n, 1))
+    hasSpans = spanCounts > 0
+    if hasSpans.any():
+        starts = spanOffsets[:-1][hasSpans]
+        bboxes[hasSpans, 0] = np.minimum.reduceat(spans[:, 1], starts)
+        bboxes[hasSpans, 1] = np.minimum.reduceat(spans[:, 0], starts)
+        bboxes[hasSpans, 2] = np.maximum.reduceat(spans[:, 2], starts)
+        bboxes[hasSpans, 3] = np.maximum.reduceat(spans[:, 0], starts)
+
+    if pxs:
+        peaks = np.column_stack((np.concatenate(pxs).astype(np.float64) - x0,
+                                 np.concatenate(pys).astype(np.float64) - y0))
+    else:
+        peaks = np.empty((0, 2))
+    peakOffsets = _offsets(peakCounts)
 
-    sourceTable.add_column(Column(np.array(familyList)),
+    ids = catalog['id']
+    parents = catalog['parent']
+    familyIds = np.where(parents == 0, ids, parents)
+    categories = np.where(parents != 0, 'deblended child',
+                          np.where(catalog['deblend_nChild'] > 0, 'blended parent', 'isolated'))
+    return FootprintArrays(spans, spanOffsets, peaks, peakOffsets, bboxes, familyIds, categories)
+
+
+def footprintOutlines(fp, maxVertices=16):
+    """Return simplified outlines of footprints as polygons
+
+    Each footprint is outlined by the left end of its first span on each
+    row, down one side, and the right end of its last span on each row, up
+    the other; gaps and holes within a row are ignored.  Rows are skipped
+    evenly so that no outline has more than about ``maxVertices`` vertices.
+
+    Parameters:
+    -----------
+    fp : `FootprintArrays`
+        Footprints to outline
+    maxVertices : `int`
+        Approximate maximum number of vertices of each polygon
+
+    Returns:
+    --------
+    vertices : `numpy.ndarray`, (nVertices, 2)
+        (x, y) of the vertices of every polygon, at pixel corners, in the
+        coordinates of the spans
+    offsets : `numpy.ndarray`, (nRecords + 1,)
+        The vertices of record ``i`` are ``vertices[offsets[i]:offsets[i+1]]``
+    """
+    n = len(fp.spanOffsets) - 1
+    y, x0, x1 = fp.spans.T.astype(np.float64)
+    owner = np.repeat(np.arange(n), np.diff(fp.spanOffsets))
+
+    # Extent of each row of each footprint
+    isRowStart = np.ones(len(y), dtype=bool)
+    isRowStart[1:] = (owner[1:] != owner[:-1]) | (y[1:] != y[:-1])
+    rowStarts = np.flatnonzero(isRowStart)
+    rowOwner = owner[rowStarts]
+    rowY = y[rowStarts]
+    rowMin = np.minimum.reduceat(x0, rowStarts) if len(rowStarts) else rowY
+    rowMax = np.maximum.reduceat(x1, rowStarts) if len(rowStarts) else rowY
+    rowCounts = np.bincount(rowOwner, minlength=n)
+
+    # Keep every step'th row, and the last one
+    rank = np.arange(len(rowStarts)) - _offsets(rowCounts)[:-1][rowOwner]
+    step = np.maximum(1, -(-rowCounts//max(1, maxVertices//4)))[rowOwner]
+    keep = (rank % step == 0) | (rank == rowCounts[rowOwner] - 1)
+    rowOwner, rowY, rowMin, rowMax = rowOwner[keep], rowY[keep], rowMin[keep], rowMax[keep]
+    keptCounts = np.bincount(rowOwner, minlength=n)
+    rank = np.arange(len(rowOwner)) - _offsets(keptCounts)[:-1][rowOwner]
+
+    # Two vertices per row down the left side, then two per row back up the right
+    offsets = _offsets(4*keptCounts)
+    vertices = np.empty((offsets[-1], 2))
+    left = offsets[:-1][rowOwner] + 2*rank
+    right = offsets[:-1][rowOwner] + 2*keptCounts[rowOwner] + 2*(keptCounts[rowOwner] - 1 - rank)
+    vertices[left] = np.column_stack((rowMin - 0.5, rowY - 0.5))
+    vertices[left + 1] = np.column_stack((rowMin - 0.5, rowY + 0.5))
+    vertices[right] = np.column_stack((rowMax + 0.5, rowY + 0.5))
+    vertices[right + 1] = np.column_stack((rowMax + 0.5, rowY - 0.5))
+    return vertices, offsets
+
+
+def _objectColumn(flat, offsets):
+    """Split a flat array into an object array of per-record masked arrays
+
+    The masked arrays are views of ``flat``, but there is still one per
+    record, as the VOTable writer needs for variable-length columns.
+
+    Parameters:
+    -----------
+    flat : `numpy.ndarray`
+        Values of all the records, one after the other
+    offsets : `numpy.ndarray`
+        The values of record ``i`` are ``flat[offsets[i]:offsets[i+1]]``
+    """
+    masked = np.ma.MaskedArray(flat, mask=np.zeros(len(flat), dtype=bool))
+    column = np.empty(len(offsets) - 1, dtype=object)
+    for i in range(len(column)):
+        column[i] = masked[offsets[i]:offsets[i + 1]]
+    return column
+
+
+def catalogAsAstropy(catalog):
+    """View a source catalog as an astropy table, copying as little as possible
+
+    Columns are views of the catalog's memory, except for those that cannot
+    be viewed (flags and strings) and, when the catalog is not contiguous in
+    memory, the whole catalog, which are copied.  Do not modify the
+    returned table's columns in place.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        Source catalog to view
+
+    Returns:
+    --------
+    `astropy.table.Table`
+        Table of the catalog columns, with int64 columns typed so that they
+        convert to VOTable
+    """
+    if not catalog.isContiguous():
+        catalog = catalog.copy(deep=True)
+    sourceTable = catalog.asAstropy(copy=False, unviewable='copy')
+
+    # Change int64 dtypes so they convert to VOTable; a view of the same
+    # memory with another type code, not a copy.
+    for colName in sourceTable.colnames:
+        if sourceTable[colName].dtype.num == 9:
+            sourceTable.replace_column(colName, sourceTable[colName].view(np.dtype('long')), copy=False)
+    return sourceTable
+
+
+def footprintBBoxes(catalog):
+    """Return the bounding boxes of the footprints of a catalog
+
+    Only each footprint's bounding box is read, not its spans and peaks as
+    in `extractFootprintArrays`.  Footprints without pixels are given
+    ``EMPTY_BBOX``.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        Source catalog
+
+    Returns:
+    --------
+    `numpy.ndarray`, (nRecords, 4)
+        (minX, minY, maxX, maxY) of each footprint, in parent pixels
+    """
+    bboxes = np.tile(np.array(EMPTY_BBOX, dtype=np.int64), (len(catalog), 1))
+    for i, record in enumerate(catalog):
+        box = record.getFootprint().getBBox()
+        if not box.isEmpty():
+            bboxes[i] = (box.getMinX(), box.getMinY(), box.getMaxX(), box.getMaxY())
+    return bboxes
+
+
+class FootprintGridIndex:
+    """Spatial index of footprint bounding boxes on a regular grid
+
+    Each footprint is listed in every grid cell its bounding box overlaps,
+    in a single array sorted by cell, so that looking up a region only
+    touches the cells it covers.  Empty boxes, with maxX < minX or
+    maxY < minY, are in no cell and overlap no region.
+
+    Parameters:
+    -----------
+    bboxes : `numpy.ndarray`, (n, 4)
+        (minX, minY, maxX, maxY) of each footprint, inclusive, as returned
+        by `footprintBBoxes` or in `FootprintArrays.bboxes`
+    cellSize : `int`
+        Width and height of the grid cells, in pixels
+    """
+
+    def __init__(self, bboxes, cellSize=256):
+        self.bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+        self.cellSize = cellSize
+        n = len(self.bboxes)
+        valid = (self.bboxes[:, 2] >= self.bboxes[:, 0]) & (self.bboxes[:, 3] >= self.bboxes[:, 1])
+        nValid = np.count_nonzero(valid)
+        self._origin = self.bboxes[valid, :2].min(axis=0) if nValid else np.zeros(2, dtype=np.int64)
+        cx0, cy0 = self._cells(self.bboxes[:, 0], self.bboxes[:, 1])
+        cx1, cy1 = self._cells(self.bboxes[:, 2], self.bboxes[:, 3])
+        self._gridWidth = int(cx1[valid].max()) + 1 if nValid else 1
+        self._gridHeight = int(cy1[valid].max()) + 1 if nValid else 1
+
+        # List each footprint once per cell it overlaps
+        nx = cx1 - cx0 + 1
+        counts = np.where(valid, nx*(cy1 - cy0 + 1), 0)
+        records = np.repeat(np.arange(n), counts)
+        k = np.arange(len(records)) - np.repeat(_offsets(counts)[:-1], counts)
+        cellIds = (cy0[records] + k//nx[records])*self._gridWidth + cx0[records] + k % nx[records]
+        order = np.argsort(cellIds, kind='stable')
+        self._cellIds = cellIds[order]
+        self._records = records[order]
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def _cells(self, x, y):
+        """Return the grid cell column and row of pixel (x, y)"""
+        return ((np.asarray(x) - self._origin[0])//self.cellSize,
+                (np.asarray(y) - self._origin[1])//self.cellSize)
+
+    def query(self, minX, minY, maxX, maxY):
+        """Return the indices of the footprints overlapping a region
+
+        Parameters:
+        -----------
+        minX, minY, maxX, maxY : `float`
+            Corners of the region, in the pixels of the bounding boxes
+
+        Returns:
+        --------
+        `numpy.ndarray`
+            Sorted indices of the footprints whose bounding boxes overlap
+            the region
+        """
+        cx0, cy0 = self._cells(np.floor(minX), np.floor(minY))
+        cx1, cy1 = self._cells(np.floor(maxX), np.floor(maxY))
+        cx0, cy0 = max(int(cx0), 0), max(int(cy0), 0)
+        cx1, cy1 = min(int(cx1), self._gridWidth - 1), min(int(cy1), self._gridHeight - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64)
+        rows = np.arange(cy0, cy1 + 1)*self._gridWidth
+        starts = np.searchsorted(self._cellIds, rows + cx0, side='left')
+        stops = np.searchsorted(self._cellIds, rows + cx1, side='right')
+        candidates = np.unique(np.concatenate([self._records[a:b] for a, b in zip(starts, stops)]))
+        boxes = self.bboxes[candidates]
+        overlaps = ((boxes[:, 0] <= maxX) & (boxes[:, 2] >= minX) &
+                    (boxes[:, 1] <= maxY) & (boxes[:, 3] >= minY))
+        return candidates[overlaps]
+
+
+def catalogFingerprint(catalog):
+    """Return a key identifying the content of a footprints table
+
+    The key is a hash of the catalog's schema and columns, and of the spans
+    and peaks of every footprint, as collected by `extractFootprintArrays`.
+    This is cheaper than building and serializing the footprints table,
+    yet any change to the catalog that would alter the table is almost
+    certain to change it.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        Source catalog from which footprints are displayed
+
+    Returns:
+    --------
+    `str`
+        Hex digest of the catalog content
+    """
+    sourceTable = catalogAsAstropy(catalog)
+    fp = extractFootprintArrays(catalog)
+
+    def buffers():
+        yield str(len(catalog)).encode()
+        for colName in sourceTable.colnames:
+            column = sourceTable[colName]
+            yield f"{colName}:{column.dtype.str}{column.shape[1:]}".encode()
+            yield np.ascontiguousarray(column).tobytes()
+        for array in (fp.spans, fp.spanOffsets, fp.peaks, fp.peakOffsets):
+            yield np.ascontiguousarray(array).tobytes()
+    return contentKey(buffers())
+
+
+_CORNER_COLUMNS = ['footprint_corner1_x', 'footprint_corner1_y',
+                   'footprint_corner2_x', 'footprint_corner2_y']
+
+
+def _sourceTable(catalog, xy0, insertColumn, nWorkers):
+    """Return the catalog as an astropy table with the family, category and
+    bounding box columns of a footprints table, and its footprint arrays
+    """
+    sourceTable = catalogAsAstropy(catalog)
+    fp = extractFootprintArrays(catalog, xy0, nWorkers)
+    sourceTable.add_column(Column(fp.familyIds, copy=False),
                            name='family_id',
-                           index=insertColumn)
-    sourceTable.add_column(Column(np.array(categoryList)),
+                           index=insertColumn, copy=False)
+    sourceTable.add_column(Column(fp.categories, copy=False),
                            name='category',
-                           index=insertColumn+1)
-    sourceTable.add_column(Column(np.array(spanList)), name='spans')
-    sourceTable.add_column(Column(np.array(peakList)), name='peaks')
-    sourceTable.add_column(Column(np.array(fpxll)), name='footprint_corner1_x')
-    sourceTable.add_column(Column(np.array(fpyll)), name='footprint_corner1_y')
-    sourceTable.add_column(Column(np.array(fpxur)), name='footprint_corner2_x')
-    sourceTable.add_column(Column(np.array(fpyur)), name='footprint_corner2_y')
+                           index=insertColumn+1, copy=False)
+    return sourceTable, fp
+
+
+def _addCornerColumns(sourceTable, fp):
+    bboxes = fp.bboxes.astype(np.int64)
+    for i, name in enumerate(_CORNER_COLUMNS):
+        sourceTable.add_column(Column(bboxes[:, i], copy=False), name=name, copy=False)
 
+
+# Coordinate columns looked for in a catalog, in order of preference, and
+# their Firefly coordinate system
+_COORD_COLUMNS = [('slot_Centroid_x', 'slot_Centroid_y', 'ZERO_BASED'),
+                  ('coord_ra', 'coord_dec', 'EQ_J2000'),
+                  ('base_SdssCentroid_x', 'base_SdssCentroid_y', 'ZERO_BASED')]
+
+
+def catalogCoordColumns(sourceTable, xcol=None, ycol=None, coordSys='ZERO_BASED'):
+    """Return the Firefly description of the coordinate columns of a table
+
+    Parameters:
+    -----------
+    sourceTable : `astropy.table.Table`
+        Table of a source catalog, e.g. from `catalogAsAstropy`
+    xcol, ycol : `str`, optional
+        Coordinate columns to use.  By default the first of the centroid
+        slot, coord_ra and coord_dec, or the SDSS centroid with some
+        finite values is used.
+    coordSys : {'ZERO_BASED', 'EQ_J2000'}
+        Coordinate system of ``xcol`` and ``ycol``: zero-based pixels or
+        equatorial coordinates
+
+    Returns:
+    --------
+    `str`
+        Value of the CatalogCoordColumns metadata, e.g.
+        'slot_Centroid_x;slot_Centroid_y;ZERO_BASED'
+    """
+    inputColumnNames = sourceTable.colnames
+
+    def valid(xName, yName):
+        return ((xName in inputColumnNames) and (yName in inputColumnNames) and
+                np.isfinite(sourceTable[xName]).any() and np.isfinite(sourceTable[yName]).any())
+
+    candidates = _COORD_COLUMNS if xcol is None else [(xcol, ycol, coordSys)]
+    # Check whether the coordinates are included and are valid
+    for xName, yName, system in candidates:
+        if valid(xName, yName):
+            return f'{xName};{yName};{system}'
+    raise RuntimeError('No valid coordinate columns in catalog')
+
+
+def _footprintsInfos(sourceTable):
+    """Return the (name, value) metadata Firefly needs to find the footprints
+    and coordinates in a footprints table
+    """
+    return [('contains_lsst_footprints', 'true'),
+            ('contains_lsst_measurements', 'true'),
+            ('FootPrintColumnNames', 'id;' + ';'.join(_CORNER_COLUMNS) + ';spans;peaks'),
+            ('pixelsys', 'zero-based'),
+            ('CatalogCoordColumns', catalogCoordColumns(sourceTable))]
+
+
+def _votable(sourceTable, infos):
+    """Return an astropy table as a binary VOTable with INFO ``infos``"""
     outputVO = from_table(sourceTable)
     outTable = outputVO.get_first_table()
 
-    outTable.infos.append(Info(name='contains_lsst_footprints', value='true'))
-    outTable.infos.append(Info(name='contains_lsst_measurements', value='true'))
-    outTable.infos.append(Info(name='FootPrintColumnNames',
-                               value='id;footprint_corner1_x;footprint_corner1_y;' +
-                               'footprint_corner2_x;footprint_corner2_y;spans;peaks'))
-    outTable.infos.append(Info(name='pixelsys', value='zero-based'))
-    # Check whether the coordinates are included and are valid
-    if (('slot_Centroid_x' in inputColumnNames) and
-            ('slot_Centroid_y' in inputColumnNames) and
-            np.isfinite(outTable.array['slot_Centroid_x']).any() and
-            np.isfinite(outTable.array['slot_Centroid_y']).any()):
-        coord_column_string = 'slot_Centroid_x;slot_Centroid_y;ZERO_BASED'
-    elif (('coord_ra' in inputColumnNames) and
-            ('coord_dec' in inputColumnNames) and
-            np.isfinite(outTable.array['coord_ra']).any() and
-            np.isfinite(outTable.array['coord_dec']).any()):
-        coord_column_string = 'coord_ra;coord_dec;EQ_J2000'
-    elif (('base_SdssCentroid_x' in inputColumnNames) and
-            ('base_SdssCentroid_y' in inputColumnNames) and
-            np.isfinite(outTable.array['base_SdssCentroid_x']).any() and
-            np.isfinite(outTable.array['base_SdssCentroid_y']).any()):
-        coord_column_string = 'base_SdssCentroid_x;base_SdssCentroid_y;ZERO_BASED'
-    else:
-        raise RuntimeError('No valid coordinate columns in catalog')
-    outTable.infos.append(Info(name='CatalogCoordColumns',
-                               value=coord_column_string))
+    for name, value in infos:
+        outTable.infos.append(Info(name=name, value=value))
 
     for f in outTable.fields:
         if f.datatype == 'bit':
@@ -189,3 +645,306 @@ def createFootprintsTable(catalog, xy0=None, insertColumn=4):
     outputVO.set_all_tables_format('binary2')
 
     return outputVO
+
+
+def _fitsHeader(infos):
+    """Return the metadata ``infos`` as FITS header cards
+
+    A value too long for one 80-character card, such as the list of
+    footprint columns, is split after semicolons across the cards
+    ``name_1``, ``name_2``, ... rather than continued in CONTINUE cards.
+    """
+    header = fits.Header()
+    for name, value in infos:
+        if len(f"HIERARCH {name} = '{value}'") <= 80:
+            header[f'HIERARCH {name}'] = value
+            continue
+        size = 80 - len(f"HIERARCH {name}_99 = ''")
+        pieces = []
+        for part in re.split('(?<=;)', value):
+            if pieces and len(pieces[-1]) + len(part) <= size:
+                pieces[-1] += part
+            else:
+                pieces.extend(part[i:i + size] for i in range(0, len(part), size))
+        for i, piece in enumerate(pieces, start=1):
+            header[f'HIERARCH {name}_{i}'] = piece
+    return header
+
+
+def createFootprintsTable(catalog, xy0=None, insertColumn=4, nWorkers=1, selection='all'):
+    """make a VOTable of SourceData table and footprints
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+            Source catalog from which to display footprints.
+    xy0 : tuple or list or None
+        Pixel origin to subtract off from the footprint coordinates.
+        If None, the value used is (0,0)
+    insertColumn : `int`
+        Column at which to insert the "family_id" and "category" columns
+    nWorkers : `int`
+        Number of processes with which to extract the footprints
+    selection : `str` or `numpy.ndarray`
+        Records to include: 'all', 'blended parents', 'deblended children',
+        'isolated' or a boolean array (see `selectRecords`)
+
+    Returns:
+    --------
+    `astropy.io.votable.voTableFile`
+        VOTable object to upload to Firefly
+    """
+    catalog = selectCatalog(catalog, selection)
+    sourceTable, fp = _sourceTable(catalog, xy0, insertColumn, nWorkers)
+    infos = _footprintsInfos(sourceTable)
+
+    spans = fp.spans.astype(np.int64).ravel()
+    peaks = fp.peaks.astype(np.float64).ravel()
+    sourceTable.add_column(Column(_objectColumn(spans, 3*fp.spanOffsets), copy=False),
+                           name='spans', copy=False)
+    sourceTable.add_column(Column(_objectColumn(peaks, 2*fp.peakOffsets), copy=False),
+                           name='peaks', copy=False)
+    _addCornerColumns(sourceTable, fp)
+
+    return _votable(sourceTable, infos)
+
+
+def createFootprintsHdu(catalog, xy0=None, insertColumn=4, nWorkers=1, selection='all'):
+    """make a compact FITS binary table of SourceData table and footprints
+
+    The table has the same columns and metadata as `createFootprintsTable`,
+    the metadata being written as header keywords (the column names split
+    across numbered cards, see `_fitsHeader`), but the spans are int32 and
+    the peaks float32, and both are written straight from the flat
+    footprint arrays as variable-length columns.  This is much faster to
+    write than the VOTable, and about half its size.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+            Source catalog from which to display footprints.
+    xy0 : tuple or list or None
+        Pixel origin to subtract off from the footprint coordinates.
+        If None, the value used is (0,0)
+    insertColumn : `int`
+        Column at which to insert the "family_id" and "category" columns
+    nWorkers : `int`
+        Number of processes with which to extract the footprints
+    selection : `str` or `numpy.ndarray`
+        Records to include: 'all', 'blended parents', 'deblended children',
+        'isolated' or a boolean array (see `selectRecords`)
+
+    Returns:
+    --------
+    `lsst.display.firefly.fitsWriter.TableHdu`
+        Table to write with `lsst.display.firefly.fitsWriter.writeFits`
+    """
+    catalog = selectCatalog(catalog, selection)
+    sourceTable, fp = _sourceTable(catalog, xy0, insertColumn, nWorkers)
+    header = _fitsHeader(_footprintsInfos(sourceTable))
+    _addCornerColumns(sourceTable, fp)
+
+    varColumns = {'spans': (fp.spans.astype(np.int32, copy=False).ravel(), 3*fp.spanOffsets),
+                  'peaks': (fp.peaks.astype(np.float32).ravel(), 2*fp.peakOffsets)}
+    return fitsWriter.TableHdu(sourceTable, varColumns, header)
+
+
+def _importArrow():
+    """Import pyarrow, which is only needed for Parquet and Arrow tables"""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError(f"Parquet and Arrow footprints tables need pyarrow: {e}")
+    return pyarrow
+
+
+def _arrowList(pa, flat, offsets, size):
+    """Return an Arrow list array of the rows of ``flat`` delimited by ``offsets``,
+    in groups of ``size`` values, without copying ``flat``
+    """
+    offsets = size*np.asarray(offsets)
+    if offsets[-1] < 1 << 31:
+        return pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), pa.array(flat))
+    return pa.LargeListArray.from_arrays(pa.array(offsets.astype(np.int64)), pa.array(flat))
+
+
+def createFootprintsArrow(catalog, xy0=None, insertColumn=4, nWorkers=1, selection='all'):
+    """make an Arrow table of SourceData table and footprints
+
+    The table has the same columns as `createFootprintsTable`, the metadata
+    being carried in the schema metadata, with int32 spans and float32
+    peaks as list columns built straight from the flat footprint arrays.
+    Write it as Parquet or Arrow IPC with `writeArrowTable`.  Needs pyarrow.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+            Source catalog from which to display footprints.
+    xy0 : tuple or list or None
+        Pixel origin to subtract off from the footprint coordinates.
+        If None, the value used is (0,0)
+    insertColumn : `int`
+        Column at which to insert the "family_id" and "category" columns
+    nWorkers : `int`
+        Number of processes with which to extract the footprints
+    selection : `str` or `numpy.ndarray`
+        Records to include: 'all', 'blended parents', 'deblended children',
+        'isolated' or a boolean array (see `selectRecords`)
+
+    Returns:
+    --------
+    `pyarrow.Table`
+        Table to upload to Firefly
+    """
+    pa = _importArrow()
+    catalog = selectCatalog(catalog, selection)
+    sourceTable, fp = _sourceTable(catalog, xy0, insertColumn, nWorkers)
+    infos = _footprintsInfos(sourceTable)
+    _addCornerColumns(sourceTable, fp)
+
+    return _arrowTable(pa, sourceTable, infos, [
+        ('spans', _arrowList(pa, fp.spans.astype(np.int32, copy=False).ravel(), fp.spanOffsets, 3)),
+        ('peaks', _arrowList(pa, fp.peaks.astype(np.float32).ravel(), fp.peakOffsets, 2)),
+    ])
+
+
+def _arrowTable(pa, sourceTable, infos, extraColumns=()):
+    """Return an astropy table as an Arrow table with schema metadata
+    ``infos``, followed by the (name, `pyarrow.Array`) ``extraColumns``
+    """
+    fields, arrays = [], []
+    for colName in sourceTable.colnames:
+        column = sourceTable[colName]
+        values = np.asarray(column)
+        if values.ndim > 1:
+            size = int(np.prod(values.shape[1:]))
+            array = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), size)
+        else:
+            array = pa.array(values)
+        metadata = {key: str(value) for key, value in [('unit', column.unit),
+                                                       ('description', column.description)] if value}
+        fields.append(pa.field(colName, array.type, metadata=metadata or None))
+        arrays.append(array)
+    for colName, array in extraColumns:
+        fields.append(pa.field(colName, array.type))
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields, metadata=dict(infos)))
+
+
+def writeArrowTable(fd, table, tableFormat='parquet'):
+    """Write an Arrow table to the binary stream ``fd``
+
+    Parameters:
+    -----------
+    fd : binary file-like
+        Stream to write to
+    table : `pyarrow.Table`
+        Table to write, e.g. from `createFootprintsArrow`
+    tableFormat : {'parquet', 'arrow'}
+        Write a Parquet file or an Arrow IPC file
+    """
+    pa = _importArrow()
+    if tableFormat == 'parquet':
+        pa.parquet.write_table(table, fd)
+    elif tableFormat == 'arrow':
+        with pa.ipc.new_file(fd, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise RuntimeError(f"Unknown Arrow table format {tableFormat}; please choose 'parquet' or 'arrow'")
+
+
+def createCatalogTable(catalog, xcol=None, ycol=None, columns=None, coordSys='ZERO_BASED',
+                       tableFormat='fits', selection='all'):
+    """make a compact table of the positions of the sources of a catalog
+
+    Only the id, coordinate and requested columns are included, and no
+    footprints, so Firefly can draw a marker for each source from a small
+    table rather than from a region per source.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        Source catalog to tabulate
+    xcol, ycol : `str`, optional
+        Coordinate columns; by default those found by `catalogCoordColumns`
+    columns : `list` of `str`, optional
+        Other columns to include
+    coordSys : {'ZERO_BASED', 'EQ_J2000'}
+        Coordinate system of ``xcol`` and ``ycol``
+    tableFormat : {'votable', 'fits', 'parquet', 'arrow'}
+        Type of table to return; 'parquet' and 'arrow' need pyarrow
+    selection : `str` or `numpy.ndarray`
+        Records to include: 'all', 'blended parents', 'deblended children',
+        'isolated' or a boolean array (see `selectRecords`)
+
+    Returns:
+    --------
+    table : `astropy.io.votable.voTableFile`, `~lsst.display.firefly.fitsWriter.TableHdu` or `pyarrow.Table`
+        Table to upload to Firefly, written as for the footprints tables
+    meta : `dict` [`str`, `str`]
+        Firefly metadata of the table, as also held by the table
+    """
+    if tableFormat not in TABLE_FORMATS:
+        raise RuntimeError(f"Unknown table format {tableFormat}; please choose one of {TABLE_FORMATS}")
+    catalog = selectCatalog(catalog, selection)
+    sourceTable = catalogAsAstropy(catalog)
+    coordColumns = catalogCoordColumns(sourceTable, xcol, ycol, coordSys)
+    names = ['id'] + coordColumns.split(';')[:2] + list(columns or [])
+    sourceTable = sourceTable[list(dict.fromkeys(names))]
+    infos = [('CatalogCoordColumns', coordColumns)]
+    if coordColumns.endswith('ZERO_BASED'):
+        infos.append(('pixelsys', 'zero-based'))
+
+    if tableFormat == 'votable':
+        table = _votable(sourceTable, infos)
+    elif tableFormat == 'fits':
+        table = fitsWriter.TableHdu(sourceTable, {}, _fitsHeader(infos))
+    else:
+        table = _arrowTable(_importArrow(), sourceTable, infos)
+    return table, dict(infos)
+
+
+def iterFootprintsTables(catalog, chunkSize, xy0=None, insertColumn=4, nWorkers=1, tableFormat='votable',
+                         selection='all'):
+    """Yield the footprints tables of consecutive chunks of a catalog
+
+    Each chunk's table is only built when it is asked for, so the first
+    one is ready quickly and the memory used depends on ``chunkSize``
+    rather than on the size of the catalog.
+
+    Parameters:
+    -----------
+    catalog : `lsst.afw.table.SourceCatalog`
+            Source catalog from which to display footprints.
+    chunkSize : `int`
+        Number of records per chunk
+    xy0 : tuple or list or None
+        Pixel origin to subtract off from the footprint coordinates.
+        If None, the value used is (0,0)
+    insertColumn : `int`
+        Column at which to insert the "family_id" and "category" columns
+    nWorkers : `int`
+        Number of processes with which to extract the footprints of a chunk
+    tableFormat : {'votable', 'fits', 'parquet', 'arrow'}
+        Yield tables made by `createFootprintsTable`, by
+        `createFootprintsHdu`, or by `createFootprintsArrow` for both
+        Parquet and Arrow IPC
+    selection : `str` or `numpy.ndarray`
+        Records to include (see `selectRecords`); chunks are made of
+        ``chunkSize`` selected records
+
+    Yields:
+    -------
+    start, stop : `int`
+        Range of the selected records in the chunk
+    table : `astropy.io.votable.voTableFile`, `lsst.display.firefly.fitsWriter.TableHdu` or `pyarrow.Table`
+        Footprints table of the chunk
+    """
+    create = {'votable': createFootprintsTable, 'fits': createFootprintsHdu,
+              'parquet': createFootprintsArrow, 'arrow': createFootprintsArrow}[tableFormat]
+    catalog = selectCatalog(catalog, selection)
+    for start in range(0, len(catalog), chunkSize):
+        stop = min(start + chunkSize, len(catalog))
+        yield start, stop, create(catalog[start:stop], xy0, insertColumn, nWorkers)
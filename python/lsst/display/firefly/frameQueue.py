@@ -0,0 +1,114 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Ordered background execution of the requests made to a frame
+
+When a display is asynchronous, its requests to Firefly are run in the
+background, one at a time and in the order they were made, so that e.g. a
+pan is applied after the image it pans is loaded.
+"""
+
+__all__ = ["FrameQueue"]
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class FrameQueue:
+    """Calls run in the background, one at a time, in the order submitted
+
+    Parameters:
+    -----------
+    name : `str`
+        Name of the thread running the calls
+    """
+
+    def __init__(self, name="firefly"):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name,
+                                            initializer=self._setThread)
+        self._thread = None
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def _setThread(self):
+        self._thread = threading.current_thread()
+
+    def isCurrent(self):
+        """Return whether the caller is running on the queue, e.g. a call
+        made by a call already queued
+        """
+        return threading.current_thread() is self._thread
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a call
+
+        Returns:
+        --------
+        future : `concurrent.futures.Future`
+            The result of the call
+        """
+        with self._lock:
+            future = self._executor.submit(func, *args, **kwargs)
+            # Keep the failures until they are reported by wait
+            self._futures = [f for f in self._futures if not _succeeded(f)]
+            self._futures.append(future)
+        return future
+
+    def __len__(self):
+        with self._lock:
+            return sum(not f.done() for f in self._futures)
+
+    def wait(self, timeout=None):
+        """Wait for the calls queued so far to complete
+
+        Parameters:
+        -----------
+        timeout : `float`, optional
+            Maximum number of seconds to wait
+
+        Raises:
+        -------
+        TimeoutError
+            Raised if calls are still running after ``timeout`` seconds
+        Exception
+            The error raised by the first call that failed since the last
+            wait, if any
+        """
+        with self._lock:
+            futures = self._futures
+            self._futures = []
+        done, notDone = wait(futures, timeout)
+        if notDone:
+            with self._lock:
+                self._futures = futures + self._futures
+            raise TimeoutError(f"{len(notDone)} requests to Firefly are still running")
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                raise error
+
+    def shutdown(self, wait=True):
+        """Stop accepting calls, running those already queued if ``wait``"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _succeeded(future):
+    return future.done() and not future.cancelled() and future.exception() is None
@@ -0,0 +1,151 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Which mask planes are used, found by scanning the mask pixels, and
+masks composited from them
+
+The planes are found with a bitwise OR of the pixels rather than a sum,
+which cannot tell which bits are set.  The scans, and compositing, can be
+split into blocks of rows handled by parallel threads.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _rowBlocks(array, nThreads, blockRows):
+    """Split a 2-d array into blocks of whole rows, viewed as unsigned"""
+    array = np.asarray(array)
+    if array.dtype.kind == 'i':
+        array = array.view(array.dtype.str.replace('i', 'u'))
+    array = array.reshape(-1, array.shape[-1]) if array.ndim > 1 else array.reshape(1, -1)
+    if blockRows is None:
+        blockRows = max(1, -(-len(array)//nThreads))
+    return [array[start:start + blockRows] for start in range(0, len(array), blockRows)]
+
+
+def _mapBlocks(func, blocks, nThreads):
+    if nThreads > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=nThreads) as pool:
+            return list(pool.map(func, blocks))
+    return [func(block) for block in blocks]
+
+
+def usedMaskBits(array, nThreads=1, blockRows=None):
+    """Return the bits set in any pixel of a mask
+
+    Parameters:
+    -----------
+    array : `numpy.ndarray`
+        Mask pixels, e.g. ``mask.array``
+    nThreads : `int`
+        Number of threads scanning blocks of rows in parallel
+    blockRows : `int`, optional
+        Number of rows per block; by default the rows are shared evenly
+        between the threads
+
+    Returns:
+    --------
+    `int`
+        Bitwise OR of all the pixels
+    """
+    blocks = _rowBlocks(array, nThreads, blockRows)
+    used = 0
+    for bits in _mapBlocks(lambda block: int(np.bitwise_or.reduce(block, axis=None)), blocks, nThreads):
+        used |= bits
+    return used
+
+
+def maskPlaneCounts(array, bits=None, nThreads=1, blockRows=None):
+    """Return the number of pixels in which each used bit of a mask is set
+
+    Parameters:
+    -----------
+    array : `numpy.ndarray`
+        Mask pixels, e.g. ``mask.array``
+    bits : iterable of `int`, optional
+        Bit numbers to count; by default those of `usedMaskBits`
+    nThreads : `int`
+        Number of threads scanning blocks of rows in parallel
+    blockRows : `int`, optional
+        Number of rows per block; by default the rows are shared evenly
+        between the threads
+
+    Returns:
+    --------
+    `dict` [`int`, `int`]
+        Number of pixels with each bit set, keyed by bit number; bits set
+        in no pixel are included only if requested in ``bits``
+    """
+    blocks = _rowBlocks(array, nThreads, blockRows)
+    if bits is None:
+        used = usedMaskBits(array, nThreads, blockRows)
+        bits = [bit for bit in range(used.bit_length()) if used & (1 << bit)]
+    counts = dict.fromkeys(bits, 0)
+    if not blocks:
+        return counts
+
+    def count(block):
+        return [np.count_nonzero(block & block.dtype.type(1 << bit)) for bit in counts]
+
+    for blockCounts in _mapBlocks(count, blocks, nThreads):
+        for bit, n in zip(counts, blockCounts):
+            counts[bit] += int(n)
+    return counts
+
+
+def compositeMaskPlanes(array, groups, nThreads=1, blockRows=None):
+    """Return a mask with one bit for each group of planes of another
+
+    Parameters:
+    -----------
+    array : `numpy.ndarray`
+        Mask pixels, e.g. ``mask.array``
+    groups : `list` of `int`
+        Bitmask of the planes of each group
+    nThreads : `int`
+        Number of threads compositing blocks of rows in parallel
+    blockRows : `int`, optional
+        Number of rows per block; by default the rows are shared evenly
+        between the threads
+
+    Returns:
+    --------
+    `numpy.ndarray`
+        Mask of the same shape as ``array``, in the smallest integer type
+        with enough bits, in which bit ``i`` is set where any plane of
+        ``groups[i]`` is set
+    """
+    dtype = next(np.dtype(t) for t in (np.uint8, np.int16, np.int32, np.int64)
+                 if 8*np.dtype(t).itemsize - (np.dtype(t).kind == 'i') >= len(groups))
+    array = np.asarray(array)
+    composite = np.zeros(array.shape, dtype=dtype)
+    blocks = _rowBlocks(array, nThreads, blockRows)
+    outBlocks = _rowBlocks(composite, nThreads, blockRows)
+
+    def fill(pair):
+        block, out = pair
+        for i, group in enumerate(groups):
+            out |= ((block & block.dtype.type(group)) != 0).astype(out.dtype) << out.dtype.type(i)
+
+    _mapBlocks(fill, list(zip(blocks, outBlocks)), nThreads)
+    return composite
@@ -0,0 +1,442 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""DS9 region strings for many shapes at once
+
+Like `lsst.afw.display.ds9Regions`, coordinates are zero-based on input and
+written one-based, as DS9 and Firefly expect.
+"""
+
+import logging
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+_LOG = logging.getLogger(__name__)
+
+
+_CSS_RGB = re.compile(r"rgba?\(([^)]*)\)$", re.IGNORECASE)
+
+
+def splitAlpha(ctype):
+    """Split a color into one DS9 regions can take and its opacity
+
+    DS9 region colors are names or ``#rrggbb``, so CSS ``rgb()`` and
+    ``rgba()`` colors are converted to ``#rrggbb``; other colors are
+    returned as they are.
+
+    Parameters:
+    -----------
+    ctype : `str` or None
+        Color, e.g. 'red', '#4a90e2' or 'rgba(74,144,226,0.60)'
+
+    Returns:
+    --------
+    color : `str` or None
+        The color without its alpha
+    alpha : `float` or None
+        The alpha of an ``rgba()`` color, or None
+    """
+    match = _CSS_RGB.match(ctype.strip()) if ctype else None
+    if match is None:
+        return ctype, None
+    try:
+        values = [float(v) for v in match.group(1).split(",")]
+    except ValueError:
+        return ctype, None
+    if len(values) not in (3, 4):
+        return ctype, None
+    r, g, b = (min(255, max(0, int(round(v)))) for v in values[:3])
+    return f"#{r:02x}{g:02x}{b:02x}", values[3] if len(values) == 4 else None
+
+
+def _color(ctype):
+    ctype = splitAlpha(ctype)[0]
+    return f" # color={ctype}" if ctype else ""
+
+
+def boxRegions(bboxes, ctype=None, pointBelow=0):
+    """Return regions outlining boxes, or marking them with points
+
+    Parameters:
+    -----------
+    bboxes : `numpy.ndarray`, (n, 4)
+        (minX, minY, maxX, maxY) of each box, inclusive, in zero-based
+        pixels of the displayed image
+    ctype : `str`, optional
+        Color of the regions; any alpha is dropped (see `splitAlpha`)
+    pointBelow : `float`
+        Boxes whose width and height are both smaller than this, in pixels,
+        are drawn as a point at their center instead
+
+    Returns:
+    --------
+    `list` of `str`
+        One region per box
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    centers = 0.5*(bboxes[:, :2] + bboxes[:, 2:]) + 1
+    sizes = bboxes[:, 2:] - bboxes[:, :2] + 1
+    isPoint = (sizes < pointBelow).all(axis=1)
+    ctype = splitAlpha(ctype)[0]
+    color = _color(ctype)
+    pointColor = f" # point=cross{' color=' + ctype if ctype else ''}"
+    return [f"point({c[0]:g}, {c[1]:g}){pointColor}" if point else
+            f"box({c[0]:g}, {c[1]:g}, {s[0]:g}, {s[1]:g}, 0){color}"
+            for c, s, point in zip(centers.tolist(), sizes.tolist(), isPoint.tolist())]
+
+
+def polygonRegions(vertices, offsets, ctype=None):
+    """Return polygon regions
+
+    Parameters:
+    -----------
+    vertices : `numpy.ndarray`, (nVertices, 2)
+        (x, y) of the vertices of every polygon, in zero-based pixels of
+        the displayed image
+    offsets : `numpy.ndarray`, (nPolygons + 1,)
+        The vertices of polygon ``i`` are ``vertices[offsets[i]:offsets[i+1]]``
+    ctype : `str`, optional
+        Color of the regions; any alpha is dropped (see `splitAlpha`)
+
+    Returns:
+    --------
+    `list` of `str`
+        One region per polygon with at least three vertices
+    """
+    coords = [f"{v:g}" for v in (np.asarray(vertices, dtype=np.float64) + 1).ravel().tolist()]
+    color = _color(ctype)
+    regions = []
+    for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        if stop - start >= 3:
+            regions.append(f"polygon({', '.join(coords[2*start:2*stop])}){color}")
+    return regions
+
+
+# Line segments drawn by `lsst.afw.display.ds9Regions.dot` for each symbol,
+# as (x0, y0, x1, y1) in units of the symbol size
+_SIN45 = np.sqrt(0.5)
+_SIN60 = 0.5*np.sqrt(3)
+_SYMBOL_SEGMENTS = {
+    '+': [(0, 1, 0, -1), (-1, 0, 1, 0)],
+    'x': [(_SIN45, _SIN45, -_SIN45, -_SIN45), (-_SIN45, _SIN45, _SIN45, -_SIN45)],
+    '*': [(1, 0, -1, 0), (-0.5, _SIN60, 0.5, -_SIN60), (0.5, _SIN60, -0.5, -_SIN60)],
+}
+DOT_SYMBOLS = tuple(_SYMBOL_SEGMENTS) + ('o',)
+
+
+def dotRegions(x, y, symb='+', size=2, ctype=None):
+    """Return the regions drawing a symbol at many points
+
+    The regions are the same as `lsst.afw.display.ds9Regions.dot` would
+    return point by point, but are computed for all the points at once.
+
+    Parameters:
+    -----------
+    x, y : array-like
+        Zero-based column and row of each point
+    symb : `str`
+        One of `DOT_SYMBOLS`: '+', 'x', '*' or 'o' (a circle)
+    size : `float` or array-like
+        Size of the symbols, in pixels, or of each symbol
+    ctype : `str`, optional
+        Color of the regions
+
+    Returns:
+    --------
+    `list` of `str`
+        The regions of each point in turn
+    """
+    if symb not in DOT_SYMBOLS:
+        raise RuntimeError(f"Symbol {symb!r} cannot be drawn in bulk; please choose one of {DOT_SYMBOLS}")
+    x = np.asarray(x, dtype=np.float64).ravel() + 1
+    y = np.asarray(y, dtype=np.float64).ravel() + 1
+    size = np.broadcast_to(np.asarray(size, dtype=np.float64), x.shape)
+    color = _color(ctype)
+    if symb == 'o':
+        template = "circle %g %g %gi" + color
+        rows = np.stack([x, y, size], axis=1)
+    else:
+        template = "line %g %g %g %g" + color
+        unit = np.array(_SYMBOL_SEGMENTS[symb])
+        rows = size[:, None, None]*unit + np.stack([x, y, x, y], axis=1)[:, None, :]
+    return [template % tuple(row) for row in rows.reshape(-1, rows.shape[-1]).tolist()]
+
+
+def lineRegions(vertices, offsets=None, ctype=None):
+    """Return the regions drawing polylines
+
+    Each polyline is drawn as line segments joining its vertices, as by
+    `lsst.afw.display.ds9Regions.drawLines`.
+
+    Parameters:
+    -----------
+    vertices : `numpy.ndarray`, (nVertices, 2)
+        (x, y) of the vertices of every polyline, in zero-based pixels
+    offsets : `numpy.ndarray`, (nLines + 1,), optional
+        The vertices of polyline ``i`` are ``vertices[offsets[i]:offsets[i+1]]``;
+        by default all the vertices form one polyline
+    ctype : `str`, optional
+        Color of the regions
+
+    Returns:
+    --------
+    `list` of `str`
+        One region per segment
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2) + 1
+    if offsets is None:
+        offsets = [0, len(vertices)]
+    # a segment joins each vertex to the next, unless it is the last of its polyline
+    isStart = np.ones(len(vertices), dtype=bool)
+    ends = np.asarray(offsets)[1:] - 1
+    isStart[ends[ends >= 0]] = False
+    starts = np.flatnonzero(isStart)
+    segments = np.concatenate([vertices[starts], vertices[starts + 1]], axis=1)
+    template = "line %g %g %g %g" + _color(ctype)
+    return [template % tuple(row) for row in segments.tolist()]
+
+
+def simplifyPolylines(vertices, offsets=None, tolerance=1.0, maxSpan=1024):
+    """Simplify polylines with the Douglas-Peucker algorithm
+
+    All the polylines are simplified together, each step of the recursion
+    being done for every polyline at once.  The ends of each polyline are
+    always kept, as is every ``maxSpan``-th vertex, which bounds the depth
+    of the recursion on long polylines at the cost of a few extra vertices.
+
+    Parameters:
+    -----------
+    vertices : `numpy.ndarray`, (nVertices, 2)
+        (x, y) of the vertices of every polyline
+    offsets : `numpy.ndarray`, (nLines + 1,), optional
+        The vertices of polyline ``i`` are ``vertices[offsets[i]:offsets[i+1]]``;
+        by default all the vertices form one polyline
+    tolerance : `float`
+        Largest distance, in the units of ``vertices``, by which a vertex
+        may be left off a simplified polyline
+    maxSpan : `int`
+        Largest number of vertices simplified as a whole
+
+    Returns:
+    --------
+    vertices : `numpy.ndarray`, (nKept, 2)
+        Vertices of the simplified polylines
+    offsets : `numpy.ndarray`, (nLines + 1,)
+        Offsets of the simplified polylines in ``vertices``
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray([0, len(vertices)] if offsets is None else offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:] - 1
+    nonEmpty = ends >= starts
+    starts, ends = starts[nonEmpty], ends[nonEmpty]
+    # Spans (first, last) of vertices to simplify, whose ends are kept
+    nSpans = np.maximum(-(-(ends - starts)//maxSpan), 1)
+    spanStarts = np.cumsum(nSpans) - nSpans
+    first = np.repeat(starts, nSpans) + maxSpan*(np.arange(nSpans.sum()) - np.repeat(spanStarts, nSpans))
+    last = np.minimum(first + maxSpan, np.repeat(ends, nSpans))
+    keep = np.zeros(len(vertices), dtype=bool)
+    keep[first] = True
+    keep[last] = True
+    if tolerance <= 0:
+        keep[:] = True
+
+    while True:
+        todo = last - first > 1
+        first, last = first[todo], last[todo]
+        if len(first) == 0:
+            break
+        counts = last - first - 1
+        group = np.repeat(np.arange(len(first)), counts)
+        inner = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + first[group] + 1
+        # Distance of each inner vertex from the segment joining its span's ends
+        a, b = vertices[first[group]], vertices[last[group]]
+        ab = b - a
+        ab2 = (ab**2).sum(axis=1)
+        t = np.clip(((vertices[inner] - a)*ab).sum(axis=1)/np.where(ab2 > 0, ab2, 1), 0, 1)
+        dist = np.hypot(*(vertices[inner] - a - t[:, None]*ab).T)
+
+        groupStarts = np.cumsum(counts) - counts
+        maxDist = np.maximum.reduceat(dist, groupStarts)
+        isMax = np.flatnonzero(dist == maxDist[group])
+        _, firstMax = np.unique(group[isMax], return_index=True)
+        split = inner[isMax[firstMax]]
+
+        far = maxDist > tolerance
+        keep[split[far]] = True
+        first = np.concatenate([first[far], split[far]])
+        last = np.concatenate([split[far], last[far]])
+
+    kept = np.concatenate([[0], np.cumsum(keep)])
+    return vertices[keep], kept[offsets]
+
+
+class RegionBuffer:
+    """Regions waiting to be sent to Firefly, sent in size-capped batches
+
+    Regions are sent as soon as they are added unless the buffer is held,
+    by setting ``buffered`` or within `batch`, or a ``flushInterval`` is set.
+    Pending regions are sent whenever they reach ``maxRegions`` or
+    ``maxBytes``, and every request carries at most that many, so that no
+    single request grows without bound.
+
+    Parameters:
+    -----------
+    send : callable
+        Called with a `list` of region strings to send them to Firefly
+    maxRegions : `int`
+        Maximum number of regions sent in one request
+    maxBytes : `int`
+        Maximum total length of the regions sent in one request
+    flushInterval : `float`, optional
+        Send the pending regions this many seconds after the first of
+        them was added, from a background thread, rather than at once.
+        Ignored while the buffer is held.
+    dispatch : callable, optional
+        Called with a function sending the pending regions when the
+        ``flushInterval`` expires, to run it e.g. in order with the other
+        requests to the frame; by default it is run by the timer thread.
+    """
+
+    def __init__(self, send, maxRegions=10000, maxBytes=1 << 20, flushInterval=None, dispatch=None):
+        self.send = send
+        self.maxRegions = maxRegions
+        self.maxBytes = maxBytes
+        self.flushInterval = flushInterval
+        self.dispatch = dispatch
+        self.buffered = False
+        self._depth = 0
+        self._pending = []
+        self._nbytes = 0
+        self._timer = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def nbytes(self):
+        """Total length of the pending regions"""
+        return self._nbytes
+
+    @property
+    def held(self):
+        """Whether regions are kept until flushed or a threshold is reached"""
+        return self.buffered or self._depth > 0
+
+    def add(self, regions):
+        """Queue ``regions``, sending them as the buffer settings require
+
+        Parameters:
+        -----------
+        regions : `list` of `str`
+            Region strings
+        """
+        with self._lock:
+            self._pending.extend(regions)
+            self._nbytes += sum(len(r) for r in regions)
+            if self.held or self.flushInterval:
+                while len(self._pending) >= self.maxRegions or self._nbytes >= self.maxBytes:
+                    self._sendBatch()
+            if not self._pending:
+                return
+            if not self.held:
+                if self.flushInterval:
+                    self._startTimer()
+                else:
+                    self.flush()
+
+    def flush(self):
+        """Send all the pending regions, in as few requests as the caps allow"""
+        with self._lock:
+            self._cancelTimer()
+            while self._pending:
+                self._sendBatch()
+
+    def clear(self):
+        """Discard the pending regions without sending them"""
+        with self._lock:
+            self._cancelTimer()
+            self._pending = []
+            self._nbytes = 0
+
+    @contextmanager
+    def batch(self):
+        """Hold the regions added within the block, and send them at its end
+
+        Batches may be nested; the regions are sent when the outermost
+        block exits.
+        """
+        with self._lock:
+            self._depth += 1
+            self._cancelTimer()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if not self.held:
+                    self.flush()
+
+    def _sendBatch(self):
+        """Send the longest run of pending regions within the caps"""
+        nbytes = 0
+        n = 0
+        for region in self._pending[:self.maxRegions]:
+            if n and nbytes + len(region) > self.maxBytes:
+                break
+            nbytes += len(region)
+            n += 1
+        batch = self._pending[:n]
+        self._pending = self._pending[n:]
+        self._nbytes -= nbytes
+        self.send(batch)
+
+    def _startTimer(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flushInterval, self._timerExpired)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancelTimer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _timerExpired(self):
+        with self._lock:
+            if self._timer is threading.current_thread():
+                self._timer = None
+        if self.dispatch is None:
+            self._flushFromTimer()
+        else:
+            self.dispatch(self._flushFromTimer)
+
+    def _flushFromTimer(self):
+        with self._lock:
+            if self.held:
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                _LOG.warning("Failed to send regions to Firefly: %s", e)
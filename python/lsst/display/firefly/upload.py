@@ -0,0 +1,115 @@
+# This file is part of display_firefly.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Streaming uploads to the Firefly server
+
+`firefly_client.FireflyClient.upload_data` hands its stream to ``requests``
+as a multipart file, which reads the whole file into memory to encode the
+request.  The functions here instead send the multipart body as an iterable
+of blocks with a precomputed Content-Length, so the memory used does not
+depend on the size of the file.
+"""
+
+import tempfile
+import uuid
+
+
+class MultipartStream:
+    """Request body uploading a single file as ``multipart/form-data``
+
+    Parameters:
+    -----------
+    iterChunks : callable
+        Function returning a fresh iterator over the blocks of the file;
+        it is called each time the body is iterated (e.g. on a retry).
+    length : `int`
+        Total length in bytes of the blocks
+    fieldName : `str`
+        Name of the form field
+    fileName : `str`
+        File name reported to the server
+    """
+
+    def __init__(self, iterChunks, length, fieldName="data", fileName="data.fits"):
+        self.boundary = uuid.uuid4().hex
+        self._iterChunks = iterChunks
+        self._head = (f"--{self.boundary}\r\n"
+                      f'Content-Disposition: form-data; name="{fieldName}"; filename="{fileName}"\r\n'
+                      "Content-Type: application/octet-stream\r\n\r\n").encode("ascii")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+        self._length = len(self._head) + length + len(self._tail)
+
+    @property
+    def contentType(self):
+        """Value of the Content-Type header for this body"""
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        yield self._head
+        yield from self._iterChunks()
+        yield self._tail
+
+
+def uploadStream(client, iterChunks, length, dataType="FITS", spoolBytes=1 << 22):
+    """Upload a file to the Firefly server without holding it in memory
+
+    Parameters:
+    -----------
+    client : `firefly_client.FireflyClient`
+        Client connected to the server
+    iterChunks : callable
+        Function returning a fresh iterator over the blocks of the file
+    length : `int`
+        Total length in bytes of the blocks
+    dataType : {'FITS', 'UNKNOWN'}
+        Type of the data, as for `firefly_client.FireflyClient.upload_data`
+    spoolBytes : `int`
+        Size beyond which the file is spooled to disk, if the client does
+        not expose the session needed to stream the request body
+
+    Returns:
+    --------
+    `str`
+        Path of the file on the server
+    """
+    isFits = dataType.upper() == "FITS"
+    try:
+        url = client.url_cmd_service + "?cmd=upload&preload="
+        session = client.session
+        headers = dict(client.header_from_ws)
+    except AttributeError:
+        with tempfile.SpooledTemporaryFile(max_size=spoolBytes) as fd:
+            for block in iterChunks():
+                fd.write(block)
+            fd.seek(0)
+            return client.upload_data(fd, dataType)
+
+    url += "true&type=FITS" if isFits else "false&type=UNKNOWN"
+    body = MultipartStream(iterChunks, length, fileName="data.fits" if isFits else "data")
+    headers["Content-Type"] = body.contentType
+    result = session.post(url, data=body, headers=headers)
+    if result.status_code != 200:
+        raise RuntimeError(f"Upload to {url} failed with status {result.status_code}")
+    index = result.text.find("$")
+    return result.text[index:]
@@ -0,0 +1,77 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Helpers shared by the tests of the Firefly display.
+"""
+
+from types import SimpleNamespace
+from unittest import mock
+
+from lsst.display.firefly import firefly as firefly_mod
+from lsst.display.firefly.cache import UploadCache
+
+
+def makeDisplay(frame=1, maskPlaneColors=None):
+    """Make a stand-in for an `lsst.afw.display.Display`, with the mask
+    plane colors given by name, red by default
+    """
+    colors = dict(maskPlaneColors or {})
+    return SimpleNamespace(frame=frame, getMaskPlaneColor=lambda name: colors.get(name, "red"),
+                           _defaultMaskPlaneColor={})
+
+
+def makeImpl(testCase, frame=1, client=None, display=None, cacheBytes=1 << 20, **kwargs):
+    """Make a ``DisplayImpl`` with ``__init__``, talking to a mock client
+
+    Until ``testCase`` ends, the module's Firefly client is ``client``, or
+    a `unittest.mock.MagicMock` if None, and its upload caches are new
+    ones of ``cacheBytes`` bytes.
+
+    Parameters:
+    -----------
+    testCase : `unittest.TestCase`
+        Test during which the display is used
+    frame : `int`
+        Frame of the display, unless ``display`` is given
+    client : optional
+        Stand-in for the `firefly_client.FireflyClient`
+    display : optional
+        Stand-in for the `lsst.afw.display.Display`; see `makeDisplay`
+    cacheBytes : `int`
+        Size of the image and footprint upload caches
+    **kwargs
+        Passed to ``DisplayImpl``
+
+    Returns:
+    --------
+    impl : `lsst.display.firefly.DisplayImpl`
+        The display; its ``_client`` is the mock client
+    """
+    if client is None:
+        client = mock.MagicMock()
+    for name, value in [("_fireflyClient", client),
+                        ("_uploadCache", UploadCache(cacheBytes)),
+                        ("_footprintCache", UploadCache(cacheBytes))]:
+        patcher = mock.patch.object(firefly_mod, name, value)
+        patcher.start()
+        testCase.addCleanup(patcher.stop)
+    return firefly_mod.DisplayImpl(display if display is not None else makeDisplay(frame), **kwargs)
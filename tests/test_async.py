@@ -0,0 +1,219 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests for displays making their requests to Firefly in the background.
+"""
+
+import collections
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import lsst.utils.tests
+from lsst.display.firefly.frameQueue import FrameQueue
+from fireflyTestUtils import makeImpl
+
+
+class _Image:
+    """Stand-in for an `lsst.afw.image.Image`."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __bool__(self):
+        return True
+
+    def getBBox(self):
+        return None
+
+
+def _make_impl(testCase, client):
+    """Make an asynchronous ``DisplayImpl`` recording the steps of
+    displaying images in ``impl.events``
+
+    A step waits for the `threading.Event` ``impl.gates[step]``, if there
+    is one, before it is recorded; ``impl.seen[step]`` is set once it is.
+    A step whose gate is never set is recorded after a ``"timeout"``.
+    """
+    impl = makeImpl(testCase, frame=4, client=client)
+    impl.setAsyncOptions(enabled=True)
+    impl.events = []
+    impl.gates = {}
+    impl.seen = collections.defaultdict(threading.Event)
+    lock = threading.Lock()
+
+    def record(*event):
+        gate = impl.gates.get(event)
+        if gate is not None and not gate.wait(10):
+            impl.events.append(("timeout",) + event)
+        with lock:
+            impl.events.append(event)
+            impl.seen[event].set()
+
+    def serialize(image, *args):
+        record("serialize", image.name)
+        record("serialized", image.name)
+        return image.name
+
+    def upload(serialized, refresh=False):
+        record("upload", serialized)
+        record("uploaded", serialized)
+        return f"file-{serialized}", False
+
+    impl._serializeImage = serialize
+    impl._uploadSerialized = upload
+    impl._erase = lambda: None
+    impl.record = record
+    return impl
+
+
+class FrameQueueTest(unittest.TestCase):
+
+    def test_order(self):
+        queue = FrameQueue()
+        self.addCleanup(queue.shutdown)
+        calls = []
+        futures = [queue.submit(lambda i: (time.sleep(0.01*(i % 2)), calls.append(i))[1], i)
+                   for i in range(10)]
+        queue.wait()
+        self.assertEqual(calls, list(range(10)))
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertFalse(queue.isCurrent())
+        self.assertTrue(queue.submit(queue.isCurrent).result())
+
+    def test_errors_are_kept_until_wait(self):
+        queue = FrameQueue()
+        self.addCleanup(queue.shutdown)
+
+        def fail(message):
+            raise ValueError(message)
+
+        queue.submit(fail, "first")
+        queue.submit(fail, "second")
+        for _ in range(5):
+            queue.submit(time.sleep, 0)
+        with self.assertRaisesRegex(ValueError, "first"):
+            queue.wait()
+        queue.wait()
+
+    def test_timeout(self):
+        queue = FrameQueue()
+        self.addCleanup(queue.shutdown)
+        release = threading.Event()
+        queue.submit(release.wait, 10)
+        with self.assertRaises(TimeoutError):
+            queue.wait(timeout=0.01)
+        self.assertEqual(len(queue), 1)
+        release.set()
+        queue.wait()
+        self.assertEqual(len(queue), 0)
+
+
+class AsyncMtvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.impl = _make_impl(self, self.client)
+        self.addCleanup(self.impl._frameQueue.shutdown)
+        self.client.show_fits_image.side_effect = \
+            lambda fileId, **kwargs: self.impl.record("show", fileId) or {"success": True}
+        self.client.set_pan.side_effect = lambda **kwargs: self.impl.record("pan")
+
+    def test_returns_futures(self):
+        # Nothing can be displayed until the first image is serialized
+        release = self.impl.gates[("serialize", "a")] = threading.Event()
+        futures = [self.impl._mtv(_Image("a")), self.impl._mtv(_Image("b")), self.impl._pan(10, 20)]
+        self.assertTrue(all(isinstance(f, Future) for f in futures))
+        self.assertFalse(any(f.done() for f in futures))
+        release.set()
+        self.impl.wait()
+        self.assertEqual(self.impl._fireflyFitsID, "file-b")
+        self.assertNotIn("timeout", [event[0] for event in self.impl.events])
+
+    def test_order_and_overlap(self):
+        # The first image cannot finish uploading until the second is
+        # being serialized
+        self.impl.gates[("uploaded", "a")] = self.impl.seen[("serialize", "b")]
+        self.impl._mtv(_Image("a"))
+        self.impl._mtv(_Image("b"))
+        self.impl._pan(10, 20)
+        self.impl.wait()
+        events = self.impl.events
+        self.assertNotIn("timeout", [event[0] for event in events])
+        requests = [event for event in events if event[0] in ("show", "pan")]
+        self.assertEqual(requests, [("show", "file-a"), ("show", "file-b"), ("pan",)])
+        self.assertEqual(self.impl._lastPan, [10.5, 20.5])
+        self.assertLess(events.index(("uploaded", "a")), events.index(("upload", "b")))
+
+    def test_errors_reach_wait(self):
+        self.client.show_fits_image.side_effect = None
+        self.client.show_fits_image.return_value = {"success": False}
+        future = self.impl._mtv(_Image("a"))
+        with self.assertRaisesRegex(RuntimeError, "Display of image failed"):
+            future.result()
+        with self.assertRaisesRegex(RuntimeError, "Display of image failed"):
+            self.impl.wait()
+
+    def test_frames_batch_separately(self):
+        other = makeImpl(self, frame=5, client=self.client)
+        other.setAsyncOptions(enabled=True)
+        self.addCleanup(other.setAsyncOptions, enabled=False)
+        with other.batchActions():
+            other.wait()  # the other frame's batch is open on its thread
+            self.impl._setMaskTransparency(50, "DETECTED")
+            self.impl.wait()
+            (call,) = self.client.dispatch.call_args_list
+            self.assertEqual(call.kwargs["payload"]["imageOverlayId"], "f4__DETECTED")
+
+    def test_region_timer_flushes_in_turn(self):
+        sent = threading.Event()
+        senders = []
+        self.client.add_region_data.side_effect = \
+            lambda **kwargs: (senders.append(threading.current_thread()), sent.set())
+        self.impl.setRegionBufferOptions(flushInterval=0.01)
+        self.impl._drawLines([(0, 0), (1, 1)], "red")
+        self.assertTrue(sent.wait(5))
+        self.impl.wait()
+        self.assertEqual(senders, [self.impl._frameQueue._thread])
+
+    def test_disable(self):
+        self.impl._mtv(_Image("a"))
+        self.impl.setAsyncOptions(enabled=False)
+        self.assertIsNone(self.impl._frameQueue)
+        self.assertEqual(self.impl._fireflyFitsID, "file-a")
+        self.assertIsNone(self.impl._pan(1, 2))
+        self.impl.wait()
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
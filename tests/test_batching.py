@@ -0,0 +1,236 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests for the pipelined dispatch of batched Firefly actions.
+"""
+
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+from lsst.display.firefly import firefly as firefly_mod
+from lsst.display.firefly.batching import ActionBatch
+from fireflyTestUtils import makeImpl
+
+
+class _Client:
+    """Stand-in for a `firefly_client.FireflyClient` recording the actions
+    and how many of them were in flight at once
+
+    If ``concurrency`` is given, each request waits until that many are in
+    flight together, failing if they never are.
+    """
+
+    channel = "test"
+
+    def __init__(self, concurrency=None):
+        self.barrier = None if concurrency is None else threading.Barrier(concurrency, timeout=10)
+        self.actions = []
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._lock = threading.Lock()
+
+    def _request(self, action, **kwargs):
+        with self._lock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            if self.barrier is not None:
+                self.barrier.wait()
+        finally:
+            with self._lock:
+                self.inFlight -= 1
+                self.actions.append((action, kwargs))
+        return {'success': True}
+
+    def get_firefly_url(self):
+        return "http://firefly"
+
+    def add_mask(self, **kwargs):
+        return self._request('add_mask', **kwargs)
+
+    def remove_mask(self, **kwargs):
+        return self._request('remove_mask', **kwargs)
+
+    def dispatch(self, **kwargs):
+        return self._request('dispatch', **kwargs)
+
+
+class _Mask:
+    """Stand-in for an `lsst.afw.image.Mask` with a plane per bit, all set"""
+
+    def __init__(self, nPlanes):
+        self.planes = {f"PLANE{i}": i for i in range(nPlanes)}
+        self.array = np.full((2, 2), (1 << nPlanes) - 1, dtype=np.int32)
+
+    def getMaskPlaneDict(self):
+        return self.planes
+
+    def getArray(self):
+        return self.array
+
+    def getBBox(self):
+        return None
+
+
+def _make_impl(testCase, nPlanes, client):
+    """Make a ``DisplayImpl`` whose mask planes all have a transparency,
+    and whose masks are not uploaded
+    """
+    impl = makeImpl(testCase, client=client)
+    impl._maskTransparencies.update({f"PLANE{i}": 50 for i in range(nPlanes)})
+    impl._uploadImage = lambda *args: ("mask-id", False)
+    return impl
+
+
+class ActionBatchTest(unittest.TestCase):
+
+    def test_unbatched_actions_are_dispatched_at_once(self):
+        batch = ActionBatch()
+        self.assertEqual(batch.add("a", lambda x: x + 1, 1), 2)
+        self.assertEqual(len(batch), 0)
+
+    def test_order_kept_per_key(self):
+        calls = []
+        batch = ActionBatch(nThreads=4)
+        with batch.batch():
+            with batch.batch():
+                for i in range(20):
+                    batch.add(i % 3, lambda i: (time.sleep(0.001*(i % 2)), calls.append(i)), i)
+            self.assertEqual(len(batch), 20)
+        self.assertEqual(len(batch), 0)
+        for key in range(3):
+            self.assertEqual([i for i in calls if i % 3 == key], list(range(key, 20, 3)))
+
+    def test_error_is_raised_after_others_complete(self):
+        calls = []
+
+        def fail():
+            raise ValueError("no server")
+
+        batch = ActionBatch()
+        with self.assertRaises(ValueError):
+            with batch.batch():
+                batch.add("a", fail)
+                batch.add("a", calls.append, "a")
+                batch.add("b", calls.append, "b")
+        self.assertEqual(calls, ["b"])
+
+    def test_threads_batch_separately(self):
+        batch = ActionBatch()
+        opened = threading.Barrier(2, timeout=5)
+        firstDone = threading.Event()
+        checked = threading.Event()
+        dispatched = []
+
+        def run(name, waitFor=None):
+            with batch.batch():
+                batch.add(name, lambda: dispatched.append((name, threading.current_thread().name)))
+                opened.wait()
+                if waitFor is not None:
+                    waitFor.wait(5)
+            if waitFor is None:
+                firstDone.set()
+
+        # "a" ends its batch while "b" still has its own open
+        threads = [threading.Thread(target=run, args=("a",), name="a"),
+                   threading.Thread(target=run, args=("b", checked), name="b")]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(firstDone.wait(5))
+        self.assertEqual(dispatched, [("a", "a")])
+        checked.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(dispatched, [("a", "a"), ("b", "b")])
+        self.assertFalse(batch.held)
+
+    def test_unbatched_actions_run_concurrently(self):
+        batch = ActionBatch()
+        # Both actions must be running at once for either to return
+        barrier = threading.Barrier(2, timeout=5)
+        threads = [threading.Thread(target=batch.add, args=(key, barrier.wait)) for key in "ab"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertFalse(barrier.broken)
+
+
+class PipelinedMaskActionsTest(unittest.TestCase):
+    """Overlaying a mask takes a few round trips however many planes it has"""
+
+    nPlanes = 16
+
+    def setUp(self):
+        threads = firefly_mod._actionBatch.nThreads
+        self.addCleanup(setattr, firefly_mod._actionBatch, "nThreads", threads)
+
+    def _mtv(self, threads, concurrency=None):
+        client = _Client(concurrency)
+        impl = _make_impl(self, self.nPlanes, client)
+        impl.setDispatchOptions(threads=threads)
+        impl._mtv(None, _Mask(self.nPlanes))
+        # An add_mask and a transparency change per plane
+        self.assertEqual(len(client.actions), 2*self.nPlanes)
+        for i in range(self.nPlanes):
+            actions = [action for action, kwargs in client.actions
+                       if kwargs.get("mask_id", kwargs.get("payload", {}).get("imageOverlayId")) ==
+                       f"f1__PLANE{i}"]
+            self.assertEqual(actions, ["add_mask", "dispatch"])
+        return client
+
+    def test_serial(self):
+        self.assertEqual(self._mtv(threads=1).maxInFlight, 1)
+
+    def test_round_trips(self):
+        # Every plane's add_mask, then every transparency change, must be in
+        # flight together for any to complete: two round trips in all
+        client = self._mtv(threads=self.nPlanes, concurrency=self.nPlanes)
+        self.assertFalse(client.barrier.broken)
+        self.assertEqual(client.maxInFlight, self.nPlanes)
+
+    def test_remove_masks(self):
+        client = _Client(self.nPlanes)
+        impl = _make_impl(self, self.nPlanes, client)
+        impl._maskIds = [(1, f"PLANE{i}") for i in range(self.nPlanes)] + [(2, "PLANE0")]
+        impl.setDispatchOptions(threads=self.nPlanes)
+        impl._remove_masks()
+        self.assertFalse(client.barrier.broken)
+        self.assertEqual(len(client.actions), self.nPlanes)
+        self.assertEqual(impl._maskIds, [(2, "PLANE0")])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,171 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests that the FITS files written for upload read back with astropy.
+"""
+
+import unittest
+from io import BytesIO
+
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+
+import lsst.utils.tests
+from lsst.display.firefly import fitsWriter
+
+
+class RoundTripMixin:
+
+    def _roundTrip(self, hdus, **kwargs):
+        with BytesIO() as fd:
+            fitsWriter.writeFits(fd, hdus, **kwargs)
+            self.assertEqual(fd.tell() % fitsWriter.FITS_BLOCK, 0)
+            fd.seek(0)
+            with fits.open(fd) as hduList:
+                hduList.verify("exception")
+                # Tables are converted, as copies lose the heap of
+                # variable-length columns
+                return [(hdu.header, None if hdu.data is None else
+                         Table(hdu.data) if isinstance(hdu, fits.BinTableHDU) else hdu.data.copy())
+                        for hdu in hduList]
+
+
+class ImageHduTest(RoundTripMixin, unittest.TestCase):
+
+    def test_multi_extension(self):
+        image = np.arange(20, dtype=np.float32).reshape(4, 5)
+        mask = np.arange(20, dtype=np.int32).reshape(4, 5)
+        header = fits.Header()
+        header["OBJECT"] = "test"
+        (h0, d0), (h1, d1) = self._roundTrip([fitsWriter.ImageHdu(image, header, "IMAGE"),
+                                              fitsWriter.ImageHdu(mask, None, "MASK")])
+        self.assertTrue(h0["EXTEND"])
+        self.assertEqual(h0["OBJECT"], "test")
+        self.assertEqual(h1["EXTNAME"], "MASK")
+        np.testing.assert_array_equal(d0, image)
+        np.testing.assert_array_equal(d1, mask)
+
+    def test_row_blocks(self):
+        # Blocks smaller than a row, and a non-contiguous input array
+        image = np.arange(60, dtype=np.float64).reshape(6, 10)[:, 2:7]
+        ((_, data),) = self._roundTrip([fitsWriter.ImageHdu(image)], chunkBytes=1)
+        np.testing.assert_array_equal(data, image)
+
+    def test_unsigned(self):
+        image = (np.arange(12, dtype=np.uint16)*5000).reshape(3, 4)
+        ((header, data),) = self._roundTrip([fitsWriter.ImageHdu(image)])
+        self.assertEqual(header["BZERO"], 32768)
+        np.testing.assert_array_equal(data, image)
+
+
+class CompressedImageHduTest(RoundTripMixin, unittest.TestCase):
+    """Tile-compressed HDUs must read back with astropy, exactly for
+    integers and within the quantization step for quantized floats."""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.image = rng.normal(100.0, 5.0, size=(67, 45)).astype(np.float32)
+        self.mask = rng.integers(0, 1 << 12, size=(67, 45)).astype(np.int32)
+
+    def test_lossless(self):
+        for compression in fitsWriter.COMPRESSION_TYPES:
+            hdus = [fitsWriter.CompressedImageHdu(self.image, None, "IMAGE", compression, tileRows=5),
+                    fitsWriter.CompressedImageHdu(self.mask, None, "MASK", compression, nThreads=3)]
+            results = self._roundTrip(hdus)
+            # An empty primary HDU precedes the compressed images
+            self.assertIsNone(results[0][1])
+            np.testing.assert_array_equal(results[1][1], self.image)
+            np.testing.assert_array_equal(results[2][1], self.mask)
+
+    def test_quantized(self):
+        image = self.image.copy()
+        image[3, 4] = np.nan
+        hdu = fitsWriter.CompressedImageHdu(image, quantizeLevel=4, nThreads=2)
+        _, (_, data) = self._roundTrip([hdu])
+        step = max(t[1] for t in hdu.tiles)
+        self.assertLess(step, 5.0)
+        self.assertTrue(np.isnan(data[3, 4]))
+        self.assertLessEqual(np.nanmax(np.abs(data - image)), 0.5*step*(1 + 1e-6))
+
+    def test_quantize_ignored_for_integers(self):
+        hdu = fitsWriter.CompressedImageHdu(self.mask, quantizeLevel=4)
+        _, (_, data) = self._roundTrip([hdu])
+        np.testing.assert_array_equal(data, self.mask)
+
+    def test_length(self):
+        hdus = [fitsWriter.ImageHdu(self.image),
+                fitsWriter.CompressedImageHdu(self.mask, compression="GZIP_1")]
+        with BytesIO() as fd:
+            fitsWriter.writeFits(fd, hdus)
+            self.assertEqual(fd.tell(), fitsWriter.fitsLength(hdus))
+
+
+class TableHduTest(RoundTripMixin, unittest.TestCase):
+    """Binary tables read back with their variable-length columns split
+    into rows."""
+
+    def _table(self):
+        table = Table()
+        table["id"] = np.arange(4, dtype=np.int64)
+        table["flag"] = np.array([True, False, True, False])
+        table["name"] = np.array(["a", "bb", "ccc", "d"])
+        table["count"] = np.arange(4, dtype=np.uint16)
+        return table
+
+    def test_var_columns(self):
+        spans = np.arange(10, dtype=np.int32)
+        peaks = np.arange(8, dtype=np.float32)/2
+        header = fits.Header()
+        header["HIERARCH pixelsys"] = "zero-based"
+        hdu = fitsWriter.TableHdu(self._table(), {"spans": (spans, [0, 3, 3, 6, 10]),
+                                                  "peaks": (peaks, [0, 2, 4, 6, 8])}, header)
+        (h0, d0), (h1, d1) = self._roundTrip([hdu], chunkBytes=8)
+        self.assertIsNone(d0)
+        self.assertEqual(h1["pixelsys"], "zero-based")
+        self.assertEqual(h1["TFORM5"], "PJ(4)")
+        np.testing.assert_array_equal(d1["id"], np.arange(4))
+        np.testing.assert_array_equal(d1["flag"], [True, False, True, False])
+        np.testing.assert_array_equal(d1["name"], ["a", "bb", "ccc", "d"])
+        np.testing.assert_array_equal(d1["count"], np.arange(4))
+        self.assertEqual([list(row) for row in d1["spans"]], [[0, 1, 2], [], [3, 4, 5], [6, 7, 8, 9]])
+        self.assertEqual([list(row) for row in d1["peaks"]], [[0, 0.5], [1, 1.5], [2, 2.5], [3, 3.5]])
+
+    def test_length(self):
+        spans = np.arange(5, dtype=np.int16)
+        hdus = [fitsWriter.TableHdu(self._table(), {"spans": (spans, [0, 1, 2, 3, 5])})]
+        with BytesIO() as fd:
+            fitsWriter.writeFits(fd, hdus)
+            self.assertEqual(fd.tell(), fitsWriter.fitsLength(hdus))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,353 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests of footprint overlays culled to the region in view.
+"""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import lsst.utils.tests
+from lsst.display.firefly import firefly as firefly_mod
+from lsst.display.firefly.footprints import EMPTY_BBOX, FootprintArrays, FootprintGridIndex, footprintOutlines
+from lsst.display.firefly.regions import boxRegions, polygonRegions, splitAlpha
+from fireflyTestUtils import makeImpl
+
+
+class _Catalog:
+    """Stand-in for a source catalog; footprints are given by their boxes."""
+
+    def __init__(self, bboxes, ids=None):
+        self.bboxes = np.asarray(bboxes)
+        self.ids = np.arange(len(self.bboxes)) if ids is None else ids
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def subset(self, mask):
+        return _Catalog(self.bboxes[mask], self.ids[mask])
+
+    def isContiguous(self):
+        return True
+
+    def copy(self, deep=False):
+        return _Catalog(self.bboxes.copy(), self.ids.copy()) if deep else self
+
+
+class _Box:
+    """Stand-in for the `lsst.geom.Box2I` of the displayed image."""
+
+    def __init__(self, x0, y0, width, height):
+        self.x0, self.y0, self.width, self.height = x0, y0, width, height
+
+    def getMinX(self):
+        return self.x0
+
+    def getMinY(self):
+        return self.y0
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+
+def _make_impl(testCase):
+    """Make a ``DisplayImpl`` showing a 4000x4000 image at (100, 200)"""
+    impl = makeImpl(testCase, frame=0)
+    impl._lastImageBBox = _Box(100, 200, 4000, 4000)
+    impl._client.upload_data.side_effect = lambda fd, dataType: f"table-{fd.read().decode()}"
+    impl._client.overlay_footprints.return_value = {"success": True}
+    return impl
+
+
+class FootprintGridIndexTest(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        corner = rng.integers(-100, 4000, (2000, 2))
+        bboxes = np.column_stack((corner, corner + rng.integers(0, 600, (2000, 2))))
+        index = FootprintGridIndex(bboxes, cellSize=128)
+        for _ in range(100):
+            minX, maxX = np.sort(rng.uniform(-500, 4500, 2))
+            minY, maxY = np.sort(rng.uniform(-500, 4500, 2))
+            expected = np.flatnonzero((bboxes[:, 0] <= maxX) & (bboxes[:, 2] >= minX) &
+                                      (bboxes[:, 1] <= maxY) & (bboxes[:, 3] >= minY))
+            np.testing.assert_array_equal(index.query(minX, minY, maxX, maxY), expected)
+
+    def test_empty(self):
+        self.assertEqual(len(FootprintGridIndex(np.empty((0, 4))).query(0, 0, 10, 10)), 0)
+
+    def test_empty_boxes_overlap_nothing(self):
+        bboxes = np.array([(500, 600, 509, 609), EMPTY_BBOX, (700, 600, 709, 609), EMPTY_BBOX])
+        index = FootprintGridIndex(bboxes, cellSize=128)
+        np.testing.assert_array_equal(index.query(-1000, -1000, 1000, 1000), [0, 2])
+        self.assertEqual(len(index.query(-10, -10, 10, 10)), 0)
+        self.assertEqual(len(FootprintGridIndex([EMPTY_BBOX]).query(-10, -10, 10, 10)), 0)
+
+
+class CulledOverlayTest(unittest.TestCase):
+    """Only footprints in view are uploaded, and more as the view moves."""
+
+    def setUp(self):
+        # One 10x10 footprint every 500 pixels along the diagonal
+        corners = np.arange(8)[:, np.newaxis]*500 + np.array([100, 200])
+        self.catalog = _Catalog(np.hstack((corners, corners + 9)))
+        self.impl = _make_impl(self)
+        patchers = [
+            mock.patch.object(firefly_mod, "footprintBBoxes", lambda catalog: catalog.bboxes),
+            mock.patch.object(firefly_mod, "catalogFingerprint",
+                              lambda catalog: ",".join(map(str, catalog.ids))),
+            mock.patch.object(firefly_mod.DisplayImpl, "_serializeFootprints",
+                              staticmethod(lambda catalog, *args: ",".join(map(str, catalog.ids)).encode())),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _uploaded(self):
+        return [c.kwargs["footprint_file"] for c in self.impl._client.overlay_footprints.call_args_list]
+
+    def _layers(self):
+        return [c.kwargs["footprint_layer_id"] for c in self.impl._client.overlay_footprints.call_args_list]
+
+    def _destroyed(self):
+        return [c.kwargs["payload"]["drawLayerId"] for c in self.impl._client.dispatch.call_args_list
+                if c.kwargs["action_type"] == 'DrawLayerCntlr.destroyDrawLayer']
+
+    def test_whole_catalog_without_view(self):
+        self.impl.overlayFootprints(self.catalog, cull=True)
+        self.assertEqual(self._uploaded(), ["table-0,1,2,3,4,5,6,7"])
+        self.assertEqual(self._layers(), ["detection footprints 0"])
+
+    def test_view_and_incremental_pan(self):
+        self.impl._zoom(4)
+        self.impl._pan(5, 5)  # view is 256 pixels wide around (105, 205)
+        self.impl.overlayFootprints(self.catalog, cull=True, viewSize=1024, margin=0.5)
+        self.assertEqual(self._uploaded(), ["table-0"])
+
+        self.impl._pan(55, 55)  # still within the uploaded margin
+        self.assertEqual(len(self._uploaded()), 1)
+
+        # Only the footprints coming into view are uploaded, as a new layer
+        self.impl._pan(1005, 1005)
+        self.assertEqual(self._uploaded(), ["table-0", "table-2"])
+
+        self.impl._zoom(0.25)  # everything is in view
+        self.assertEqual(self._uploaded()[-1], "table-1,3,4,5,6,7")
+        self.impl._pan(2005, 2005)
+        self.assertEqual(len(self._uploaded()), 3)
+        self.assertEqual(self._layers(), [f"detection footprints 0 {n}" for n in (1, 2, 3)])
+        self.assertEqual(self._destroyed(), [])
+
+    def test_failed_upload_is_retried(self):
+        self.impl._zoom(4)
+        self.impl._pan(5, 5)
+        self.impl._client.overlay_footprints.return_value = {"success": False}
+        with self.assertRaises(RuntimeError):
+            self.impl.overlayFootprints(self.catalog, cull=True)
+        self.impl._client.overlay_footprints.return_value = {"success": True}
+        self.impl._pan(55, 55)
+        self.assertEqual(self._uploaded(), ["table-0", "table-0"])
+        self.assertEqual(self._layers(), ["detection footprints 0 1", "detection footprints 0 1"])
+
+    def test_selection(self):
+        self.impl.overlayFootprints(self.catalog, cull=True, selection=self.catalog.ids % 2 == 1)
+        self.assertEqual(self._uploaded(), ["table-1,3,5,7"])
+
+    def test_new_overlay_replaces_culled_one(self):
+        self.impl._zoom(4)
+        self.impl._pan(5, 5)
+        self.impl.overlayFootprints(self.catalog, cull=True)
+        self.impl._pan(1005, 1005)
+        self.impl.overlayFootprints(self.catalog)
+        self.assertEqual(self.impl._footprintOverlays, {})
+        self.assertEqual(self._destroyed(), ["detection footprints 0 1", "detection footprints 0 2"])
+        self.assertEqual(self._layers()[-1], "detection footprints 0")
+
+
+def _rectangleArrays(catalog, xy0, nWorkers=1):
+    """Stand-in for ``extractFootprintArrays``: footprints fill their boxes."""
+    x0, y0 = xy0
+    spans = [(y - y0, box[0] - x0, box[2] - x0) for box in catalog.bboxes
+             for y in range(box[1], box[3] + 1)]
+    rows = catalog.bboxes[:, 3] - catalog.bboxes[:, 1] + 1
+    offsets = np.concatenate(([0], np.cumsum(rows)))
+    return FootprintArrays(np.array(spans).reshape(-1, 3), offsets, None, None, None, None, None)
+
+
+class LevelOfDetailTest(CulledOverlayTest):
+    """The footprints are drawn in less detail as the display zooms out."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(firefly_mod, "extractFootprintArrays", _rectangleArrays)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _regions(self):
+        return [c.kwargs["region_data"] for c in self.impl._client.add_region_data.call_args_list]
+
+    def test_levels_follow_zoom(self):
+        self.impl._zoom(0.4)
+        self.impl.overlayFootprints(self.catalog, levelOfDetail=True, detailZooms=(1, 0.5))
+        (markers,) = self._regions()
+        self.assertEqual(len(markers), 8)
+        self.assertTrue(markers[0].startswith("box(5.5, 5.5, 10, 10, 0)"), markers[0])
+        self.assertEqual(self._uploaded(), [])
+
+        self.impl._zoom(0.75)
+        self.impl._client.delete_region_layer.assert_called_once()
+        outlines = self._regions()[-1]
+        self.assertEqual(len(outlines), 8)
+        self.assertTrue(outlines[0].startswith("polygon("), outlines[0])
+
+        self.impl._zoom(2)
+        self.assertEqual(self.impl._client.delete_region_layer.call_count, 2)
+        self.assertEqual(self._uploaded(), ["table-0,1,2,3,4,5,6,7"])
+
+        self.impl._zoom(0.4)
+        self.assertEqual(self._destroyed(), ["detection footprints 0"])
+        self.assertEqual(len(self._regions()), 3)
+
+    def test_region_color_alpha(self):
+        self.impl._zoom(0.4)
+        self.impl.overlayFootprints(self.catalog, levelOfDetail=True, detailZooms=(1, 0.5))
+        self.assertTrue(all(r.endswith(" # color=#4a90e2") for r in self._regions()[0]))
+        # The alpha of the default color is given to the layer, once
+        self.impl._zoom(0.45)
+        (call,) = [c for c in self.impl._client.dispatch.call_args_list
+                   if c.kwargs["action_type"] == 'DrawLayerCntlr.changeDrawingDef']
+        self.assertEqual(call.kwargs["payload"], dict(drawLayerId="detection footprints 0 outlines",
+                                                      plotId="0",
+                                                      drawingDef=dict(color='rgba(74,144,226,0.60)')))
+
+    def test_small_boxes_become_points(self):
+        self.impl._zoom(0.01)
+        self.impl.overlayFootprints(self.catalog, levelOfDetail=True)
+        self.assertTrue(all(r.startswith("point(") for r in self._regions()[0]))
+
+
+class ChunkedOverlayTest(unittest.TestCase):
+    """Chunks are uploaded and shown one after the other."""
+
+    def setUp(self):
+        self.impl = _make_impl(self)
+        self.catalog = _Catalog(np.zeros((5, 4), dtype=int))
+        self.built = []
+
+        def iterTables(catalog, chunkSize, **kwargs):
+            for start in range(0, len(catalog), chunkSize):
+                stop = min(start + chunkSize, len(catalog))
+                self.built.append((start, stop))
+                yield start, stop, catalog.ids[start:stop]
+
+        patchers = [
+            mock.patch.object(firefly_mod, "iterFootprintsTables", iterTables),
+            mock.patch.object(firefly_mod.DisplayImpl, "_serializeTable",
+                              staticmethod(lambda table, tableFormat: ",".join(map(str, table)).encode())),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_chunks_are_shown_as_they_are_built(self):
+        shown = []
+        self.impl._client.overlay_footprints.side_effect = \
+            lambda **kwargs: shown.append((kwargs["footprint_layer_id"], kwargs["footprint_file"],
+                                           len(self.built)))
+        self.impl.overlayFootprints(self.catalog, chunkSize=2, layerString="fp ")
+        self.assertEqual(shown, [("fp 0 1", "table-0,1", 1), ("fp 0 2", "table-2,3", 2),
+                                 ("fp 0 3", "table-4", 3)])
+
+    def test_overlaying_again_removes_chunk_layers(self):
+        self.impl.overlayFootprints(self.catalog, chunkSize=2, layerString="fp ")
+        self.impl.overlayFootprints(self.catalog, chunkSize=5, layerString="fp ")
+        destroyed = [c.kwargs["payload"]["drawLayerId"] for c in self.impl._client.dispatch.call_args_list]
+        self.assertEqual(destroyed, ["fp 0 1", "fp 0 2", "fp 0 3"])
+        self.assertEqual(self.impl._footprintChunkLayers, {"fp 0": ["fp 0 1"]})
+
+    def test_chunks_replace_table(self):
+        with mock.patch.object(firefly_mod, "catalogFingerprint", lambda catalog: "all"), \
+                mock.patch.object(firefly_mod.DisplayImpl, "_serializeFootprints",
+                                  staticmethod(lambda catalog, *args: b"all")):
+            self.impl.overlayFootprints(self.catalog, layerString="fp ")
+        self.impl.overlayFootprints(self.catalog, chunkSize=2, layerString="fp ")
+        (destroy,) = self.impl._client.dispatch.call_args_list
+        self.assertEqual(destroy.kwargs["payload"], dict(drawLayerId="fp 0"))
+        layers = [c.kwargs["footprint_layer_id"] for c in self.impl._client.overlay_footprints.call_args_list]
+        self.assertEqual(layers, ["fp 0", "fp 0 1", "fp 0 2", "fp 0 3"])
+        self.assertEqual(self.impl._footprintTableLayers, set())
+
+    def test_chunks_cannot_be_culled(self):
+        with self.assertRaises(firefly_mod.FireflyError):
+            self.impl.overlayFootprints(self.catalog, chunkSize=2, cull=True)
+
+
+class RegionsTest(unittest.TestCase):
+
+    def test_box_regions(self):
+        self.assertEqual(boxRegions([[0, 0, 3, 1], [10, 10, 10, 10]], ctype="red", pointBelow=2),
+                         ["box(2.5, 1.5, 4, 2, 0) # color=red", "point(11, 11) # point=cross color=red"])
+
+    def test_css_colors(self):
+        self.assertEqual(splitAlpha('rgba(74,144,226,0.60)'), ('#4a90e2', 0.6))
+        self.assertEqual(splitAlpha('rgb(80, 100, 220)'), ('#5064dc', None))
+        self.assertEqual(splitAlpha('cyan'), ('cyan', None))
+        self.assertEqual(splitAlpha(None), (None, None))
+        self.assertEqual(boxRegions([[10, 10, 10, 10]], ctype='rgba(74,144,226,0.60)', pointBelow=2),
+                         ["point(11, 11) # point=cross color=#4a90e2"])
+        self.assertEqual(polygonRegions(np.zeros((3, 2)), np.array([0, 3]), ctype='rgb(255,0,0)'),
+                         ["polygon(1, 1, 1, 1, 1, 1) # color=#ff0000"])
+
+    def test_outline_polygons(self):
+        # A diamond and a single pixel
+        spans = np.array([[0, 5, 5], [1, 4, 6], [2, 5, 5], [10, 1, 1]])
+        fp = FootprintArrays(spans, np.array([0, 3, 4]), None, None, None, None, None)
+        vertices, offsets = footprintOutlines(fp)
+        np.testing.assert_array_equal(offsets, [0, 12, 16])
+        np.testing.assert_array_equal(vertices[12:], [[0.5, 9.5], [0.5, 10.5], [1.5, 10.5], [1.5, 9.5]])
+        regions = polygonRegions(vertices, offsets)
+        self.assertEqual(regions[1], "polygon(1.5, 10.5, 1.5, 11.5, 2.5, 11.5, 2.5, 10.5)")
+
+    def test_outline_vertex_limit(self):
+        spans = np.array([[y, 0, y] for y in range(100)])
+        vertices, offsets = footprintOutlines(FootprintArrays(spans, np.array([0, 100]),
+                                                              None, None, None, None, None), maxVertices=16)
+        self.assertLessEqual(len(vertices), 20)
+        np.testing.assert_array_equal(vertices[[0, -1]], [[-0.5, -0.5], [0.5, -0.5]])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
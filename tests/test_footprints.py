@@ -0,0 +1,418 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests for the construction of footprint tables from source catalogs.
+"""
+
+import io
+import re
+import unittest
+
+import numpy as np
+from astropy.io import fits
+from astropy.io.votable import parse
+from astropy.table import Table
+
+import lsst.utils.tests
+import lsst.geom as geom
+import lsst.afw.detection as afwDetect
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.display.firefly import fitsWriter, footprints
+from fireflyTestUtils import makeImpl
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def _make_catalog(nSources=40, seed=3):
+    """Make a catalog of parents, deblended children and isolated sources
+    with circular and rectangular footprints.
+    """
+    rng = np.random.default_rng(seed)
+    schema = afwTable.SourceTable.makeMinimalSchema()
+    schema.addField("deblend_nChild", type=np.int32, doc="number of children")
+    centroidKey = afwTable.Point2DKey.addFields(schema, "slot_Centroid", "centroid", "pixel")
+    nChildKey = schema["deblend_nChild"].asKey()
+    catalog = afwTable.SourceCatalog(schema)
+    for i in range(nSources):
+        record = catalog.addNew()
+        x, y = rng.uniform(20, 480, 2)
+        center = geom.Point2I(int(x), int(y))
+        if i % 2:
+            spans = afwGeom.SpanSet.fromShape(int(rng.integers(1, 8)), afwGeom.Stencil.CIRCLE,
+                                              offset=center)
+        else:
+            spans = afwGeom.SpanSet(geom.Box2I(center, geom.Extent2I(int(rng.integers(1, 9)), 3)))
+        footprint = afwDetect.Footprint(spans)
+        for _ in range(i % 3 + 1):
+            footprint.addPeak(x + rng.uniform(-1, 1), y + rng.uniform(-1, 1), 1.0)
+        record.setFootprint(footprint)
+        record.set(centroidKey, geom.Point2D(x, y))
+        if i % 4 == 3:
+            parent = catalog[i - 1]
+            record.setParent(parent.getId())
+            parent.set(nChildKey, parent.get(nChildKey) + 1)
+    return catalog
+
+
+class FootprintArraysTest(lsst.utils.tests.TestCase):
+    """The flat footprint arrays match the catalog record by record."""
+
+    def setUp(self):
+        self.catalog = _make_catalog()
+        self.xy0 = (7, 11)
+
+    def test_matches_records(self):
+        x0, y0 = self.xy0
+        fp = footprints.extractFootprintArrays(self.catalog, self.xy0)
+        self.assertEqual(len(fp.spanOffsets), len(self.catalog) + 1)
+        for i, record in enumerate(self.catalog):
+            footprint = record.getFootprint()
+            spans = [(s.getY() - y0, s.getX0() - x0, s.getX1() - x0) for s in footprint.getSpans()]
+            np.testing.assert_array_equal(fp.spans[fp.spanOffsets[i]:fp.spanOffsets[i + 1]], spans)
+            peaks = [(p.getFx() - x0, p.getFy() - y0) for p in footprint.getPeaks()]
+            np.testing.assert_allclose(fp.peaks[fp.peakOffsets[i]:fp.peakOffsets[i + 1]], peaks)
+            box = footprint.getBBox()
+            self.assertEqual(tuple(fp.bboxes[i]),
+                             (box.getMinX() - x0, box.getMinY() - y0, box.getMaxX() - x0, box.getMaxY() - y0))
+            parentId = record.getParent()
+            self.assertEqual(fp.familyIds[i], parentId if parentId else record.getId())
+            if parentId:
+                self.assertEqual(fp.categories[i], 'deblended child')
+            elif record.get('deblend_nChild'):
+                self.assertEqual(fp.categories[i], 'blended parent')
+            else:
+                self.assertEqual(fp.categories[i], 'isolated')
+
+    def test_workers_do_not_change_result(self):
+        serial = footprints.extractFootprintArrays(self.catalog, self.xy0)
+        for nWorkers in (2, 3):
+            parallel = footprints.extractFootprintArrays(self.catalog, self.xy0, nWorkers=nWorkers)
+            for name in serial._fields:
+                np.testing.assert_array_equal(getattr(parallel, name), getattr(serial, name), err_msg=name)
+
+    def test_workers_copy_gapped_subsets(self):
+        mask = np.arange(len(self.catalog)) % 2 == 1
+        serial = footprints.extractFootprintArrays(footprints.subsetCatalog(self.catalog, mask), self.xy0)
+        parallel = footprints.extractFootprintArrays(self.catalog.subset(mask), self.xy0, nWorkers=2)
+        for name in serial._fields:
+            np.testing.assert_array_equal(getattr(parallel, name), getattr(serial, name), err_msg=name)
+
+    def test_touching_spans_are_kept(self):
+        catalog = _make_catalog(nSources=1)
+        spans = afwGeom.SpanSet([afwGeom.Span(20, 10, 12), afwGeom.Span(20, 13, 14),
+                                 afwGeom.Span(21, 11, 11)], False)
+        catalog[0].setFootprint(afwDetect.Footprint(spans))
+        fp = footprints.extractFootprintArrays(catalog, self.xy0)
+        np.testing.assert_array_equal(fp.spans, [(9, 3, 5), (9, 6, 7), (10, 4, 4)])
+        np.testing.assert_array_equal(fp.bboxes, [(3, 9, 7, 10)])
+
+    def test_empty_footprints(self):
+        catalog = _make_catalog(nSources=3)
+        catalog[1].setFootprint(afwDetect.Footprint(afwGeom.SpanSet()))
+        fp = footprints.extractFootprintArrays(catalog, self.xy0)
+        bboxes = footprints.footprintBBoxes(catalog)
+        self.assertEqual(tuple(fp.bboxes[1]), footprints.EMPTY_BBOX)
+        self.assertEqual(tuple(bboxes[1]), footprints.EMPTY_BBOX)
+        np.testing.assert_array_equal(fp.bboxes[[0, 2]] + np.array(self.xy0*2), bboxes[[0, 2]])
+        index = footprints.FootprintGridIndex(bboxes)
+        np.testing.assert_array_equal(index.query(-1000, -1000, 1000, 1000), [0, 2])
+
+    def test_empty_catalog(self):
+        fp = footprints.extractFootprintArrays(self.catalog[:0], nWorkers=4)
+        self.assertEqual(fp.spans.shape, (0, 3))
+        self.assertEqual(list(fp.spanOffsets), [0])
+
+
+class SelectRecordsTest(lsst.utils.tests.TestCase):
+
+    def test_matches_record_selector(self):
+        catalog = _make_catalog()
+        for selection in footprints.SELECTIONS:
+            expected = [footprints.recordSelector(record, selection) for record in catalog]
+            np.testing.assert_array_equal(footprints.selectRecords(catalog, selection), expected,
+                                          err_msg=selection)
+
+    def test_mask(self):
+        catalog = _make_catalog()
+        mask = np.arange(len(catalog)) % 3 == 0
+        np.testing.assert_array_equal(footprints.selectRecords(catalog, mask), mask)
+        table = footprints.createFootprintsTable(catalog, selection=mask).get_first_table().to_table()
+        np.testing.assert_array_equal(table['id'], catalog['id'][mask])
+        with self.assertRaises(RuntimeError):
+            footprints.selectRecords(catalog, mask[1:])
+        with self.assertRaises(RuntimeError):
+            footprints.selectRecords(catalog, 'parents')
+
+    def test_gapped_selection(self):
+        catalog = _make_catalog(300)
+        mask = np.arange(len(catalog)) % 2 == 0
+        self.assertFalse(catalog.subset(mask).isContiguous())
+        selected = footprints.selectCatalog(catalog, mask)
+        self.assertTrue(selected.isContiguous())
+        np.testing.assert_array_equal(selected['id'], catalog['id'][mask])
+        fp = footprints.extractFootprintArrays(selected)
+        self.assertEqual(len(fp.spanOffsets), mask.sum() + 1)
+        table = footprints.createFootprintsTable(catalog, selection=mask).get_first_table().to_table()
+        np.testing.assert_array_equal(table['id'], catalog['id'][mask])
+        chunks = list(footprints.iterFootprintsTables(catalog, 64, selection=mask))
+        ids = np.concatenate([np.asarray(table.get_first_table().to_table()['id']) for _, _, table in chunks])
+        np.testing.assert_array_equal(ids, catalog['id'][mask])
+
+    def test_non_contiguous_catalog(self):
+        catalog = _make_catalog(300)
+        mask = np.arange(len(catalog)) % 3 != 0
+        subset = catalog.subset(mask)
+        self.assertFalse(subset.isContiguous())
+        expected = footprints.subsetCatalog(catalog, mask)
+        table = footprints.createFootprintsTable(subset, selection='isolated').get_first_table().to_table()
+        np.testing.assert_array_equal(table['id'], footprints.selectCatalog(expected, 'isolated')['id'])
+        fp = footprints.extractFootprintArrays(subset)
+        np.testing.assert_array_equal(fp.spans, footprints.extractFootprintArrays(expected).spans)
+        self.assertEqual(footprints.catalogFingerprint(subset), footprints.catalogFingerprint(expected))
+
+    def test_selected_table(self):
+        catalog = _make_catalog()
+        table = footprints.createFootprintsTable(catalog, selection='blended parents')
+        categories = set(table.get_first_table().to_table()['category'])
+        self.assertEqual(categories, {'blended parent'})
+
+
+def _headerInfos(header):
+    """Return the metadata of a footprints table's FITS header, joining the
+    values split across numbered cards
+    """
+    infos = {}
+    for key, value in header.items():
+        if not key.isupper():
+            name = re.sub(r'_\d+$', '', key)
+            infos[name] = infos.get(name, '') + value
+    return infos
+
+
+class FitsHeaderTest(lsst.utils.tests.TestCase):
+
+    def _roundTrip(self, infos):
+        hdu = fitsWriter.TableHdu(Table({'id': np.arange(3)}), {}, footprints._fitsHeader(infos))
+        with io.BytesIO() as fd:
+            fitsWriter.writeFits(fd, [hdu])
+            data = fd.getvalue()
+        self.assertNotIn(b'CONTINUE', data)
+        with fits.open(io.BytesIO(data)) as hduList:
+            return _headerInfos(hduList[1].header)
+
+    def test_footprints_infos(self):
+        catalog = _make_catalog()
+        infos = footprints._footprintsInfos(footprints.catalogAsAstropy(catalog))
+        self.assertEqual(self._roundTrip(infos), dict(infos))
+
+    def test_long_values(self):
+        infos = [('ColumnNames', ';'.join(f'column_{i}' for i in range(30))),
+                 ('LongName', 'x'*200)]
+        self.assertEqual(self._roundTrip(infos), dict(infos))
+
+
+class CreateFootprintsTableTest(lsst.utils.tests.TestCase):
+
+    def _toXml(self, table):
+        with io.BytesIO() as fd:
+            table.to_xml(fd)
+            return fd.getvalue()
+
+    def test_parallel_output_is_identical(self):
+        catalog = _make_catalog()
+        serial = self._toXml(footprints.createFootprintsTable(catalog))
+        self.assertEqual(self._toXml(footprints.createFootprintsTable(catalog, nWorkers=2)), serial)
+
+    def test_catalog_is_not_modified(self):
+        catalog = _make_catalog()
+        ids = catalog['id'].copy()
+        table = footprints.createFootprintsTable(catalog).get_first_table().to_table()
+        np.testing.assert_array_equal(catalog['id'], ids)
+        np.testing.assert_array_equal(table['id'], ids)
+        self.assertEqual(table['spans'][0].tolist(),
+                         [v for s in catalog[0].getFootprint().getSpans()
+                          for v in (s.getY(), s.getX0(), s.getX1())])
+
+    def test_compact_table_matches_votable(self):
+        catalog = _make_catalog()
+        votable = footprints.createFootprintsTable(catalog).get_first_table()
+        expected = votable.to_table()
+        with io.BytesIO() as fd:
+            fitsWriter.writeFits(fd, [footprints.createFootprintsHdu(catalog)])
+            fd.seek(0)
+            with fits.open(fd) as hduList:
+                infos = _headerInfos(hduList[1].header)
+                self.assertEqual(infos, {info.name: info.value for info in votable.infos})
+                data = hduList[1].data
+                self.assertEqual(sorted(data.columns.names), sorted(expected.colnames))
+                np.testing.assert_array_equal(data['footprint_corner2_y'], expected['footprint_corner2_y'])
+                for i in range(len(catalog)):
+                    np.testing.assert_array_equal(data['spans'][i], expected['spans'][i])
+                    np.testing.assert_allclose(data['peaks'][i], expected['peaks'][i], rtol=1e-6)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not available")
+    def test_arrow_tables(self):
+        catalog = _make_catalog()
+        votable = footprints.createFootprintsTable(catalog).get_first_table()
+        expected = votable.to_table()
+        table = footprints.createFootprintsArrow(catalog)
+        for tableFormat in ('parquet', 'arrow'):
+            with io.BytesIO() as fd:
+                footprints.writeArrowTable(fd, table, tableFormat)
+                fd.seek(0)
+                if tableFormat == 'parquet':
+                    result = pyarrow.parquet.read_table(fd)
+                else:
+                    result = pyarrow.ipc.open_file(fd).read_all()
+            metadata = {key.decode(): value.decode() for key, value in result.schema.metadata.items()}
+            self.assertEqual(metadata, {info.name: info.value for info in votable.infos})
+            self.assertEqual(sorted(result.column_names), sorted(expected.colnames))
+            for i in range(len(catalog)):
+                self.assertEqual(result['spans'][i].as_py(), list(expected['spans'][i]))
+                np.testing.assert_allclose(result['peaks'][i].as_py(), expected['peaks'][i], rtol=1e-6)
+
+    def test_chunks(self):
+        catalog = _make_catalog()
+        chunks = list(footprints.iterFootprintsTables(catalog, 15))
+        self.assertEqual([(start, stop) for start, stop, _ in chunks], [(0, 15), (15, 30), (30, 40)])
+        ids = np.concatenate([np.asarray(table.get_first_table().to_table()['id']) for _, _, table in chunks])
+        np.testing.assert_array_equal(ids, catalog['id'])
+        (_, _, hdu), = footprints.iterFootprintsTables(catalog, 100, tableFormat='fits')
+        self.assertIsInstance(hdu, fitsWriter.TableHdu)
+
+
+class CreateCatalogTableTest(lsst.utils.tests.TestCase):
+
+    def test_compact_table(self):
+        catalog = _make_catalog()
+        hdu, meta = footprints.createCatalogTable(catalog, columns=['parent'], selection='isolated')
+        self.assertEqual(meta, {'CatalogCoordColumns': 'slot_Centroid_x;slot_Centroid_y;ZERO_BASED',
+                                'pixelsys': 'zero-based'})
+        selected = footprints.selectCatalog(catalog, 'isolated')
+        with io.BytesIO() as fd:
+            fitsWriter.writeFits(fd, [hdu])
+            fd.seek(0)
+            with fits.open(fd) as hduList:
+                self.assertEqual(hduList[1].header['CatalogCoordColumns'], meta['CatalogCoordColumns'])
+                data = hduList[1].data
+                self.assertEqual(data.columns.names, ['id', 'slot_Centroid_x', 'slot_Centroid_y', 'parent'])
+                np.testing.assert_array_equal(data['id'], selected['id'])
+                np.testing.assert_array_equal(data['slot_Centroid_x'], selected['slot_Centroid_x'])
+
+    def test_coordinate_columns(self):
+        catalog = _make_catalog()
+        _, meta = footprints.createCatalogTable(catalog, 'slot_Centroid_y', 'slot_Centroid_x',
+                                                tableFormat='votable')
+        self.assertEqual(meta['CatalogCoordColumns'], 'slot_Centroid_y;slot_Centroid_x;ZERO_BASED')
+        # coord_ra and coord_dec are not set
+        with self.assertRaises(RuntimeError):
+            footprints.createCatalogTable(catalog, 'coord_ra', 'coord_dec', coordSys='EQ_J2000')
+
+
+class CatalogFingerprintTest(lsst.utils.tests.TestCase):
+
+    def test_same_catalog(self):
+        self.assertEqual(footprints.catalogFingerprint(_make_catalog()),
+                         footprints.catalogFingerprint(_make_catalog()))
+
+    def test_peak_positions(self):
+        catalog = _make_catalog()
+        before = footprints.catalogFingerprint(catalog)
+        footprint = catalog[5].getFootprint()
+        moved = afwDetect.Footprint(footprint.getSpans())
+        for peak in footprint.getPeaks():
+            moved.addPeak(peak.getFx() + 0.25, peak.getFy(), peak.getPeakValue())
+        catalog[5].setFootprint(moved)
+        self.assertEqual(footprints.footprintBBoxes(catalog)[5].tolist(),
+                         [footprint.getBBox().getMinX(), footprint.getBBox().getMinY(),
+                          footprint.getBBox().getMaxX(), footprint.getBBox().getMaxY()])
+        self.assertNotEqual(footprints.catalogFingerprint(catalog), before)
+
+    def test_span_shapes(self):
+        catalog = _make_catalog(nSources=1)
+        spans = [afwGeom.Span(20, 10, 12), afwGeom.Span(21, 11, 13)]
+        catalog[0].setFootprint(afwDetect.Footprint(afwGeom.SpanSet(spans)))
+        before = footprints.catalogFingerprint(catalog)
+        # Same area and bounding box
+        spans = [afwGeom.Span(20, 11, 13), afwGeom.Span(21, 10, 12)]
+        catalog[0].setFootprint(afwDetect.Footprint(afwGeom.SpanSet(spans)))
+        self.assertNotEqual(footprints.catalogFingerprint(catalog), before)
+
+
+class FootprintOverlayTest(lsst.utils.tests.TestCase):
+    """Culled overlays of a real catalog upload the footprints in view."""
+
+    def setUp(self):
+        self.catalog = _make_catalog(300)
+        self.impl = makeImpl(self, frame=0)
+        self.impl._lastImageBBox = geom.Box2I(geom.Point2I(0, 0), geom.Extent2I(500, 500))
+        self.tables = []
+
+        def upload(fd, dataType):
+            self.tables.append(parse(io.BytesIO(fd.read())).get_first_table().to_table())
+            return f"table-{len(self.tables)}"
+
+        self.impl._client.upload_data.side_effect = upload
+        self.impl._client.overlay_footprints.return_value = {"success": True}
+
+    def test_culled_footprints(self):
+        self.impl._zoom(2)
+        self.impl._pan(100, 100)
+        self.impl.overlayFootprints(self.catalog, cull=True, viewSize=200)
+        self.impl._pan(300, 300)
+        shown = self.impl._footprintOverlays["detection footprints 0"].shown
+        self.assertTrue(0 < shown.sum() < len(self.catalog))
+        self.assertEqual(len(self.tables), 2)
+        ids = np.concatenate([np.asarray(table['id']) for table in self.tables])
+        np.testing.assert_array_equal(np.sort(ids), np.sort(self.catalog['id'][shown]))
+
+    def test_level_of_detail(self):
+        self.impl._zoom(0.6)
+        self.impl._pan(100, 100)
+        self.impl.overlayFootprints(self.catalog, cull=True, viewSize=200, levelOfDetail=True,
+                                    detailZooms=(1, 0.5))
+        overlay = self.impl._footprintOverlays["detection footprints 0"]
+        self.assertTrue(0 < overlay.shown.sum() < len(self.catalog))
+        self.impl._pan(400, 400)
+        regions = [region for c in self.impl._client.add_region_data.call_args_list
+                   for region in c.kwargs["region_data"]]
+        self.assertEqual(len(regions), overlay.shown.sum())
+        self.assertTrue(all(region.startswith("polygon(") for region in regions))
+        self.assertEqual(self.tables, [])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -27,38 +27,25 @@ other on the server.
 """
 
 import unittest
-from types import SimpleNamespace
-from unittest import mock
+
+import numpy as np
 
 import lsst.utils.tests
 from lsst.display.firefly import firefly as firefly_mod
+from fireflyTestUtils import makeDisplay, makeImpl
 
 
-def _make_impl(frame, mask_ids=None, mask_dict=None, mask_plane_colors=None,
-               default_mask_plane_color=None, mask_transparencies=None):
-    """Construct a ``DisplayImpl`` without running ``__init__``.
-
-    ``DisplayImpl.__init__`` requires a live Firefly server; we sidestep it
-    via ``__new__`` and inject only the attributes the methods under test
-    read.  ``display`` is stubbed as a SimpleNamespace exposing the small
-    surface those methods touch (``frame``, ``getMaskPlaneColor``,
-    ``_defaultMaskPlaneColor``).
+def _make_impl(testCase, frame, mask_ids=None, mask_dict=None, mask_plane_colors=None):
+    """Make a ``DisplayImpl`` for ``frame`` talking to a mock client, with
+    the mask layers ``mask_ids`` already overlaid from a mask with the
+    planes ``mask_dict``, colored as in ``mask_plane_colors``
     """
-    impl = firefly_mod.DisplayImpl.__new__(firefly_mod.DisplayImpl)
-    impl.display = SimpleNamespace(
-        frame=frame,
-        getMaskPlaneColor=lambda name: (mask_plane_colors or {}).get(name, "red"),
-        _defaultMaskPlaneColor=default_mask_plane_color or {},
-    )
-    impl._maskIds = list(mask_ids) if mask_ids is not None else []
-    impl._maskDict = dict(mask_dict) if mask_dict is not None else {}
-    impl._maskPlaneColors = dict(mask_plane_colors) if mask_plane_colors is not None else {}
-    impl._maskTransparencies = dict(mask_transparencies) if mask_transparencies is not None else {}
+    impl = makeImpl(testCase, display=makeDisplay(frame, mask_plane_colors))
+    impl._maskIds = list(mask_ids or [])
+    impl._maskDict = dict(mask_dict or {})
+    impl._maskPlaneColors = dict(mask_plane_colors or {})
     impl._fireflyFitsID = "fits-id-stub"
-    # ``__del__`` -> ``_close()`` reads these attributes; satisfy it
-    # since we are bypassing ``__init__``.
-    impl.verbose = False
-    impl._client = None
+    impl._fireflyMaskOnServer = "mask-id-stub"
     return impl
 
 
@@ -81,13 +68,13 @@ class RemoveMasksTest(unittest.TestCase):
 
     def test_only_removes_current_frame(self):
         impl = _make_impl(
-            frame=1,
+            self, frame=1,
             mask_ids=[(0, "DETECTED"), (1, "DETECTED"), (1, "BAD"), (2, "SAT")],
         )
-        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
-            impl._remove_masks()
-            removed = [(c.kwargs["plot_id"], c.kwargs["mask_id"])
-                       for c in client.remove_mask.call_args_list]
+        client = impl._client
+        impl._remove_masks()
+        removed = [(c.kwargs["plot_id"], c.kwargs["mask_id"])
+                   for c in client.remove_mask.call_args_list]
         # Frame 1 layers removed, frames 0 and 2 left alone.
         self.assertEqual(set(removed),
                          {("1", "f1__DETECTED"), ("1", "f1__BAD")})
@@ -98,32 +85,64 @@ class SetMaskPlaneColorTest(unittest.TestCase):
     """``setMaskPlaneColor`` should retarget only the current frame's
     layer, leaving sibling frames' layers in place."""
 
-    def test_scopes_mask_id(self):
+    def test_recolors_in_place(self):
         impl = _make_impl(
-            frame=2,
+            self, frame=2,
+            mask_ids=[(0, "DETECTED"), (2, "DETECTED")],
             mask_dict={"DETECTED": 5},
             mask_plane_colors={"DETECTED": "red"},
         )
-        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
-            impl._setMaskPlaneColor("DETECTED", "cyan")
-            (remove_call,) = client.remove_mask.call_args_list
-            (add_call,) = client.add_mask.call_args_list
-        self.assertEqual(remove_call.kwargs["plot_id"], "2")
-        self.assertEqual(remove_call.kwargs["mask_id"], "f2__DETECTED")
+        client = impl._client
+        impl._setMaskPlaneColor("DETECTED", "cyan")
+        (call,) = client.dispatch.call_args_list
+        self.assertEqual(client.remove_mask.call_count, 0)
+        self.assertEqual(client.add_mask.call_count, 0)
+        self.assertEqual(call.kwargs["action_type"], "ImagePlotCntlr.overlayPlotChangeAttributes")
+        self.assertEqual(call.kwargs["payload"], {"plotId": "2", "imageOverlayId": "f2__DETECTED",
+                                                  "attributes": {"color": "cyan"}, "doReplot": True})
+        self.assertEqual(impl._maskPlaneColors["DETECTED"], "cyan")
+
+    def test_ignored_plane_is_added(self):
+        impl = _make_impl(
+            self, frame=2,
+            mask_dict={"DETECTED": 5},
+            mask_plane_colors={"DETECTED": "ignore"},
+        )
+        client = impl._client
+        impl._setMaskPlaneColor("DETECTED", "cyan")
+        (add_call,) = client.add_mask.call_args_list
         self.assertEqual(add_call.kwargs["plot_id"], "2")
         self.assertEqual(add_call.kwargs["mask_id"], "f2__DETECTED")
-        self.assertEqual(impl._maskPlaneColors["DETECTED"], "cyan")
+        self.assertEqual(add_call.kwargs["file_on_server"], "mask-id-stub")
+        self.assertEqual(add_call.kwargs["color"], "cyan")
+        self.assertEqual(impl._maskIds, [(2, "DETECTED")])
 
     def test_ignore_color_skips_add(self):
         impl = _make_impl(
-            frame=0,
+            self, frame=0,
+            mask_ids=[(0, "DETECTED")],
             mask_dict={"DETECTED": 5},
             mask_plane_colors={"DETECTED": "red"},
         )
-        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
-            impl._setMaskPlaneColor("DETECTED", "ignore")
-            self.assertEqual(client.remove_mask.call_count, 1)
-            self.assertEqual(client.add_mask.call_count, 0)
+        client = impl._client
+        impl._setMaskPlaneColor("DETECTED", "ignore")
+        self.assertEqual(client.remove_mask.call_count, 1)
+        self.assertEqual(client.add_mask.call_count, 0)
+        self.assertEqual(impl._maskIds, [])
+
+    def test_several_planes(self):
+        impl = _make_impl(
+            self, frame=1,
+            mask_ids=[(1, "DETECTED"), (1, "BAD"), (1, "SAT")],
+            mask_dict={"DETECTED": 5, "BAD": 0, "SAT": 1},
+        )
+        client = impl._client
+        impl.setMaskPlaneColors({"DETECTED": "blue", "BAD": "green", "SAT": "ignore"})
+        changed = [(c.kwargs["payload"]["imageOverlayId"], c.kwargs["payload"]["attributes"])
+                   for c in client.dispatch.call_args_list]
+        self.assertEqual(client.remove_mask.call_count, 1)
+        self.assertEqual(client.add_mask.call_count, 0)
+        self.assertCountEqual(changed, [("f1__DETECTED", {"color": "blue"}), ("f1__BAD", {"color": "green"})])
 
 
 class SetMaskTransparencyTest(unittest.TestCase):
@@ -131,10 +150,10 @@ class SetMaskTransparencyTest(unittest.TestCase):
     the dispatched ``imageOverlayId`` must be the frame-scoped id."""
 
     def test_named_plane_uses_scoped_overlay_id(self):
-        impl = _make_impl(frame=3)
-        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
-            impl._setMaskTransparency(40, "DETECTED")
-            (call,) = client.dispatch.call_args_list
+        impl = _make_impl(self, frame=3)
+        client = impl._client
+        impl._setMaskTransparency(40, "DETECTED")
+        (call,) = client.dispatch.call_args_list
         payload = call.kwargs["payload"]
         self.assertEqual(payload["plotId"], "3")
         self.assertEqual(payload["imageOverlayId"], "f3__DETECTED")
@@ -144,17 +163,98 @@ class SetMaskTransparencyTest(unittest.TestCase):
         # ``maskName=None`` means "all of this frame's planes".  Layers
         # registered against other frames must not be touched.
         impl = _make_impl(
-            frame=1,
+            self, frame=1,
             mask_ids=[(0, "DETECTED"), (1, "DETECTED"), (1, "BAD")],
-            default_mask_plane_color={},
         )
-        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
-            impl._setMaskTransparency(0, None)
-            ids = {c.kwargs["payload"]["imageOverlayId"]
-                   for c in client.dispatch.call_args_list}
+        client = impl._client
+        impl._setMaskTransparency(0, None)
+        ids = {c.kwargs["payload"]["imageOverlayId"]
+               for c in client.dispatch.call_args_list}
         self.assertEqual(ids, {"f1__DETECTED", "f1__BAD"})
 
 
+class _Mask:
+    """Stand-in for an `lsst.afw.image.Mask`."""
+
+    def __init__(self, array, planes):
+        self.array = array
+        self.planes = planes
+
+    def getMaskPlaneDict(self):
+        return self.planes
+
+    def getArray(self):
+        return self.array
+
+    def getBBox(self):
+        return None
+
+    def getXY0(self):
+        return (0, 0)
+
+
+class CompositeMaskTest(unittest.TestCase):
+    """Composited masks are uploaded once and overlaid with a layer per
+    color."""
+
+    def setUp(self):
+        planes = {"BAD": 0, "SAT": 1, "INTRP": 2, "DETECTED": 5, "EDGE": 4, "CR": 3}
+        array = np.zeros((4, 5), dtype=np.int32)
+        array[0, :] = 1 << 0
+        array[1, :] = 1 << 1
+        array[2, :] = (1 << 2) | (1 << 4)
+        array[3, :2] = 1 << 5
+        colors = {"BAD": "red", "SAT": "green", "INTRP": "Green", "DETECTED": "blue", "EDGE": "ignore",
+                  "CR": "magenta"}
+        self.impl = _make_impl(self, frame=1, mask_plane_colors=colors)
+        self.impl.setMaskOptions(composite=True)
+        self.uploads = []
+        self.impl._uploadHdus = lambda hdus: (self.uploads.append(hdus[0].array) or
+                                              (f"composite-{len(self.uploads)}", False))
+        self.mask = _Mask(array, planes)
+
+    def test_layer_per_color(self):
+        client = self.impl._client
+        self.impl._mtv(None, self.mask)
+        calls = client.add_mask.call_args_list
+        self.assertCountEqual([(c.kwargs["mask_id"], c.kwargs["bit_number"], c.kwargs["color"])
+                               for c in calls],
+                              [("f1__BAD", 0, "red"), ("f1__SAT+INTRP", 1, "green"),
+                               ("f1__DETECTED", 2, "blue")])
+        self.assertEqual({c.kwargs["file_on_server"] for c in calls}, {"composite-1"})
+        (composite,) = self.uploads
+        self.assertEqual(composite.dtype, np.uint8)
+        np.testing.assert_array_equal(composite[:, 0], [1, 2, 2, 4])
+        np.testing.assert_array_equal(composite[3], [4, 4, 0, 0, 0])
+
+    def test_recolor_and_transparency(self):
+        client = self.impl._client
+        self.impl._mtv(None, self.mask)
+        client.reset_mock()
+        self.impl._setMaskPlaneColor("SAT", "red")
+        removed = {c.kwargs["mask_id"] for c in client.remove_mask.call_args_list}
+        added = [c.kwargs["mask_id"] for c in client.add_mask.call_args_list]
+        self.impl._setMaskTransparency(30, "BAD")
+        (dispatch,) = client.dispatch.call_args_list
+        self.assertEqual(removed, {"f1__BAD", "f1__SAT+INTRP", "f1__DETECTED"})
+        # Actions on different layers are dispatched concurrently
+        self.assertCountEqual(added, ["f1__BAD+SAT", "f1__INTRP", "f1__DETECTED"])
+        self.assertEqual(len(self.uploads), 2)
+        self.assertEqual(dispatch.kwargs["payload"]["imageOverlayId"], "f1__BAD+SAT")
+
+    def test_recolor_in_place(self):
+        client = self.impl._client
+        self.impl._mtv(None, self.mask)
+        client.reset_mock()
+        self.impl.setMaskPlaneColors({"BAD": "blue", "DETECTED": "red"})
+        changed = [(c.kwargs["payload"]["imageOverlayId"], c.kwargs["payload"]["attributes"])
+                   for c in client.dispatch.call_args_list]
+        self.assertEqual(client.remove_mask.call_count, 0)
+        self.assertEqual(client.add_mask.call_count, 0)
+        self.assertCountEqual(changed, [("f1__BAD", {"color": "blue"}), ("f1__DETECTED", {"color": "red"})])
+        self.assertEqual(len(self.uploads), 1)
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 
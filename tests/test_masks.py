@@ -0,0 +1,76 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+"""Tests of the scan for the mask planes in use, and of composited masks.
+"""
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+from lsst.display.firefly.masks import compositeMaskPlanes, maskPlaneCounts, usedMaskBits
+
+
+class MaskScanTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.mask = np.zeros((301, 200), dtype=np.int32)
+        self.mask[rng.integers(0, 301, 50), rng.integers(0, 200, 50)] |= 1 << 5
+        self.mask[:10] |= 1 << 1
+        self.mask[300, 199] |= np.int32(-2**31)  # bit 31
+        self.expected = {bit: int(np.count_nonzero(self.mask.view(np.uint32) & np.uint32(1 << bit)))
+                         for bit in (1, 5, 31)}
+
+    def test_used_bits(self):
+        self.assertEqual(usedMaskBits(self.mask), (1 << 1) | (1 << 5) | (1 << 31))
+        self.assertEqual(usedMaskBits(self.mask, nThreads=4, blockRows=7), usedMaskBits(self.mask))
+        self.assertEqual(usedMaskBits(np.zeros((0, 5), dtype=np.int32)), 0)
+
+    def test_counts(self):
+        self.assertEqual(maskPlaneCounts(self.mask), self.expected)
+        self.assertEqual(maskPlaneCounts(self.mask, nThreads=3, blockRows=50), self.expected)
+        self.assertEqual(maskPlaneCounts(self.mask, bits=[0, 5]), {0: 0, 5: self.expected[5]})
+
+    def test_composite(self):
+        groups = [(1 << 1) | (1 << 31), 1 << 5]
+        composite = compositeMaskPlanes(self.mask, groups, nThreads=2, blockRows=100)
+        self.assertEqual(composite.dtype, np.uint8)
+        bits = self.mask.view(np.uint32)
+        np.testing.assert_array_equal(composite & 1, (bits & np.uint32(groups[0])) != 0)
+        np.testing.assert_array_equal(composite >> 1, (bits & np.uint32(groups[1])) != 0)
+        self.assertEqual(compositeMaskPlanes(self.mask, [1]*12).dtype, np.int16)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,287 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests for displaying images in many frames at once.
+"""
+
+import io
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import requests
+
+import lsst.utils.tests
+from lsst.display.firefly import firefly as firefly_mod
+from lsst.display.firefly import fitsWriter
+from fireflyTestUtils import makeImpl
+
+
+class _Image:
+    """Stand-in for an `lsst.afw.image.Image`."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def getArray(self):
+        return self.array
+
+    def getBBox(self):
+        return None
+
+    def getXY0(self):
+        return (0, 0)
+
+
+class _Mask(_Image):
+    """Stand-in for an `lsst.afw.image.Mask`."""
+
+    def getMaskPlaneDict(self):
+        return {"BAD": 0}
+
+
+class _MaskedImage:
+    """Stand-in for an `lsst.afw.image.MaskedImage`."""
+
+    def __init__(self, image, mask):
+        self.image = image
+        self.mask = mask
+
+    def getImage(self):
+        return self.image
+
+    def getMask(self):
+        return self.mask
+
+
+class _Client:
+    """Stand-in for a `firefly_client.FireflyClient` recording uploads and
+    how many were in flight at once
+
+    If ``concurrency`` is given, each upload waits until that many are in
+    flight together, failing if they never are.
+    """
+
+    channel = "test"
+
+    def __init__(self, concurrency=None):
+        self.barrier = None if concurrency is None else threading.Barrier(concurrency, timeout=10)
+        self.session = requests.Session()
+        self.adapters = dict(self.session.adapters)
+        self.poolSizes = set()
+        self.render_tree_id = None
+        self.uploads = {}
+        self.shown = {}
+        self.showSuccess = True
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._lock = threading.Lock()
+
+    def upload_fits_data(self, fd):
+        with self._lock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            self.poolSizes.add(self.session.get_adapter("http://firefly")._pool_maxsize)
+        try:
+            if self.barrier is not None:
+                self.barrier.wait()
+        finally:
+            with self._lock:
+                self.inFlight -= 1
+                fileId = f"file-{len(self.uploads)}"
+                self.uploads[fileId] = fd.read()
+        return fileId
+
+    def show_fits_image(self, fileId, plot_id, **kwargs):
+        self.shown[plot_id] = fileId
+        return {"success": self.showSuccess}
+
+    def add_mask(self, **kwargs):
+        return {"success": True}
+
+    def delete_region_layer(self, region_layer_id, plot_id=None):
+        return {"success": True}
+
+    def get_firefly_url(self):
+        return "http://firefly"
+
+
+def _make_display(testCase, frame, client, multiExtension=False, cacheBytes=1 << 30):
+    """Make a stand-in for an `lsst.afw.display.Display` showing ``data``
+    as ``mtv`` does
+    """
+    impl = makeImpl(testCase, frame, client=client, cacheBytes=cacheBytes)
+    impl.setUploadOptions(multiExtension=multiExtension)
+    display = SimpleNamespace(_impl=impl, frame=frame)
+
+    def mtv(data, title=""):
+        image, mask, wcs = firefly_mod._splitImageData(data)
+        impl._mtv(image, mask, wcs, title)
+    display.mtv = mtv
+    return display
+
+
+class MtvManyTest(unittest.TestCase):
+
+    nFrames = 16
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.images = {frame: _Image(rng.normal(size=(20, 30)).astype(np.float32))
+                       for frame in range(self.nFrames)}
+
+    def _mtvMany(self, images, multiExtension=(), displays=None, concurrency=None, **kwargs):
+        """Display ``images`` with ``mtvMany`` on new displays, or on
+        ``displays``, multi-extension on the frames in ``multiExtension``,
+        uploading them in groups of ``concurrency`` if given
+        """
+        client = _Client(concurrency)
+        if displays is None:
+            displays = {frame: _make_display(self, frame, client, frame in multiExtension)
+                        for frame in images}
+        with mock.patch.object(firefly_mod, "_fireflyClient", client), \
+                mock.patch.object(firefly_mod.afwDisplay, "getDisplay", displays.get, create=True):
+            displays[0]._impl.mtvMany(images, **kwargs)
+            return client
+
+    def test_serial(self):
+        client = self._mtvMany(self.images, processes=0, connections=1)
+        self.assertEqual(client.maxInFlight, 1)
+        self.assertEqual(len(client.uploads), self.nFrames)
+
+    def test_uploads_use_all_connections(self):
+        # Uploads only complete eight at a time
+        client = self._mtvMany(self.images, processes=0, connections=8, concurrency=8)
+        self.assertFalse(client.barrier.broken)
+        self.assertEqual(client.maxInFlight, 8)
+        self.assertEqual(sorted(client.shown), sorted(str(frame) for frame in self.images))
+        self.assertEqual(len(client.uploads), self.nFrames)
+        self.assertEqual(client.session.get_adapter("http://firefly")._pool_maxsize, 10)
+
+    def test_keeps_connections_alive(self):
+        client = self._mtvMany(self.images, processes=0, connections=self.nFrames)
+        self.assertEqual(client.poolSizes, {self.nFrames})
+        # The session's own adapters are put back
+        self.assertEqual(client.session.adapters, client.adapters)
+
+    def test_processes_are_spawned(self):
+        pools = []
+
+        def makePool(max_workers, mp_context):
+            pools.append(mp_context.get_start_method())
+            return firefly_mod.ThreadPoolExecutor(max_workers=max_workers)
+        with mock.patch.object(firefly_mod, "ProcessPoolExecutor", makePool):
+            client = self._mtvMany(self.images, processes=2)
+        self.assertEqual(pools, ["spawn"])
+        self.assertEqual(len(client.uploads), self.nFrames)
+
+    def test_files_match_single_frame_uploads(self):
+        mask = _Mask(np.ones((20, 30), dtype=np.int32))
+        images = {0: _MaskedImage(self.images[0], mask), 1: self.images[1]}
+        displays = {0: _make_display(self, 0, None, multiExtension=True), 1: _make_display(self, 1, None)}
+        client = self._mtvMany(images, displays=displays, processes=2)
+        # Each file was uploaded once, and then shown
+        self.assertEqual(len(client.uploads), 2)
+        self.assertEqual(displays[0]._impl._fireflyMaskOnServer, client.shown["0"])
+        self.assertFalse(displays[0]._impl._prepared)
+        for frame, data in images.items():
+            fileId = client.shown[str(frame)]
+            (_, hdus), = displays[frame]._impl._preparedFiles(data, "")
+            with io.BytesIO() as fd:
+                fitsWriter.writeFits(fd, hdus)
+                self.assertEqual(client.uploads[fileId], fd.getvalue())
+
+    def test_uploads_once_without_cache(self):
+        # The file ids of the uploads are used whether or not they are cached
+        displays = {frame: _make_display(self, frame, None, cacheBytes=0) for frame in self.images}
+        client = self._mtvMany(self.images, displays=displays, processes=0)
+        self.assertEqual(len(client.uploads), self.nFrames)
+        self.assertEqual(sorted(client.shown.values()), sorted(client.uploads))
+        for display in displays.values():
+            self.assertFalse(display._impl._prepared)
+
+    def test_failed_show_forgets_files(self):
+        # The mask file is uploaded, but never shown as the image fails
+        mask = _Mask(np.ones((20, 30), dtype=np.int32))
+        displays = {0: _make_display(self, 0, None)}
+        client = _Client()
+        client.showSuccess = False
+        with mock.patch.object(firefly_mod, "_fireflyClient", client), \
+                mock.patch.object(firefly_mod.afwDisplay, "getDisplay", displays.get, create=True):
+            with self.assertRaises(RuntimeError):
+                displays[0]._impl.mtvMany({0: _MaskedImage(self.images[0], mask)}, processes=0)
+        self.assertEqual(len(client.uploads), 2)
+        self.assertFalse(displays[0]._impl._prepared)
+
+    def test_serialization_is_bounded(self):
+        connections = 2
+        lock = threading.Lock()
+        serialized = []
+        allSerialized = threading.Event()
+        client = _Client()
+        upload = client.upload_fits_data
+
+        def serialize(hdus):
+            with lock:
+                # Frames serialized and not yet shown
+                serialized.append(len(serialized) + 1 - len(client.shown))
+                if len(serialized) == self.nFrames:
+                    allSerialized.set()
+            return serializeHdus(hdus)
+
+        def slowUpload(fd):
+            # Uploads stall until every frame is serialized, unless that
+            # never happens, as it should not
+            if not allSerialized.wait(0.5):
+                allSerialized.set()
+            return upload(fd)
+
+        serializeHdus = firefly_mod._serializeHdus
+        client.upload_fits_data = slowUpload
+        displays = {frame: _make_display(self, frame, client) for frame in self.images}
+        with mock.patch.object(firefly_mod, "_serializeHdus", serialize), \
+                mock.patch.object(firefly_mod, "_fireflyClient", client), \
+                mock.patch.object(firefly_mod.afwDisplay, "getDisplay", displays.get, create=True):
+            displays[0]._impl.mtvMany(self.images, processes=0, connections=connections)
+        self.assertEqual(len(serialized), self.nFrames)
+        self.assertLessEqual(max(serialized), 2*connections)
+        self.assertEqual(len(client.shown), self.nFrames)
+
+    def test_not_firefly(self):
+        displays = {0: _make_display(self, 0, None), 1: SimpleNamespace(_impl=object())}
+        with self.assertRaises(firefly_mod.FireflyError):
+            self._mtvMany({0: self.images[0], 1: self.images[1]}, displays=displays)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
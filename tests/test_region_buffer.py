@@ -0,0 +1,183 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+"""Tests of regions drawn in bulk, of their batching, and of simplified lines.
+"""
+
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import lsst.utils.tests
+from lsst.display.firefly import firefly as firefly_mod
+from lsst.display.firefly.regions import RegionBuffer, dotRegions, lineRegions, simplifyPolylines
+from fireflyTestUtils import makeImpl
+
+
+class BulkRegionsTest(unittest.TestCase):
+
+    def test_dots(self):
+        self.assertEqual(dotRegions([0, 9], [1, 19], '+', 2, 'red'),
+                         ["line 1 4 1 0 # color=red", "line -1 2 3 2 # color=red",
+                          "line 10 22 10 18 # color=red", "line 8 20 12 20 # color=red"])
+        self.assertEqual(dotRegions([0, 9], [1, 19], 'o', [2, 3]), ["circle 1 2 2i", "circle 10 20 3i"])
+        self.assertEqual(len(dotRegions(np.arange(5), np.arange(5), '*')), 15)
+        with self.assertRaises(RuntimeError):
+            dotRegions([0], [0], 'text')
+
+    def test_lines(self):
+        vertices = [(0, 0), (1, 0), (1, 1), (5, 5), (6, 6)]
+        self.assertEqual(lineRegions(vertices),
+                         ["line 1 1 2 1", "line 2 1 2 2", "line 2 2 6 6", "line 6 6 7 7"])
+        self.assertEqual(lineRegions(vertices, [0, 3, 3, 4, 5], 'blue'),
+                         ["line 1 1 2 1 # color=blue", "line 2 1 2 2 # color=blue"])
+        self.assertEqual(lineRegions([]), [])
+
+
+class RegionBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.buffer = RegionBuffer(self.sent.append, maxRegions=4, maxBytes=100)
+
+    def test_unbuffered_sends_at_once(self):
+        self.buffer.add(["a"])
+        self.buffer.add(["b", "c"])
+        self.assertEqual(self.sent, [["a"], ["b", "c"]])
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_buffered_sends_full_batches(self):
+        self.buffer.buffered = True
+        for i in range(10):
+            self.buffer.add([str(i)])
+        self.assertEqual(self.sent, [["0", "1", "2", "3"], ["4", "5", "6", "7"]])
+        self.buffer.flush()
+        self.assertEqual(self.sent[-1], ["8", "9"])
+
+    def test_payloads_capped_in_bytes(self):
+        regions = ["x"*40 for _ in range(5)]
+        self.buffer.add(regions)
+        self.assertEqual([len(batch) for batch in self.sent], [2, 2, 1])
+        self.assertEqual(self.buffer.nbytes, 0)
+
+    def test_nested_batches(self):
+        with self.buffer.batch():
+            self.buffer.add(["a"])
+            with self.buffer.batch():
+                self.buffer.add(["b"])
+            self.assertEqual(self.sent, [])
+            self.buffer.add(["c"])
+        self.assertEqual(self.sent, [["a", "b", "c"]])
+
+    def test_flush_timer(self):
+        sent = threading.Event()
+        self.buffer.send = lambda regions: (self.sent.append(regions), sent.set())
+        self.buffer.flushInterval = 0.01
+        self.buffer.add(["a"])
+        self.buffer.add(["b"])
+        self.assertTrue(sent.wait(5))
+        self.assertEqual(self.sent, [["a", "b"]])
+
+    def test_flush_timer_dispatch(self):
+        dispatched = threading.Event()
+        flushes = []
+        self.buffer.dispatch = lambda flush: (flushes.append(flush), dispatched.set())
+        self.buffer.flushInterval = 0.01
+        self.buffer.add(["a"])
+        self.assertTrue(dispatched.wait(5))
+        self.assertEqual(self.sent, [])
+        (flush,) = flushes
+        flush()
+        self.assertEqual(self.sent, [["a"]])
+
+
+class DisplayRegionsTest(unittest.TestCase):
+    """Drawing many regions in a batch takes few requests."""
+
+    def test_batch_round_trips(self):
+        impl = makeImpl(self)
+        impl.setRegionBufferOptions(maxRegions=1000)
+        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
+            with impl.batchRegions():
+                for i in range(2500):
+                    impl._uploadTextData([f"point({i}, {i})"])
+        self.assertEqual(client.add_region_data.call_count, 3)
+        kwargs = client.add_region_data.call_args.kwargs
+        self.assertEqual(len(kwargs["region_data"]), 500)
+        self.assertEqual(kwargs["region_layer_id"], "lsstRegions1")
+
+    def test_dots_sent_together(self):
+        impl = makeImpl(self)
+        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
+            impl.dots(np.arange(5000), np.arange(5000), 'o', 3)
+        self.assertEqual(client.add_region_data.call_count, 1)
+        self.assertEqual(len(client.add_region_data.call_args.kwargs["region_data"]), 5000)
+
+
+class SimplifiedLinesTest(unittest.TestCase):
+    """Lines are simplified to a tolerance in screen pixels."""
+
+    def test_simplify(self):
+        # a zig-zag of amplitude 0.5 along a straight line, then a corner
+        x = np.arange(101.0)
+        vertices = np.concatenate([np.column_stack([x, 0.5*(x % 2)]), [[100, 50]]])
+        simplified, offsets = simplifyPolylines(vertices, tolerance=1)
+        np.testing.assert_array_equal(simplified, [[0, 0], [100, 0], [100, 50]])
+        self.assertEqual(offsets.tolist(), [0, 3])
+        simplified, _ = simplifyPolylines(vertices, tolerance=0.25)
+        self.assertEqual(len(simplified), len(vertices))
+        simplified, offsets = simplifyPolylines(vertices, [0, 101, 101, 102], tolerance=1, maxSpan=40)
+        np.testing.assert_array_equal(simplified[:, 0], [0, 40, 80, 100, 100])
+        self.assertEqual(offsets.tolist(), [0, 4, 4, 5])
+
+    def test_redrawn_on_zoom(self):
+        impl = makeImpl(self)
+        x = np.arange(101.0)
+        points = np.column_stack([x, 0.5*(x % 2)])
+        with mock.patch.object(firefly_mod, "_fireflyClient") as client:
+            impl.setLineSimplification(2)
+            impl._drawLines(points, 'red')
+            self.assertEqual(client.add_region_data.call_args.kwargs["region_data"],
+                             ["line 1 1 101 1 # color=red"])
+            impl._zoom(8)
+            client.delete_region_layer.assert_called_once_with("lsstRegions1 lines", plot_id="1")
+            self.assertEqual(len(client.add_region_data.call_args.kwargs["region_data"]), 100)
+            impl._zoom(8)
+            self.assertEqual(client.add_region_data.call_count, 2)
+            impl._erase()
+            self.assertEqual(impl._simplifiedLines, [])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
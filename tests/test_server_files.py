@@ -0,0 +1,135 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests for displaying FITS files read directly by the Firefly server.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from astropy.io import fits
+
+import lsst.utils.tests
+from lsst.display.firefly import firefly as firefly_mod
+from fireflyTestUtils import makeDisplay, makeImpl
+
+
+def _write_calexp(path):
+    """Write a file laid out as a calexp, with an empty primary HDU"""
+    mask = fits.ImageHDU(np.zeros((4, 5), dtype=np.int32), name="MASK")
+    mask.header["MP_BAD"] = 0
+    mask.header["MP_CR"] = 3
+    mask.header["HIERARCH MP_DETECTED"] = 5
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(np.zeros((4, 5), dtype=np.float32), name="IMAGE"),
+                  mask]).writeto(path)
+
+
+class MtvFileTest(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dir = os.path.realpath(tmpdir.name)
+        self.path = os.path.join(self.dir, "repo", "calexp.fits")
+        os.makedirs(os.path.dirname(self.path))
+        _write_calexp(self.path)
+        self.client = mock.MagicMock()
+        self.client.show_fits_image.return_value = {"success": True}
+        patcher = mock.patch.object(firefly_mod.upload, "uploadStream",
+                                    side_effect=lambda client, iterChunks, length, spoolBytes:
+                                    self.uploaded.append(b"".join(iterChunks())) or "${upload}")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.uploaded = []
+
+    def _makeImpl(self, pathMap=None):
+        impl = makeImpl(self, client=self.client, display=makeDisplay(2, {"CR": "ignore"}))
+        impl.setServerPathMap(pathMap)
+        return impl
+
+    def test_server_path(self):
+        impl = self._makeImpl({self.dir + "/repo/": "/mnt/repo", self.dir: "/other"})
+        self.assertEqual(impl._serverPath(self.path), "/mnt/repo/calexp.fits")
+        self.assertEqual(impl._serverPath(self.dir + "/repo2/x.fits"), "/other/repo2/x.fits")
+        self.assertIsNone(impl._serverPath("/elsewhere/x.fits"))
+
+    def test_file_on_server(self):
+        impl = self._makeImpl({self.dir: "/mnt"})
+        impl.mtvFile("file://" + self.path, hdu=0, maskHdu=1)
+        (call,) = self.client.show_fits_image.call_args_list
+        self.assertIsNone(call.args[0])
+        self.assertEqual(call.kwargs["file"], "/mnt/repo/calexp.fits")
+        self.assertEqual(call.kwargs["MultiImageIdx"], 0)
+        self.assertEqual(self.uploaded, [])
+        masks = {c.kwargs["mask_id"]: c.kwargs for c in self.client.add_mask.call_args_list}
+        self.assertEqual(set(masks), {"f2__BAD", "f2__DETECTED"})
+        self.assertEqual(masks["f2__DETECTED"]["bit_number"], 5)
+        self.assertEqual(masks["f2__DETECTED"]["image_number"], 1)
+        self.assertEqual(masks["f2__DETECTED"]["file_on_server"], "/mnt/repo/calexp.fits")
+
+    def test_unmapped_file_is_uploaded(self):
+        impl = self._makeImpl()
+        impl.mtvFile(self.path, hdu=0)
+        impl.mtvFile(self.path, hdu=0)
+        with open(self.path, "rb") as fd:
+            self.assertEqual(self.uploaded, [fd.read()])
+        self.assertEqual([c.args[0] for c in self.client.show_fits_image.call_args_list],
+                         ["${upload}", "${upload}"])
+
+    def test_fallback_to_upload(self):
+        impl = self._makeImpl({self.dir: "/mnt"})
+        self.client.show_fits_image.side_effect = [{"success": False}, {"success": True}]
+        impl.mtvFile(self.path, hdu=0, maskHdu=1)
+        self.assertEqual(len(self.uploaded), 1)
+        self.assertEqual(self.client.show_fits_image.call_args.args[0], "${upload}")
+        self.assertEqual({c.kwargs["file_on_server"] for c in self.client.add_mask.call_args_list},
+                         {"${upload}"})
+
+    def test_url(self):
+        impl = self._makeImpl()
+        impl.mtvFile("https://data.lsst.cloud/calexp.fits", hdu=2)
+        (call,) = self.client.show_fits_image.call_args_list
+        self.assertEqual(call.args[0], "https://data.lsst.cloud/calexp.fits")
+        self.assertEqual(call.kwargs["MultiImageIdx"], 2)
+        with self.assertRaises(firefly_mod.FireflyError):
+            impl.mtvFile("https://data.lsst.cloud/calexp.fits", maskHdu=1)
+
+    def test_missing_file(self):
+        impl = self._makeImpl()
+        with self.assertRaises(RuntimeError):
+            impl.mtvFile(os.path.join(self.dir, "missing.fits"))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
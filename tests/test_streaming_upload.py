@@ -0,0 +1,122 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests for streaming FITS uploads, which never hold the whole file in
+memory.
+"""
+
+import unittest
+from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+import lsst.utils.tests
+from lsst.display.firefly import fitsWriter, upload
+from fireflyTestUtils import makeImpl
+
+
+class _Session:
+    """Records the blocks of each request body, as ``requests`` sends them."""
+
+    def __init__(self):
+        self.bodies = []
+
+    def post(self, url, data, headers):
+        self.url = url
+        self.headers = headers
+        self.bodies.append(list(data))
+        self.contentLength = len(data)
+        return SimpleNamespace(status_code=200, text='"$upload/data.fits"')
+
+
+class MultipartStreamTest(unittest.TestCase):
+
+    def test_length_and_body(self):
+        blocks = [b"abc", b"defg"]
+        body = upload.MultipartStream(lambda: iter(blocks), 7)
+        data = b"".join(body)
+        self.assertEqual(len(body), len(data))
+        self.assertIn(b"\r\n\r\nabcdefg\r\n--" + body.boundary.encode(), data)
+        # The body can be iterated again, e.g. when a request is retried
+        self.assertEqual(b"".join(body), data)
+
+    def test_upload_stream(self):
+        session = _Session()
+        client = SimpleNamespace(url_cmd_service="http://firefly/CmdSrv", session=session,
+                                 header_from_ws={"FF-channel": "c"})
+        fileId = upload.uploadStream(client, lambda: iter([b"x"*10, b"y"*5]), 15)
+        self.assertEqual(fileId, '$upload/data.fits"')
+        self.assertIn("type=FITS", session.url)
+        self.assertEqual(session.headers["FF-channel"], "c")
+        self.assertTrue(session.headers["Content-Type"].startswith("multipart/form-data"))
+        self.assertEqual(session.contentLength, sum(len(b) for b in session.bodies[0]))
+
+    def test_spooled_fallback(self):
+        uploaded = []
+
+        def upload_data(fd, dataType):
+            uploaded.append(fd.read())
+            return "$spooled"
+        client = SimpleNamespace(upload_data=upload_data)
+        self.assertEqual(upload.uploadStream(client, lambda: iter([b"ab", b"cd"]), 4), "$spooled")
+        self.assertEqual(uploaded, [b"abcd"])
+
+
+class StreamingUploadTest(unittest.TestCase):
+    """With streaming enabled, no block larger than ``chunkBytes`` (plus a
+    header) is ever built, and the upload matches the in-memory file."""
+
+    def test_blocks_are_bounded(self):
+        array = np.arange(200*50, dtype=np.float32).reshape(200, 50)
+        hdus = [fitsWriter.ImageHdu(array)]
+        session = _Session()
+        client = mock.MagicMock(url_cmd_service="http://firefly/CmdSrv", session=session,
+                                header_from_ws={})
+        impl = makeImpl(self, client=client)
+        impl.setUploadOptions(streaming=True, chunkBytes=1000)
+        self.assertEqual(impl._uploadHdus(hdus), ('$upload/data.fits"', False))
+        # The second display is served from the cache
+        self.assertEqual(impl._uploadHdus(hdus), ('$upload/data.fits"', True))
+        self.assertEqual(len(session.bodies), 1)
+
+        with BytesIO() as fd:
+            fitsWriter.writeFits(fd, hdus)
+            expected = fd.getvalue()
+        body = b"".join(session.bodies[0])
+        self.assertIn(expected, body)
+        pixelBlocks = [b for b in session.bodies[0] if not b.startswith((b"--", b"\r\n", b"SIMPLE"))]
+        self.assertLessEqual(max(len(b) for b in pixelBlocks), 1000)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
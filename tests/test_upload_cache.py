@@ -0,0 +1,213 @@
+#
+# LSST Data Management System
+# Copyright 2026 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+"""Tests for the content-addressed cache of uploaded FITS files.
+"""
+
+import unittest
+from unittest import mock
+
+import lsst.utils.tests
+from lsst.display.firefly import firefly as firefly_mod
+from lsst.display.firefly.cache import UploadCache, contentKey
+from fireflyTestUtils import makeImpl
+
+
+def _fake_write(fd, data, wcs, title, metadata=None):
+    """Stand-in for ``afwDisplay.writeFitsImage``; ``data`` is bytes."""
+    fd.write(data)
+
+
+class UploadCacheTest(unittest.TestCase):
+
+    def test_content_key(self):
+        self.assertEqual(contentKey([b"abc", b"def"]), contentKey([b"abcdef"]))
+        self.assertEqual(contentKey(iter([b"abc", b"def"])), contentKey([b"abcdef"]))
+        self.assertNotEqual(contentKey([b"abc"]), contentKey([b"abd"]))
+
+    def test_lru_eviction_by_bytes(self):
+        cache = UploadCache(100)
+        cache.put("a", "id-a", 40)
+        cache.put("b", "id-b", 40)
+        self.assertEqual(cache.get("a"), "id-a")  # "b" is now least recent
+        cache.put("c", "id-c", 40)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.totalBytes, 80)
+
+    def test_oversized_entry_not_cached(self):
+        cache = UploadCache(10)
+        cache.put("a", "id-a", 11)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.totalBytes, 0)
+
+    def test_invalidate(self):
+        cache = UploadCache(100)
+        cache.put("a", "id-a", 10)
+        cache.put("b", "id-b", 10)
+        cache.invalidate("a")
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.totalBytes, 10)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.totalBytes, 0)
+
+
+class UploadImageTest(unittest.TestCase):
+    """``_uploadImage`` only uploads content it has not uploaded before."""
+
+    def test_identical_content_uploaded_once(self):
+        impl = makeImpl(self, frame=0)
+        with mock.patch.object(firefly_mod, "_fireflyClient") as client, \
+                mock.patch.object(firefly_mod.afwDisplay, "writeFitsImage", _fake_write):
+            client.upload_fits_data.side_effect = ["id-1", "id-2"]
+            first = impl._uploadImage(b"pixels", None, "", None)
+            second = impl._uploadImage(b"pixels", None, "", None)
+            third = impl._uploadImage(b"other pixels", None, "", None)
+        self.assertEqual(first, ("id-1", False))
+        self.assertEqual(second, ("id-1", True))
+        self.assertEqual(third, ("id-2", False))
+        self.assertEqual(client.upload_fits_data.call_count, 2)
+
+    def test_refresh_uploads_again(self):
+        impl = makeImpl(self, frame=0)
+        with mock.patch.object(firefly_mod, "_fireflyClient") as client, \
+                mock.patch.object(firefly_mod.afwDisplay, "writeFitsImage", _fake_write):
+            client.upload_fits_data.side_effect = ["id-1", "id-2"]
+            impl._uploadImage(b"pixels", None, "", None)
+            refreshed = impl._uploadImage(b"pixels", None, "", None, refresh=True)
+        self.assertEqual(refreshed, ("id-2", False))
+
+    def test_clear_upload_cache(self):
+        impl = makeImpl(self, frame=0)
+        with mock.patch.object(firefly_mod, "_fireflyClient") as client, \
+                mock.patch.object(firefly_mod.afwDisplay, "writeFitsImage", _fake_write):
+            client.upload_fits_data.side_effect = ["id-1", "id-2"]
+            impl._uploadImage(b"pixels", None, "", None)
+            impl.clearUploadCache()
+            self.assertEqual(impl._uploadImage(b"pixels", None, "", None), ("id-2", False))
+
+
+class OverlayFootprintsCacheTest(unittest.TestCase):
+    """Overlaying the same catalog again only re-issues the overlay."""
+
+    def setUp(self):
+        self.impl = makeImpl(self, frame=0)
+        self.impl._client.upload_data.side_effect = ["table-1", "table-2"]
+        self.impl._client.overlay_footprints.return_value = {"success": True}
+        patchers = [mock.patch.object(firefly_mod, "catalogFingerprint", lambda catalog: catalog),
+                    mock.patch.object(firefly_mod.DisplayImpl, "_serializeFootprints",
+                                      mock.Mock(side_effect=lambda catalog, *args: catalog.encode()))]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_style_change_reuses_table(self):
+        self.impl.overlayFootprints("catalog", color="red")
+        self.impl.overlayFootprints("catalog", color="blue", style="outline")
+        self.assertEqual(self.impl._client.upload_data.call_count, 1)
+        self.assertEqual(firefly_mod.DisplayImpl._serializeFootprints.call_count, 1)
+        calls = self.impl._client.overlay_footprints.call_args_list
+        self.assertEqual([c.kwargs["footprint_file"] for c in calls], ["table-1", "table-1"])
+        self.assertEqual([c.kwargs["color"] for c in calls], ["red", "blue"])
+
+    def test_new_catalog_is_uploaded(self):
+        self.impl.overlayFootprints("catalog")
+        self.impl.overlayFootprints("other catalog")
+        self.assertEqual(self.impl._client.upload_data.call_count, 2)
+
+    def test_stale_server_file_is_uploaded_again(self):
+        self.impl.overlayFootprints("catalog")
+        self.impl._client.overlay_footprints.side_effect = [{"success": False}, {"success": True}]
+        self.impl.overlayFootprints("catalog")
+        self.assertEqual(self.impl._client.upload_data.call_count, 2)
+        self.assertEqual(firefly_mod.DisplayImpl._serializeFootprints.call_count, 1)
+        self.assertEqual(self.impl._footprintCache.get("votable:catalog"), (b"catalog", "table-2"))
+
+    def test_failed_overlay_is_not_cached(self):
+        self.impl._client.overlay_footprints.return_value = {"success": False}
+        with self.assertRaisesRegex(RuntimeError, "Display of footprints failed"):
+            self.impl.overlayFootprints("catalog")
+        self.assertNotIn("votable:catalog", self.impl._footprintCache)
+
+    def test_failed_retry_forgets_table(self):
+        self.impl.overlayFootprints("catalog")
+        self.impl._client.overlay_footprints.return_value = {"success": False}
+        with self.assertRaisesRegex(RuntimeError, "Display of footprints failed"):
+            self.impl.overlayFootprints("catalog")
+        self.assertNotIn("votable:catalog", self.impl._footprintCache)
+
+
+class OverlayCatalogTest(unittest.TestCase):
+    """Catalog tables are uploaded once per content."""
+
+    def setUp(self):
+        self.impl = makeImpl(self, frame=0)
+        self.impl._client.upload_data.side_effect = ["table-1", "table-2"]
+        self.impl._client.show_table.return_value = {"success": True}
+        meta = {"CatalogCoordColumns": "x;y;ZERO_BASED"}
+        patchers = [mock.patch.object(firefly_mod, "createCatalogTable",
+                                      lambda catalog, *args: (catalog, dict(meta))),
+                    mock.patch.object(firefly_mod.DisplayImpl, "_serializeTable",
+                                      staticmethod(lambda table, tableFormat: table.encode()))]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_table_uploaded_once(self):
+        self.impl.overlayCatalog("catalog", color="red")
+        self.impl.overlayCatalog("catalog", symbol="X")
+        self.assertEqual(self.impl._client.upload_data.call_count, 1)
+        calls = self.impl._client.show_table.call_args_list
+        self.assertEqual([c.kwargs["file_on_server"] for c in calls], ["table-1", "table-1"])
+        self.assertEqual(calls[0].kwargs["meta"], {"CatalogCoordColumns": "x;y;ZERO_BASED",
+                                                   "DEFAULT_COLOR": "red"})
+        self.assertEqual(calls[1].kwargs["meta"]["DEFAULT_SYMBOL"], "X")
+        self.assertEqual(calls[1].kwargs["tbl_id"], "catalog 0")
+
+    def test_stale_server_file_is_uploaded_again(self):
+        self.impl.overlayCatalog("catalog")
+        self.impl._client.show_table.side_effect = [{"success": False}, {"success": True}]
+        self.impl.overlayCatalog("catalog")
+        self.assertEqual(self.impl._client.upload_data.call_count, 2)
+        self.assertEqual(self.impl._client.show_table.call_args.kwargs["file_on_server"], "table-2")
+
+    def test_failed_retry_raises(self):
+        self.impl.overlayCatalog("catalog")
+        self.impl._client.show_table.return_value = {"success": False}
+        with self.assertRaisesRegex(RuntimeError, "Display of catalog failed"):
+            self.impl.overlayCatalog("catalog")
+        self.assertEqual(self.impl._client.show_table.call_count, 3)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()